@@ -2,11 +2,20 @@
 #__init__.py : include here every symbol that should be exported on the package level, following the format below
 from .interface import generate_discretization, save_gdf, load_gdf
 
-from .h3_utils import generate_H3_discretization
+from .h3_utils import generate_H3_discretization, generate_H3_hierarchy, H3Hierarchy
+
+from .adjacency import Adjacency, get_adjacency, with_neighbors
+
+from .cache import DiscretizationCache
+
+from .points import assign_points, PointAssigner
 
 from .travel_times import graphhopper
 
 #from .travel_times.travel_times import set_graphhopper_key, set_googlemaps_key
-from .travel_times.graphhopper import distance_matrix_from_gdf, gen_distance_matrix, gen_distance_matrix_from_file
+from .travel_times.graphhopper import distance_matrix_from_gdf, gen_distance_matrix, gen_distance_matrix_from_file, GraphHopperClient, set_graphhopper_key
+from .travel_times.pair_cache import TravelTimeCache
+from .travel_times.googlemaps import GoogleMapsClient, set_googlemaps_key
 
-from .add_regressors import addRegressorUniformDistribution,addRegressorWeightedAverage
\ No newline at end of file
+from .add_regressors import addRegressorUniformDistribution,addRegressorWeightedAverage
+from .areal_weighting import OverlapWeights, WeightCache
\ No newline at end of file
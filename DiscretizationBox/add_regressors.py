@@ -1,10 +1,10 @@
-import os
-import pandas as pd
+import numpy as np
 import geopandas as gpd
-import numbers
-from warnings import warn
 
-def addRegressorWeightedAverage(df : gpd.GeoDataFrame, regressor_df : gpd.GeoDataFrame, discr_id_col : str = 'h3_index', regressor_columns = None) -> gpd.GeoDataFrame:
+from .areal_weighting import OverlapWeights, areal_weights, apply_weights, numeric_columns
+
+def addRegressorWeightedAverage(df : gpd.GeoDataFrame, regressor_df : gpd.GeoDataFrame, discr_id_col : str = 'h3_index', regressor_columns = None, *,
+        weights : OverlapWeights = None, cache = None, method : str = 'overlay', sub_resolution : int = None, n_jobs : int = 1, tile_size : float = None) -> gpd.GeoDataFrame:
     '''
     Apply parameters from regressor database to geographic discretization as a wieghted average of the areas of intersection.
     Parameters
@@ -12,48 +12,31 @@ def addRegressorWeightedAverage(df : gpd.GeoDataFrame, regressor_df : gpd.GeoDat
         regressor_df : gpd.GeoDataFrame - geodataframe containing the desired regressors and geometries defining geographic boundaries.
         discr_id_col : str - ID column from df
         regressor_columns : list - list of column names that should be considered
+        weights : OverlapWeights - precomputed overlap weights for the geometries of df and regressor_df. Skips the geometry work
+        cache : WeightCache or str - overlap weight cache (or its directory). Weights are reused whenever both geometry layers were seen before
+        method : str - how overlaps are measured. 'overlay' (default) intersects the polygons exactly. 'h3', for discretizations from
+            generate_H3_discretization, counts fine H3 cells instead (no polygon overlay, approximate on the regressor boundaries)
+        sub_resolution : int - resolution of the fine cells of the 'h3' method (default: the discretization's resolution + 2). Higher is more accurate and slower
+        n_jobs : int - worker processes for the 'overlay' method. Other than 1, the study area is split in tiles processed in parallel (-1 uses every core)
+        tile_size : float - side of the tiles, in CRS units. Smaller tiles bound the memory used with huge regressor polygons. See areal_weighting.tiled_intersection_areas
     Returns
         overlay_df : gpd.GeoDataFrame - geodataframe with same structure as df with new columns of applied regressors.
     '''
 
-    # merge calculating area overlays
-    overlay_df = gpd.overlay(df,regressor_df,how='intersection').rename({'geometry':'geometry_overlay'},axis=1)
-    # merge with df to get original discretization
-    overlay_df = pd.merge(
-        overlay_df,
-        df,
-        on=discr_id_col,
-        how='outer'
-    ).rename({'geometry':'geometry_discr'},axis=1)
-
-    # complete area zero for non overlay dicretizations
-    overlay_df['geometry_overlay_area'] = overlay_df['geometry_overlay'].area.copy()
-    overlay_df.loc[overlay_df['geometry_overlay'].isna(),'geometry_overlay_area'] = 0
-
-    # calculate percentage of areas on each overlay
-    overlay_df['overlay_area_percentage'] = overlay_df['geometry_overlay_area'] / overlay_df['geometry_discr'].area
+    weights, _overlaps = areal_weights(df, regressor_df, 'weighted_average', weights=weights, cache=cache,
+        method=method, sub_resolution=sub_resolution, discr_id_col=discr_id_col, n_jobs=n_jobs, tile_size=tile_size)
+    regressor_columns = numeric_columns(regressor_df, regressor_columns)
 
-    # apply regressor columns multiplying merged values with calculated percentages
-    if regressor_columns is None:
-        regressor_columns = [col for col in regressor_df.columns if not(col in ['geometry','regr_id'])]
-    for col in regressor_columns:
-        try:
-            if issubclass(overlay_df[col].dtype.type, numbers.Number):
-                overlay_df[col] *= overlay_df['overlay_area_percentage']
-            else:
-                warn('Column ' + str(col) + 'isn\'t numeric. Regressor won\'t be applied')
-        except Error:
-            warn('Column ' + str(col) + 'was ignored because an error ocurred')
-
-    #remove any columns that may have been skipped:
-    regressor_columns = [col for col in regressor_columns if col in overlay_df.columns]
-    # sum weithed partials and recover original columns
-    overlay_df = overlay_df.groupby([discr_id_col])[regressor_columns].sum()
-    overlay_df = pd.merge(df,overlay_df.reset_index(),on=discr_id_col,how='left')
+    # weighted sum of the regressors over each cell (zero for cells without overlay)
+    overlay_df = df.reset_index(drop=True)
+    values = apply_weights(weights, regressor_df[regressor_columns].to_numpy(dtype=float))
+    for k, col in enumerate(regressor_columns):
+        overlay_df[col] = values[:, k]
 
     return overlay_df
 
-def addRegressorUniformDistribution(df : gpd.GeoDataFrame, regressor_df : gpd.GeoDataFrame, discr_id_col : str = 'h3_index', regressor_columns = None) -> gpd.GeoDataFrame:
+def addRegressorUniformDistribution(df : gpd.GeoDataFrame, regressor_df : gpd.GeoDataFrame, discr_id_col : str = 'h3_index', regressor_columns = None, *,
+        weights : OverlapWeights = None, cache = None, method : str = 'overlay', sub_resolution : int = None, n_jobs : int = 1, tile_size : float = None) -> gpd.GeoDataFrame:
     '''
     Apply parameters from regressor database to geographic discretization as a uniform distribution of parameters in regressors area.
     Parameters
@@ -61,6 +44,13 @@ def addRegressorUniformDistribution(df : gpd.GeoDataFrame, regressor_df : gpd.Ge
         regressor_df : gpd.GeoDataFrame - geodataframe containing the desired regressors and geometries defining geographic boundaries.
         discr_id_col : str - discretization ID column from df
         regressor_columns : list - list of column names that should be considered
+        weights : OverlapWeights - precomputed overlap weights for the geometries of df and regressor_df. Skips the geometry work
+        cache : WeightCache or str - overlap weight cache (or its directory). Weights are reused whenever both geometry layers were seen before
+        method : str - how overlaps are measured. 'overlay' (default) intersects the polygons exactly. 'h3', for discretizations from
+            generate_H3_discretization, counts fine H3 cells instead (no polygon overlay, approximate on the regressor boundaries)
+        sub_resolution : int - resolution of the fine cells of the 'h3' method (default: the discretization's resolution + 2). Higher is more accurate and slower
+        n_jobs : int - worker processes for the 'overlay' method. Other than 1, the study area is split in tiles processed in parallel (-1 uses every core)
+        tile_size : float - side of the tiles, in CRS units. Smaller tiles bound the memory used with huge regressor polygons. See areal_weighting.tiled_intersection_areas
     Returns
         overlay_df : gpd.GeoDataFrame - geodataframe with same structure as df with new columns of applied regressors.
     '''
@@ -68,35 +58,15 @@ def addRegressorUniformDistribution(df : gpd.GeoDataFrame, regressor_df : gpd.Ge
     # create regressors ID column
     regressor_df['regr_id'] = list(range(len(regressor_df)))
 
-    # merge calculating area overlays
-    overlay_df = gpd.overlay(df,regressor_df,how='intersection').rename({'geometry':'geometry_overlay'},axis=1)
-    # merge with df to get original discretization
-    overlay_df = pd.merge(
-        overlay_df,
-        regressor_df[['regr_id','geometry']],
-        on='regr_id',
-        how='left'
-    ).rename({'geometry':'geometry_regr'},axis=1)
-
-    # calculate percentage of regressor areas on each overlay
-    overlay_df['overlay_area_percentage'] = overlay_df['geometry_overlay'].area / overlay_df['geometry_regr'].area
-
-    # apply regressor columns multiplying merged values with calculated percentages
-    if regressor_columns is None:
-        regressor_columns = [col for col in regressor_df.columns if not(col in ['geometry','regr_id'])]
-    for col in regressor_columns:
-        try:
-            if issubclass(overlay_df[col].dtype.type, numbers.Number):
-                overlay_df[col] *= overlay_df['overlay_area_percentage']
-            else:
-                warn('Column ' + str(col) + 'isn\'t numeric. Regressor won\'t be applied')
-        except:
-            warn('Column ' + str(col) + 'was ignored because an error ocurred')
+    weights, overlaps = areal_weights(df, regressor_df, 'uniform', weights=weights, cache=cache,
+        method=method, sub_resolution=sub_resolution, discr_id_col=discr_id_col, n_jobs=n_jobs, tile_size=tile_size)
+    regressor_columns = numeric_columns(regressor_df, regressor_columns)
 
-    #remove any columns that may have been skipped:
-    regressor_columns = [col for col in regressor_columns if col in overlay_df.columns]
-    # sum weithed partials and recover original columns
-    overlay_df = overlay_df.groupby([discr_id_col])[regressor_columns].sum()
-    overlay_df = pd.merge(df,overlay_df.reset_index(),on=discr_id_col,how='left')
+    # distribute each regressor over the cells proportionally to the intersection areas (NaN for cells without overlay)
+    overlay_df = df.reset_index(drop=True)
+    values = apply_weights(weights, regressor_df[regressor_columns].to_numpy(dtype=float))
+    values[~overlaps] = np.nan
+    for k, col in enumerate(regressor_columns):
+        overlay_df[col] = values[:, k]
 
     return overlay_df
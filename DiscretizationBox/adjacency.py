@@ -0,0 +1,276 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from geopandas import GeoDataFrame
+import numpy as np
+import shapely
+
+'''
+This file defines the compact adjacency structure shared by every discretization shape.
+
+Neighbors are stored in CSR (compressed sparse row) form: the neighbors of row i are indices[indptr[i]:indptr[i+1]].
+The structure is attached to the discretized GeoDataFrame (see set_adjacency / get_adjacency), and the familiar 'neighbors'
+column of lists is only built when someone asks for it (see with_neighbors).
+'''
+
+#keys used to store the adjacency, and the row index it was built for, in GeoDataFrame.attrs
+ADJACENCY_ATTR = 'adjacency'
+ADJACENCY_INDEX_ATTR = 'adjacency_index'
+
+class Adjacency:
+    '''
+    Immutable CSR adjacency between the rows of a discretization.
+
+    Attributes
+        indptr  : numpy.ndarray (int32) - row pointers, of length n + 1
+        indices : numpy.ndarray (int32) - concatenated neighbor lists, of length indptr[-1]
+    '''
+
+    def __init__(self, indptr, indices):
+        indptr = np.ascontiguousarray(indptr, dtype=np.int32)
+        indices = np.ascontiguousarray(indices, dtype=np.int32)
+        if indptr.ndim != 1 or indices.ndim != 1 or len(indptr) == 0:
+            raise ValueError("indptr and indices must be non-empty 1-d arrays")
+        if indptr[0] != 0 or indptr[-1] != len(indices) or (np.diff(indptr) < 0).any():
+            raise ValueError("indptr must start at 0, be non-decreasing and end at len(indices)")
+        n = len(indptr) - 1
+        if len(indices) and (indices.min() < 0 or indices.max() >= n):
+            raise ValueError("indices must be in range [0, {})".format(n))
+
+        #read only, so rows can be handed out as views without risking corruption
+        indptr.flags.writeable = False
+        indices.flags.writeable = False
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def from_lists(cls, neighbors):
+        '''
+            Build from a sequence of neighbor lists, one per row (the format of the 'neighbors' column)
+        '''
+        neighbors = list(neighbors)
+        lengths = np.fromiter(map(len, neighbors), dtype=np.int64, count=len(neighbors))
+        indptr = np.zeros(len(neighbors) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.fromiter((n for row in neighbors for n in row), dtype=np.int64, count=int(indptr[-1]))
+        return cls(indptr, indices)
+
+    @classmethod
+    def from_pairs(cls, sources, targets, n : int):
+        '''
+            Build from (source, target) row pairs. Pairs are grouped by source with a stable sort, so the order of the targets of each row is preserved
+        '''
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        order = np.argsort(sources, kind='stable')
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+        return cls(indptr, targets[order])
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, i):
+        '''
+            Neighbors of row i, as a read only view (no copy)
+        '''
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        if not isinstance(other, Adjacency):
+            return NotImplemented
+        return np.array_equal(self.indptr, other.indptr) and np.array_equal(self.indices, other.indices)
+
+    def __repr__(self):
+        return 'Adjacency(n={}, n_edges={})'.format(len(self), self.n_edges)
+
+    #arrays are immutable: copies (e.g. pandas propagating GeoDataFrame.attrs) can share them
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.indices)
+
+    def degree(self) -> np.ndarray:
+        '''
+            Number of neighbors of every row
+        '''
+        return np.diff(self.indptr)
+
+    def take(self, rows) -> 'Adjacency':
+        '''
+            Adjacency of a reordering of the rows: row j of the result is row rows[j] of self. rows must be a permutation of range(n)
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) != len(self) or not np.array_equal(np.sort(rows), np.arange(len(self))):
+            raise ValueError("rows must be a permutation of range({})".format(len(self)))
+        new_position = np.empty(len(self), dtype=np.int64)
+        new_position[rows] = np.arange(len(self))
+        degree = self.degree()[rows]
+        indptr = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(degree, out=indptr[1:])
+        #gather the neighbor lists of the selected rows, in their new order, and renumber the neighbors
+        gather = np.arange(indptr[-1]) - np.repeat(indptr[:-1], degree) + np.repeat(self.indptr[rows], degree)
+        return Adjacency(indptr, new_position[self.indices[gather]])
+
+    def to_lists(self) -> list:
+        '''
+            Neighbor lists of python ints, one per row (the format of the 'neighbors' column)
+        '''
+        indices = self.indices.tolist()
+        indptr = self.indptr.tolist()
+        return [indices[indptr[i]:indptr[i + 1]] for i in range(len(self))]
+
+    def to_scipy(self):
+        '''
+            Export as a scipy.sparse.csr_matrix of shape (n, n) with ones for every neighbor pair. The index arrays are shared, not copied
+        '''
+        from scipy.sparse import csr_matrix
+        data = np.ones(self.n_edges, dtype=np.int8)
+        return csr_matrix((data, self.indices, self.indptr), shape=(len(self), len(self)), copy=False)
+
+
+class RowIndex:
+    '''
+        The row index a discretization had when metadata (e.g. its adjacency) was attached to GeoDataFrame.attrs.
+        pandas propagates attrs through sort_values, iloc, reindex, etc., so the metadata is only valid while gdf.index still matches
+    '''
+    def __init__(self, index):
+        self.index = index
+
+    def matches(self, gdf) -> bool:
+        return self.index.equals(gdf.index)
+
+    def positions(self, gdf):
+        '''
+            Position at attach time of every current row of gdf, if its rows are a reordering of the original ones. None otherwise
+        '''
+        if len(gdf.index) != len(self.index) or not (self.index.is_unique and gdf.index.is_unique):
+            return None
+        positions = self.index.get_indexer(gdf.index)
+        return None if (positions < 0).any() else positions
+
+    #pandas compares attrs with == when combining frames
+    def __eq__(self, other):
+        if not isinstance(other, RowIndex):
+            return NotImplemented
+        return self.index.equals(other.index)
+
+    #pandas.Index is immutable, so copies of a GeoDataFrame (which deep copy attrs) can share it
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def set_adjacency(gdf : GeoDataFrame, adjacency : Adjacency) -> GeoDataFrame:
+    '''
+        Attach adjacency to gdf (in place) and return gdf. Any stale 'neighbors' column is dropped, as it would be out of sync.
+        The current gdf.index is recorded with it, so reordered frames are detected by get_adjacency
+    '''
+    if len(adjacency) != len(gdf):
+        raise ValueError("adjacency has {} rows but the GeoDataFrame has {}".format(len(adjacency), len(gdf)))
+    if 'neighbors' in gdf.columns:
+        gdf.drop(columns=['neighbors'], inplace=True)
+    gdf.attrs[ADJACENCY_ATTR] = adjacency
+    gdf.attrs[ADJACENCY_INDEX_ATTR] = RowIndex(gdf.index)
+    return gdf
+
+def get_adjacency(gdf : GeoDataFrame) -> Adjacency:
+    '''
+        Return the adjacency of a familiar gdf, numbered by the current row positions (frames reordered after generation, e.g. by sort_values, are renumbered).
+        GeoDataFrames that only have a 'neighbors' column of lists are also accepted
+    '''
+    adjacency = gdf.attrs.get(ADJACENCY_ATTR)
+    if adjacency is None:
+        if 'neighbors' not in gdf.columns:
+            raise KeyError("GeoDataFrame has neither an attached adjacency nor a 'neighbors' column")
+        return Adjacency.from_lists(gdf['neighbors'])
+    if len(adjacency) != len(gdf):
+        #pandas propagates attrs through row selections, which invalidates the row numbering
+        raise ValueError("the attached adjacency has {} rows but the GeoDataFrame has {}. Was it filtered after being generated?".format(len(adjacency), len(gdf)))
+    rows = gdf.attrs.get(ADJACENCY_INDEX_ATTR)
+    if rows is None or rows.matches(gdf):
+        return adjacency
+    #rows were reordered (e.g. sort_values): renumber the neighbors to the current row positions
+    positions = rows.positions(gdf)
+    if positions is None:
+        raise ValueError("the GeoDataFrame index no longer matches the one the adjacency was attached with, so its rows cannot be matched. "
+                         "Were rows relabeled (e.g. reset_index) after being reordered? Call set_adjacency again with the right adjacency")
+    return adjacency.take(positions)
+
+def with_neighbors(gdf : GeoDataFrame) -> GeoDataFrame:
+    '''
+        Fill the 'neighbors' column (lists of row indexes) from the attached adjacency, in place, and return gdf
+    '''
+    if 'neighbors' not in gdf.columns:
+        gdf['neighbors'] = get_adjacency(gdf).to_lists()
+    return gdf
+
+
+#geometries and spatial index of the worker processes used by adjacency_from_geometries
+_worker_geometries = None
+_worker_tree = None
+
+def _init_touching_worker(wkb):
+    global _worker_geometries, _worker_tree
+    _worker_geometries = shapely.from_wkb(wkb)
+    shapely.prepare(_worker_geometries)
+    _worker_tree = shapely.STRtree(_worker_geometries)
+
+def _touching_pairs(rows, predicate, distance, geometries = None, tree = None):
+    if geometries is None:
+        geometries, tree = _worker_geometries, _worker_tree
+    #only pairs whose bounding boxes overlap are tested, using the prepared query geometries
+    if predicate == 'dwithin':
+        sources, targets = tree.query(geometries[rows], predicate='dwithin', distance=distance)
+    else:
+        sources, targets = tree.query(geometries[rows], predicate=predicate)
+    sources = rows[sources]
+    not_self = sources != targets
+    return sources[not_self], targets[not_self]
+
+def adjacency_from_geometries(geometries, *, tolerance : float = 0.0, n_jobs : int = 1, chunk_size : int = 10000) -> Adjacency:
+    '''
+    Compute the adjacency between arbitrary geometries (e.g. census tracts) using a spatial index, so only pairs with overlapping bounding boxes are tested.
+
+    Arguments:
+        geometries : (GeoSeries, array of shapely geometries) - the shapes. Row i of the result refers to the i-th geometry
+    Keyword only arguments:
+        tolerance : (float) - snapping tolerance, in the units of the geometries' CRS. With 0 (default), two shapes are neighbors if they touch
+            (share boundary but no interior). With a positive value, two shapes are neighbors if they are within that distance of each other,
+            so shared edges with small numerical gaps or overlaps are still detected
+        n_jobs : (int) - number of worker processes, each querying a chunk of the geometries. 1 (default) runs serially, -1 or None uses every core
+        chunk_size : (int) - number of geometries queried per task when running in parallel
+    Returns:
+        (Adjacency) - neighbors of every geometry, sorted by row index
+    '''
+    geometries = np.asarray(geometries, dtype=object)
+    if tolerance < 0:
+        raise ValueError("tolerance must be non-negative. Got {}".format(tolerance))
+    predicate = 'dwithin' if tolerance > 0 else 'touches'
+    n = len(geometries)
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+
+    chunks = [np.arange(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+    if n_jobs == 1 or len(chunks) <= 1:
+        shapely.prepare(geometries)
+        tree = shapely.STRtree(geometries)
+        results = [_touching_pairs(rows, predicate, tolerance, geometries, tree) for rows in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_touching_worker, initargs=(shapely.to_wkb(geometries),)) as executor:
+            results = list(executor.map(_touching_pairs, chunks, [predicate] * len(chunks), [tolerance] * len(chunks)))
+
+    sources = np.concatenate([r[0] for r in results]) if results else np.zeros(0, dtype=np.int64)
+    targets = np.concatenate([r[1] for r in results]) if results else np.zeros(0, dtype=np.int64)
+    order = np.lexsort((targets, sources))
+    return Adjacency.from_pairs(sources[order], targets[order], n)
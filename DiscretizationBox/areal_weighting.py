@@ -0,0 +1,463 @@
+import numbers
+import os
+import uuid
+from warnings import warn
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from .cache import geometry_hash
+
+'''
+This file defines the areal weighting engine behind add_regressors.
+
+Instead of a full overlay, candidate (cell, regressor) pairs are found with an STRtree and intersection areas are computed in bulk,
+only for pairs that actually overlap. Cells fully inside a regressor polygon skip the intersection altogether. The areas form a sparse
+cell x regressor matrix, and applying every numeric regressor column is then one sparse matrix product.
+
+The areas only depend on the geometries of both layers, so they can be kept (OverlapWeights) or persisted (WeightCache) and reused
+for every regressor layer sharing the same geometries.
+'''
+
+def intersection_areas(cells, regions):
+    '''
+        Sparse matrix of intersection areas between two layers of polygons.
+
+        Arguments:
+            cells : (GeoSeries, array of shapely geometries) - the discretization cells
+            regions : (GeoSeries, array of shapely geometries) - the regressor polygons
+        Returns:
+            (scipy.sparse.csr_matrix) - matrix of shape (len(cells), len(regions)) where [i,j] is the area of cells[i] & regions[j].
+                Only pairs with a positive intersection area are stored
+    '''
+    from scipy.sparse import csr_matrix
+    cells = np.asarray(cells, dtype=object)
+    regions = np.asarray(regions, dtype=object)
+    shape = (len(cells), len(regions))
+    if len(cells) == 0 or len(regions) == 0:
+        return csr_matrix(shape)
+
+    tree = shapely.STRtree(regions)
+    cell_index, region_index = tree.query(cells, predicate='intersects')
+
+    shapely.prepare(regions)
+    areas = np.empty(len(cell_index))
+    #cells fully inside a regressor polygon: the intersection is the cell itself
+    inside = shapely.contains(regions[region_index], cells[cell_index])
+    areas[inside] = shapely.area(cells[cell_index[inside]])
+    partial = ~inside
+    areas[partial] = shapely.area(shapely.intersection(cells[cell_index[partial]], regions[region_index[partial]]))
+
+    positive = areas > 0 #pairs only touching along an edge or corner
+    return csr_matrix((areas[positive], (cell_index[positive], region_index[positive])), shape=shape)
+
+def _tile_areas(cells_wkb, regions_wkb):
+    '''
+        (cell, region, area) triplets of one tile, positions relative to the tile. Runs inside worker processes
+    '''
+    areas = intersection_areas(shapely.from_wkb(cells_wkb), shapely.from_wkb(regions_wkb)).tocoo()
+    return areas.row, areas.col, areas.data
+
+def _tiles(cells, regions, tile_size, n_tiles):
+    '''
+        Split the work of intersection_areas in tiles. Each cell belongs to the tile containing its centroid (so cells are never counted twice),
+        and every regressor polygon is clipped to the bounding box of the cells of the tile, which keeps every intersection with them intact.
+
+        Yields (cell positions, region positions, cells WKB, clipped regions WKB)
+    '''
+    centroids = shapely.get_coordinates(shapely.centroid(cells))
+    minx, miny = centroids.min(axis=0)
+    maxx, maxy = centroids.max(axis=0)
+    width, height = max(maxx - minx, 1e-12), max(maxy - miny, 1e-12)
+    if tile_size is None:
+        nx = max(int(round(np.sqrt(n_tiles * width / height))), 1)
+        ny = max(int(round(n_tiles / nx)), 1)
+    else:
+        nx, ny = max(int(np.ceil(width / tile_size)), 1), max(int(np.ceil(height / tile_size)), 1)
+    ix = np.minimum(((centroids[:, 0] - minx) / width * nx).astype(np.int64), nx - 1)
+    iy = np.minimum(((centroids[:, 1] - miny) / height * ny).astype(np.int64), ny - 1)
+    tile_of = iy * nx + ix
+
+    order = np.argsort(tile_of, kind='stable')
+    bounds = np.flatnonzero(np.diff(tile_of[order])) + 1
+    tree = shapely.STRtree(regions)
+    for tile_cells in np.split(order, bounds):
+        extent = shapely.box(*shapely.total_bounds(cells[tile_cells]))
+        tile_regions = tree.query(extent, predicate='intersects')
+        if len(tile_regions) == 0:
+            continue
+        clipped = shapely.intersection(regions[tile_regions], extent)
+        yield tile_cells, tile_regions, shapely.to_wkb(cells[tile_cells]), shapely.to_wkb(clipped)
+
+def tiled_intersection_areas(cells, regions, *, n_jobs : int = -1, tile_size : float = None, tiles_per_job : int = 4):
+    '''
+        intersection_areas computed tile by tile, for huge regressor layers.
+
+        The study area is split in tiles, both layers are clipped to each tile and tiles are processed in a process pool. Only the clipped pieces
+        of the (possibly huge) regressor polygons are sent to the workers, and at most 2 * n_jobs tiles are in flight at any time, so memory stays bounded.
+        Each cell is handled by exactly one tile, so the result is the same matrix as intersection_areas (up to floating point rounding).
+
+        Arguments:
+            cells, regions - see intersection_areas
+            n_jobs : (int) - number of worker processes. 1 processes the tiles serially, -1 or None uses every core
+            tile_size : (float) - tile side, in the units of the CRS (degrees for EPSG:4326). Defaults to a grid of about n_jobs * tiles_per_job tiles
+            tiles_per_job : (int) - approximate number of tiles per worker when tile_size is not given
+        Returns:
+            (scipy.sparse.csr_matrix) - see intersection_areas
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    from collections import deque
+    from scipy.sparse import csr_matrix
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    cells = np.asarray(cells, dtype=object)
+    regions = np.asarray(regions, dtype=object)
+    shape = (len(cells), len(regions))
+    if len(cells) == 0 or len(regions) == 0:
+        return csr_matrix(shape)
+
+    rows, cols, data = [], [], []
+    def collect(tile_cells, tile_regions, result):
+        tile_rows, tile_cols, tile_areas = result
+        rows.append(tile_cells[tile_rows])
+        cols.append(tile_regions[tile_cols])
+        data.append(tile_areas)
+
+    tiles = _tiles(cells, regions, tile_size, n_jobs * tiles_per_job)
+    if n_jobs == 1:
+        for tile_cells, tile_regions, cells_wkb, regions_wkb in tiles:
+            collect(tile_cells, tile_regions, _tile_areas(cells_wkb, regions_wkb))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            pending = deque()
+            for tile_cells, tile_regions, cells_wkb, regions_wkb in tiles:
+                pending.append((tile_cells, tile_regions, executor.submit(_tile_areas, cells_wkb, regions_wkb)))
+                #bound the number of clipped tiles held in memory
+                while len(pending) >= 2 * n_jobs:
+                    tile_cells, tile_regions, future = pending.popleft()
+                    collect(tile_cells, tile_regions, future.result())
+            while pending:
+                tile_cells, tile_regions, future = pending.popleft()
+                collect(tile_cells, tile_regions, future.result())
+
+    if not data:
+        return csr_matrix(shape)
+    return csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))), shape=shape)
+
+def numeric_columns(regressor_df : gpd.GeoDataFrame, regressor_columns = None, exclude = ('geometry', 'regr_id')) -> list:
+    '''
+        The regressor columns that can be applied (numeric ones). Other requested columns are skipped with a warning
+    '''
+    if regressor_columns is None:
+        regressor_columns = [col for col in regressor_df.columns if col not in exclude]
+    columns = []
+    for col in regressor_columns:
+        if col not in regressor_df.columns:
+            warn('Column ' + str(col) + ' was ignored because it is not in regressor_df')
+        elif issubclass(regressor_df[col].dtype.type, numbers.Number):
+            columns.append(col)
+        else:
+            warn('Column ' + str(col) + ' isn\'t numeric. Regressor won\'t be applied')
+    return columns
+
+def apply_weights(weights, values : np.ndarray) -> np.ndarray:
+    '''
+        weights @ values, with missing (NaN) values counting as zero
+    '''
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0.0)
+    return np.asarray(weights @ values)
+
+def _check_crs(df, regressor_df):
+    if df.crs is not None and regressor_df.crs is not None and not df.crs.equals(regressor_df.crs):
+        warn('CRS mismatch between df ({}) and regressor_df ({}). Areas are computed as if they matched'.format(df.crs, regressor_df.crs))
+
+#bump whenever the stored weights change, so stale entries are not reused
+WEIGHTS_VERSION = 1
+
+#scale (around the cell center) of an H3 hexagon that contains the centers of all its descendants, with a safety margin. Measured: ~1.15
+CHILDREN_SCALE = 1.25
+
+class OverlapWeights:
+    '''
+    Intersection areas between a discretization and a regressor geometry layer, reusable across regressor calls.
+
+    Only geometries matter: yearly versions of a layer, or any other attribute values on the same geometries, reuse the same OverlapWeights.
+
+    Attributes
+        areas : scipy.sparse.csr_matrix - [i,j] is the area of cell i & regressor j (see intersection_areas)
+        cell_areas, region_areas : numpy.ndarray - areas of the cells and of the regressor polygons
+        cells_hash, regions_hash : str - geometry_hash of both layers, used to check the weights are applied to the right geometries
+        method : str - how the areas were measured: 'overlay' (exact intersections, see compute) or 'h3-<sub resolution>' (see from_h3)
+    '''
+
+    def __init__(self, areas, cell_areas, region_areas, cells_hash : str, regions_hash : str, method : str = 'overlay'):
+        self.areas = areas.tocsr()
+        self.cell_areas = np.asarray(cell_areas, dtype=np.float64)
+        self.region_areas = np.asarray(region_areas, dtype=np.float64)
+        self.cells_hash = cells_hash
+        self.regions_hash = regions_hash
+        self.method = method
+
+    @classmethod
+    def compute(cls, df : gpd.GeoDataFrame, regressor_df : gpd.GeoDataFrame, n_jobs : int = 1, tile_size : float = None):
+        '''
+            Exact weights of df and regressor_df. With n_jobs != 1 or a tile_size, the areas are computed by tiles (see tiled_intersection_areas)
+        '''
+        _check_crs(df, regressor_df)
+        cells = np.asarray(df.geometry, dtype=object)
+        regions = np.asarray(regressor_df.geometry, dtype=object)
+        if n_jobs == 1 and tile_size is None:
+            areas = intersection_areas(cells, regions)
+        else:
+            areas = tiled_intersection_areas(cells, regions, n_jobs=n_jobs, tile_size=tile_size)
+        return cls(areas, shapely.area(cells), shapely.area(regions), geometry_hash(cells), geometry_hash(regions))
+
+    @classmethod
+    def from_h3(cls, df : gpd.GeoDataFrame, regressor_df : gpd.GeoDataFrame, sub_resolution : int = None, discr_id_col : str = 'h3_index'):
+        '''
+            Approximate weights of an H3 discretization, without any polygon overlay.
+
+            Every discretization cell is split into its children at sub_resolution (fine cells), and each fine cell is assigned to the
+            regressor polygons containing its center (the same rule h3.polyfill uses). Areas are then measured in fine cells: a cell whose
+            7 ** (sub_resolution - resolution) children have m centers inside a regressor is a fraction m / 7 ** (sub_resolution - resolution) covered.
+            Regressor polygons reaching outside the discretization are polyfilled to count their fine cells outside of it, and polygons too
+            small to contain a fine cell center are represented by the fine cell of their representative point, so they are never dropped.
+
+            Arguments:
+                df : (GeoDataFrame) - a discretization from generate_H3_discretization
+                regressor_df : (GeoDataFrame) - the regressor polygons
+                sub_resolution : (int) - resolution of the fine cells. Each extra level multiplies the work by 7 and divides the
+                    boundary error by about sqrt(7). Defaults to the discretization's resolution + 2
+                discr_id_col : (string) - column of df holding the H3 indexes
+        '''
+        import h3
+        import h3.api.numpy_int as h3_int
+        import pandas as pd
+        from scipy.sparse import coo_matrix
+        from .h3_utils import h3_polyfill_array, h3_to_parent_array
+
+        hex_indexes = df[discr_id_col].tolist()
+        if len(hex_indexes) == 0:
+            raise ValueError('df is empty')
+        resolution = h3.h3_get_resolution(hex_indexes[0])
+        if sub_resolution is None:
+            sub_resolution = min(resolution + 2, 15)
+        if sub_resolution <= resolution or sub_resolution > 15:
+            raise ValueError('sub_resolution must be in range [{}, 15]. Got {}'.format(resolution + 1, sub_resolution))
+        cells = np.fromiter((h3.string_to_h3(hex) for hex in hex_indexes), dtype=np.uint64, count=len(hex_indexes))
+        row_of = pd.Index(cells)
+
+        regions = regressor_df.geometry
+        if regions.crs is not None and not regions.crs.equals('EPSG:4326'):
+            regions = regions.to_crs(epsg=4326)
+        regions = np.asarray(regions, dtype=object)
+
+        shapely.prepare(regions)
+        hexagons = np.asarray(df.geometry, dtype=object)
+        children = [h3_int.h3_to_children(int(cell), sub_resolution) for cell in cells]
+        cell_areas = np.fromiter(map(len, children), dtype=np.int64, count=len(children)).astype(np.float64)
+
+        #the centers of the descendants of an H3 cell lie within its hexagon scaled by ~1.15 around its center. Regressors containing
+        #the scaled hexagon contain every fine cell center, so only cells crossing a regressor boundary need their fine cells tested
+        coords, ring_index = shapely.get_coordinates(shapely.get_exterior_ring(hexagons), return_index=True)
+        centroids = shapely.get_coordinates(shapely.centroid(hexagons))[ring_index]
+        scaled = shapely.polygons(shapely.linearrings(centroids + CHILDREN_SCALE * (coords - centroids), indices=ring_index))
+        cell_index, region_index = shapely.STRtree(regions).query(scaled, predicate='intersects')
+        full = shapely.contains(regions[region_index], scaled[cell_index])
+        rows, cols, counts = [cell_index[full]], [region_index[full]], [cell_areas[cell_index[full]]]
+
+        #boundary cells: point in polygon test of each fine cell center against each candidate regressor
+        boundary_cells, boundary_regions = cell_index[~full], region_index[~full]
+        tested = np.unique(boundary_cells)
+        centers = {cell : np.array([h3_int.h3_to_geo(child) for child in children[cell]], dtype=np.float64) for cell in tested.tolist()}
+        n_fine = cell_areas[boundary_cells].astype(np.int64)
+        if n_fine.sum():
+            fine_centers = np.concatenate([centers[cell] for cell in boundary_cells.tolist()])
+            inside = shapely.contains_xy(np.repeat(regions[boundary_regions], n_fine), fine_centers[:, 1], fine_centers[:, 0])
+            pair = np.repeat(np.arange(len(boundary_cells)), n_fine)
+            hits = np.bincount(pair[inside], minlength=len(boundary_cells))
+            rows.append(boundary_cells), cols.append(boundary_regions), counts.append(hits.astype(np.float64))
+        rows, cols, counts = np.concatenate(rows), np.concatenate(cols), np.concatenate(counts)
+        region_areas = np.bincount(cols, weights=counts, minlength=len(regions))
+
+        #regressors reaching outside the discretization also have fine cells outside of it, count them with polyfill
+        coverage = shapely.coverage_union_all(hexagons)
+        shapely.prepare(coverage)
+        valid = ~shapely.is_missing(regions) & ~shapely.is_empty(regions)
+        for j in np.flatnonzero(valid & ~shapely.covers(coverage, regions)):
+            region_areas[j] = max(region_areas[j], len(h3_polyfill_array(regions[j], sub_resolution)))
+
+        #regressors without any fine cell center: use the fine cell of their representative point
+        tiny = np.flatnonzero(valid & (region_areas == 0))
+        if len(tiny):
+            representative = shapely.point_on_surface(regions[tiny])
+            fine = np.array([h3_int.geo_to_h3(point.y, point.x, sub_resolution) for point in representative], dtype=np.uint64)
+            tiny_rows = row_of.get_indexer(h3_to_parent_array(fine, resolution))
+            inside = tiny_rows >= 0
+            rows, cols, counts = np.concatenate([rows, tiny_rows[inside]]), np.concatenate([cols, tiny[inside]]), np.concatenate([counts, np.ones(inside.sum())])
+            region_areas[tiny] = 1
+
+        positive = counts > 0
+        areas = coo_matrix((counts[positive], (rows[positive], cols[positive])), shape=(len(cells), len(regions))).tocsr()
+        areas.sum_duplicates()
+        return cls(areas, cell_areas, region_areas, geometry_hash(df.geometry), geometry_hash(regressor_df.geometry), method='h3-{}'.format(sub_resolution))
+
+    def __repr__(self):
+        return 'OverlapWeights(cells={}, regions={}, overlaps={}, method={})'.format(self.areas.shape[0], self.areas.shape[1], self.areas.nnz, self.method)
+
+    def matches(self, df : gpd.GeoDataFrame, regressor_df : gpd.GeoDataFrame) -> bool:
+        '''
+            Whether these weights were computed for the geometries of df and regressor_df
+        '''
+        return (self.areas.shape == (len(df), len(regressor_df)) and geometry_hash(df.geometry) == self.cells_hash
+            and geometry_hash(regressor_df.geometry) == self.regions_hash)
+
+    def weights(self, how : str):
+        '''
+            Weight matrix (cells x regressors) of one of the add_regressors distributions.
+
+            Arguments:
+                how : (string) - 'weighted_average' : [i,j] is the fraction of cell i covered by regressor j
+                                 'uniform' : [i,j] is the fraction of regressor j inside cell i
+            Returns:
+                (scipy.sparse.csr_matrix, numpy.ndarray) - the weights, and a boolean mask of the cells overlapping at least one regressor
+        '''
+        from scipy.sparse import diags
+        if how == 'weighted_average':
+            weights = diags(1.0 / np.where(self.cell_areas > 0, self.cell_areas, np.inf)) @ self.areas
+        elif how == 'uniform':
+            weights = self.areas @ diags(1.0 / np.where(self.region_areas > 0, self.region_areas, np.inf))
+        else:
+            raise ValueError("how must be 'weighted_average' or 'uniform'. Got " + str(how))
+        return weights.tocsr(), np.diff(self.areas.indptr) > 0
+
+    def save(self, path):
+        '''
+            Write the weights to path (.npz)
+        '''
+        np.savez(path, data=self.areas.data, indices=self.areas.indices, indptr=self.areas.indptr, shape=np.array(self.areas.shape),
+            cell_areas=self.cell_areas, region_areas=self.region_areas, hashes=np.array([self.cells_hash, self.regions_hash]), method=np.array(self.method))
+
+    @classmethod
+    def load(cls, path):
+        from scipy.sparse import csr_matrix
+        with np.load(path) as f:
+            areas = csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            cells_hash, regions_hash = (str(h) for h in f['hashes'])
+            return cls(areas, f['cell_areas'], f['region_areas'], cells_hash, regions_hash, str(f['method']))
+
+class WeightCache:
+    '''
+    Local directory of OverlapWeights, keyed by the geometry hashes of both layers.
+
+    Usage:
+        cache = WeightCache('weights')
+        cache.precompute(hexagons, land_use) #once
+        addRegressorWeightedAverage(hexagons, land_use_2020, cache=cache) #no geometry work if land_use_2020 has the same geometries
+
+    Attributes
+        directory : str - where entries are stored
+        hits, misses : int - statistics of this cache object
+    '''
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def _key(cells_hash : str, regions_hash : str, method : str) -> str:
+        return '{}_{}_{}_v{}'.format(cells_hash, regions_hash, method, WEIGHTS_VERSION)
+
+    def key(self, df : gpd.GeoDataFrame, regressor_df : gpd.GeoDataFrame, method : str = 'overlay') -> str:
+        return self._key(geometry_hash(df.geometry), geometry_hash(regressor_df.geometry), method)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, df : gpd.GeoDataFrame, regressor_df : gpd.GeoDataFrame, method : str = 'overlay'):
+        '''
+            Return the cached OverlapWeights of df and regressor_df (measured with method, see OverlapWeights), or None if there is no such entry
+        '''
+        try:
+            weights = OverlapWeights.load(self._path(self.key(df, regressor_df, method)))
+        except (FileNotFoundError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return weights
+
+    def put(self, weights : OverlapWeights):
+        path = self._path(self._key(weights.cells_hash, weights.regions_hash, weights.method))
+        #write to a temporary file and rename, so concurrent readers never see partial entries
+        tmp = '{}.{}.tmp.npz'.format(path, uuid.uuid4().hex)
+        weights.save(tmp)
+        os.replace(tmp, path)
+
+    def precompute(self, df : gpd.GeoDataFrame, regressor_df : gpd.GeoDataFrame, method : str = 'overlay', **kwargs) -> OverlapWeights:
+        '''
+            Return the OverlapWeights of df and regressor_df, computing and storing them if they are not cached yet. See compute_weights
+        '''
+        weights = self.get(df, regressor_df, method_tag(df, method, kwargs.get('sub_resolution'), kwargs.get('discr_id_col', 'h3_index')))
+        if weights is None:
+            weights = compute_weights(df, regressor_df, method, **kwargs)
+            self.put(weights)
+        return weights
+
+def method_tag(df : gpd.GeoDataFrame, method : str = 'overlay', sub_resolution : int = None, discr_id_col : str = 'h3_index') -> str:
+    '''
+        OverlapWeights.method of the weights compute_weights would return
+    '''
+    if method == 'overlay':
+        return 'overlay'
+    if method == 'h3':
+        if sub_resolution is None:
+            import h3
+            sub_resolution = min(h3.h3_get_resolution(df[discr_id_col].iloc[0]) + 2, 15)
+        return 'h3-{}'.format(sub_resolution)
+    raise ValueError("method must be 'overlay' or 'h3'. Got " + str(method))
+
+def compute_weights(df : gpd.GeoDataFrame, regressor_df : gpd.GeoDataFrame, method : str = 'overlay', sub_resolution : int = None,
+        discr_id_col : str = 'h3_index', n_jobs : int = 1, tile_size : float = None) -> OverlapWeights:
+    '''
+        OverlapWeights of df and regressor_df.
+
+        Arguments:
+            method : (string) - 'overlay' : exact intersection areas (see OverlapWeights.compute)
+                                'h3' : fine H3 cell counts, for H3 discretizations (see OverlapWeights.from_h3)
+            sub_resolution, discr_id_col - options of the 'h3' method (ignored by 'overlay')
+            n_jobs, tile_size - options of the 'overlay' method (ignored by 'h3'): process the study area by tiles, in parallel
+    '''
+    if method == 'overlay':
+        return OverlapWeights.compute(df, regressor_df, n_jobs, tile_size)
+    if method == 'h3':
+        return OverlapWeights.from_h3(df, regressor_df, sub_resolution, discr_id_col)
+    raise ValueError("method must be 'overlay' or 'h3'. Got " + str(method))
+
+def as_weight_cache(cache) -> WeightCache:
+    '''
+        Accept either a WeightCache or a directory path
+    '''
+    if isinstance(cache, WeightCache):
+        return cache
+    return WeightCache(cache)
+
+def areal_weights(df : gpd.GeoDataFrame, regressor_df : gpd.GeoDataFrame, how : str, *, weights : OverlapWeights = None, cache = None,
+        method : str = 'overlay', **kwargs):
+    '''
+        Weight matrix of one of the add_regressors distributions (see OverlapWeights.weights).
+
+        Arguments:
+            weights : (OverlapWeights) - precomputed weights for these geometries. Checked against them, then used as is
+            cache : (WeightCache, string) - weight cache (or its directory). The weights are computed and stored on a miss
+            method, kwargs - how the weights are computed when they are not given, see compute_weights
+    '''
+    if weights is not None:
+        if not weights.matches(df, regressor_df):
+            raise ValueError('weights were computed for other geometries than df and regressor_df')
+    elif cache is not None:
+        weights = as_weight_cache(cache).precompute(df, regressor_df, method, **kwargs)
+    else:
+        weights = compute_weights(df, regressor_df, method, **kwargs)
+    return weights.weights(how)
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import uuid
+from geopandas import GeoDataFrame
+import numpy as np
+import pandas as pd
+import shapely
+
+from .parquet_io import read_parquet, write_parquet
+
+'''
+This file defines an opt-in, content-addressed on-disk cache for discretizations (see generate_discretization's cache argument).
+
+Entries are keyed by a hash of the input geometries (WKB), attributes, CRS and parameters, and stored as GeoParquet files
+(see parquet_io.py), so loading an entry needs no recomputation and no reprojection.
+'''
+
+#bump whenever the discretization output changes, so stale entries are not reused
+CACHE_VERSION = 3
+
+def geometry_hash(geometries) -> str:
+    '''
+        sha256 hex digest of a sequence of shapely geometries, computed over their WKB
+    '''
+    digest = hashlib.sha256()
+    wkb = shapely.to_wkb(np.asarray(geometries, dtype=object))
+    digest.update(np.fromiter(map(len, wkb), dtype=np.int64, count=len(wkb)).tobytes())
+    for item in wkb:
+        digest.update(item)
+    return digest.hexdigest()
+
+def gdf_hash(gdf : GeoDataFrame) -> str:
+    '''
+        sha256 hex digest of a GeoDataFrame: geometries, CRS, index, column names and attribute values
+    '''
+    digest = hashlib.sha256()
+    digest.update(geometry_hash(gdf.geometry).encode())
+    digest.update(str(gdf.crs.to_wkt() if gdf.crs is not None else None).encode())
+    #the index is part of the result when the input rows are kept as they are (shape = 'none')
+    digest.update(json.dumps([str(name) for name in gdf.index.names] + [str(gdf.index.dtype)]).encode())
+    digest.update(pd.util.hash_pandas_object(gdf.index).values.tobytes())
+    attributes = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+    digest.update(json.dumps([str(c) for c in attributes.columns]).encode())
+    if len(attributes.columns):
+        digest.update(pd.util.hash_pandas_object(attributes.astype(str), index=False).values.tobytes())
+    return digest.hexdigest()
+
+class DiscretizationCache:
+    '''
+    Local directory of cached discretizations with size based LRU eviction.
+
+    Attributes
+        directory : str - where entries are stored
+        max_bytes : int - once the entries take more than this, the least recently used ones are evicted
+        hits, misses, evictions : int - statistics of this cache object. See stats()
+    '''
+
+    def __init__(self, directory, max_bytes : int = 2 * 1024 ** 3):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, gdf : GeoDataFrame, **params) -> str:
+        '''
+            Cache key of discretizing gdf with the given parameters
+        '''
+        digest = hashlib.sha256()
+        digest.update(gdf_hash(gdf).encode())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        digest.update(str(CACHE_VERSION).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.parquet')
+
+    def get(self, key : str):
+        '''
+            Return the cached GeoDataFrame for key, or None if there is no such entry
+        '''
+        path = self._path(key)
+        try:
+            gdf = read_parquet(path)
+        except (FileNotFoundError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        #mark as recently used
+        os.utime(path)
+        return gdf
+
+    def put(self, key : str, gdf : GeoDataFrame):
+        '''
+            Store gdf under key, then evict least recently used entries if the cache grew past max_bytes
+        '''
+        path = self._path(key)
+        #write to a temporary file and rename, so concurrent readers never see partial entries
+        tmp = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        write_parquet(gdf, tmp)
+        os.replace(tmp, path)
+        self.evict()
+
+    def entries(self) -> list:
+        '''
+            (key, size in bytes, last use time) of every entry, least recently used first
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.parquet'):
+                continue
+            key = name[:-len('.parquet')]
+            try:
+                size = os.path.getsize(self._path(key))
+                last_used = os.path.getmtime(self._path(key))
+            except OSError:
+                continue
+            entries.append((key, size, last_used))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def size(self) -> int:
+        return sum(size for _key, size, _last_used in self.entries())
+
+    def evict(self):
+        '''
+            Remove least recently used entries until the cache fits in max_bytes
+        '''
+        entries = self.entries()
+        total = sum(size for _key, size, _last_used in entries)
+        for key, size, _last_used in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        for key, _size, _last_used in self.entries():
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        '''
+            Hit / miss statistics of this cache object, plus the current number and size of entries
+        '''
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions, 'entries': len(entries), 'bytes': sum(size for _key, size, _last_used in entries)}
+
+def as_cache(cache) -> DiscretizationCache:
+    '''
+        Accept either a DiscretizationCache or a directory path
+    '''
+    if isinstance(cache, DiscretizationCache):
+        return cache
+    return DiscretizationCache(cache)
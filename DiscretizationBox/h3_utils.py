@@ -1,40 +1,186 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
 from geopandas import GeoDataFrame
 import geopandas
 import h3
+import h3.api.numpy_int as h3_int
+import numpy as np
+import pandas as pd
+import shapely
+from itertools import chain
 from shapely.geometry import Polygon, Point, MultiPolygon
 from warnings import warn
 
-#helper function: gets geojson like (H3 expects as input) from shapely polygon
-def polygon_to_geojson(polygon : Polygon):
-    temp_coord_list = list(polygon.exterior.coords)
-    #we have to manually convert from a list of list of tuples to a list of list of lists (and also invert lat, long ordering)
-    coords = []
-    for (long,lat) in temp_coord_list:
-        coords.append([lat,long])
+from .adjacency import Adjacency, set_adjacency
 
-    #we dont want the loop around here
-    coords.pop()
+#helper function: gets geojson like (H3 expects as input) from shapely polygon. Holes are dropped unless holes = True
+def polygon_to_geojson(polygon : Polygon, holes : bool = False):
+    rings = [polygon.exterior] + (list(polygon.interiors) if holes else [])
+    geoJson = {'type': 'Polygon', 'coordinates': [] }
+    for ring in rings:
+        temp_coord_list = list(ring.coords)
+        #we have to manually convert from a list of list of tuples to a list of list of lists (and also invert lat, long ordering)
+        coords = []
+        for (long,lat) in temp_coord_list:
+            coords.append([lat,long])
 
-    geoJson = {'type': 'Polygon', 'coordinates': [coords] }
+        #we dont want the loop around here
+        coords.pop()
+        geoJson['coordinates'].append(coords)
     return geoJson
 
+#bit layout of the integer form of H3 indexes: 4 resolution bits at offset 52, then one 3-bit digit per resolution (digit r at offset 3 * (15 - r))
+_H3_RESOLUTION_OFFSET = np.uint64(52)
+_H3_RESOLUTION_MASK = np.uint64(15) << _H3_RESOLUTION_OFFSET
 
+def h3_to_parent_array(cells : np.ndarray, resolution : int) -> np.ndarray:
+    '''
+    Vectorized h3_to_parent over the integer form of H3 indexes (see h3.string_to_h3).
 
+    Parameters
+        param cells      : numpy.ndarray - uint64 H3 indexes, all at a resolution >= resolution
+        param resolution : int           - resolution of the parents
+        return : numpy.ndarray - uint64 parent of every cell
+    '''
+    cells = np.asarray(cells, dtype=np.uint64)
+    #digits finer than the parent resolution are set to 7 (unused)
+    unused = sum(7 << (3 * (15 - r)) for r in range(resolution + 1, 16))
+    return (cells & ~_H3_RESOLUTION_MASK) | (np.uint64(resolution) << _H3_RESOLUTION_OFFSET) | np.uint64(unused)
 
-def generate_H3_discretization(gdf : GeoDataFrame, resolution : int = 7):
-    
+def h3_polyfill_array(geometry, resolution : int) -> np.ndarray:
     '''
-    Generate a hexagonal discretization of the area using Uber's H3 library, and returns a new GeoDataFrame with it. 
+    Integer H3 indexes of the cells whose centers fall inside a shapely Polygon or MultiPolygon (lat long coordinates), holes included
+    '''
+    parts = [polygon for polygon in shapely.get_parts(geometry) if polygon.geom_type == "Polygon" and not polygon.is_empty]
+    if not parts:
+        return np.zeros(0, dtype=np.uint64)
+    return np.unique(np.concatenate([np.asarray(h3_int.polyfill(polygon_to_geojson(polygon, holes=True), resolution), dtype=np.uint64) for polygon in parts]))
+
+
+
+#helper function: computes the geometry, area and neighbors of every H3 cell in hex_indexes at once
+def _h3_cells_to_columns(hex_indexes : list):
+    '''
+    Batch engine behind generate_H3_discretization. Every per-cell H3 query is done in a single pass, and everything else
+        (cell -> row lookup, polygon construction, neighbor filtering) is done with NumPy / shapely arrays, so the cost grows linearly with the number of cells.
 
     Parameters
-        param gdf        : GeoDataFrame - the original geodataframe whose boundaries will be considered to generate the discretization
-        param resolution : int          - the desired resolution level passed to the H3 library. A bigger number means smaller hexagons. Valid range [0,15]
-        return : GeoDataFrame - a new GeoDataFrame containing the H3 hexagons that approximately cover the original region 
+        param hex_indexes : list - sorted list of H3 indexes. The row of each cell in the returned columns is its position in this list
+        return : (numpy.ndarray, numpy.ndarray, Adjacency) - polygons, areas (km2) and neighbors (CSR adjacency between rows) of every cell
     '''
+    n = len(hex_indexes)
+    if n == 0:
+        return np.empty(0, dtype=object), np.empty(0, dtype=float), Adjacency(np.zeros(1), np.zeros(0))
 
-    if(resolution < 0 or resolution > 15):
-        raise ValueError("resolution must be in range [0, 15]. Got {}".format(resolution))
+    #send a warning if there is a pentagon in the study region!
+    for hex in hex_indexes:
+        if h3.h3_is_pentagon(hex):
+            warn('A H3 cell in the study region is a pentagon. See H3\'s documentation for further details.')
+
+    #cell -> row lookup, built once over the integer form of the indexes. Replaces the linear list searches
+    int_indexes = np.fromiter((h3.string_to_h3(hex) for hex in hex_indexes), dtype=np.uint64, count=n)
+    row_of = pd.Index(int_indexes)
+
+    #boundaries: h3 gives (lat,long) tuples, shapely wants (long,lat). Cells may have more than 6 vertices (distortion vertices), so rings are ragged
+    boundaries = [h3.h3_to_geo_boundary(hex) for hex in hex_indexes]
+    n_vertices = np.fromiter(map(len, boundaries), dtype=np.int64, count=n)
+    coords = np.fromiter(chain.from_iterable(chain.from_iterable(boundaries)), dtype=float, count=2 * int(n_vertices.sum()))
+    coords = coords.reshape(-1, 2)[:, ::-1]
+    rings = shapely.linearrings(coords, indices=np.repeat(np.arange(n), n_vertices))
+    polygons = shapely.polygons(rings)
+
+    pol_areas = np.fromiter((h3.cell_area(hex) for hex in hex_indexes), dtype=float, count=n) #cell area in default km2
+
+    #ring neighbors: look every ring member up at once and drop the ones outside the study region
+    hex_rings = [h3_int.hex_ring(hex, 1) for hex in int_indexes]
+    ring_sizes = np.fromiter(map(len, hex_rings), dtype=np.int64, count=n)
+    assert (ring_sizes == 6).all(), "Cell found that did not have 6 neighbors. Does the study area contain H3 pentagons? Check H3 official documentation for details"
+    ring_rows = row_of.get_indexer(np.concatenate(hex_rings)).reshape(n, 6)
+    inside = ring_rows >= 0
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(inside.sum(axis=1), out=indptr[1:])
+    neighbors = Adjacency(indptr, ring_rows[inside])
 
+    return polygons, pol_areas, neighbors
+
+
+#helper function: resolves the n_jobs convention (None or negative values mean 'every core')
+def _effective_n_jobs(n_jobs):
+    if n_jobs is None or n_jobs < 0:
+        return os.cpu_count() or 1
+    if n_jobs == 0:
+        raise ValueError("n_jobs must be a positive integer, -1 or None. Got 0")
+    return n_jobs
+
+#helper function: polyfills the pieces of one tile, keeping only the cells owned by that tile. Runs inside worker processes
+def _polyfill_tile(pieces, resolution, tile_ix, tile_iy, grid):
+    minx, miny, deltax, deltay, nx, ny = grid
+    cells = set()
+    for piece in pieces:
+        cells.update(h3.polyfill(piece, resolution))
+
+    #a cell is owned by the tile its center falls in. Tiles overlap slightly, so this is what makes the merge exact (no dropped or duplicated cells)
+    owned = []
+    for cell in cells:
+        lat, long = h3.h3_to_geo(cell)
+        ix = min(max(int((long - minx) // deltax), 0), nx - 1)
+        iy = min(max(int((lat - miny) // deltay), 0), ny - 1)
+        if ix == tile_ix and iy == tile_iy:
+            owned.append(cell)
+    return owned
+
+def parallel_polyfill(polygons : list, resolution : int, *, n_jobs : int = -1, tiles_per_job : int = 4) -> set:
+    '''
+    Polyfill a (potentially huge) region using a process pool. The bounding box of the region is split in a grid of tiles, every polygon is clipped to
+        every tile (with a small overlap) and each tile is polyfilled independently. A cell is kept only by the tile that contains its center, so the
+        merged result is the same set of cells returned by calling h3.polyfill on every polygon serially.
+
+    Parameters
+        param polygons      : list - shapely Polygons, in lat long coordinates. As in generate_H3_discretization, only the exterior rings are considered
+        param resolution    : int  - H3 resolution level. Valid range [0,15]
+        param n_jobs        : int  - number of worker processes. -1 or None uses every core
+        param tiles_per_job : int  - approximate number of tiles per worker. More tiles balance the load better, at the cost of more clipping
+        return : set - H3 indexes covering the region
+    '''
+    n_jobs = _effective_n_jobs(n_jobs)
+    polygons = [Polygon(polygon.exterior) for polygon in polygons]
+    if len(polygons) == 0:
+        return set()
+
+    #build a grid of roughly square tiles over the bounding box of the whole region
+    minx, miny, maxx, maxy = shapely.total_bounds(polygons)
+    width, height = max(maxx - minx, 1e-12), max(maxy - miny, 1e-12)
+    n_tiles = max(n_jobs * tiles_per_job, 1)
+    nx = max(int(round(np.sqrt(n_tiles * width / height))), 1)
+    ny = max(int(round(n_tiles / nx)), 1)
+    deltax, deltay = width / nx, height / ny
+    grid = (minx, miny, deltax, deltay, nx, ny)
+
+    #clip the polygons to every (slightly enlarged) tile. The overlap absorbs numerical noise from the clipping on the tile edges
+    margin_x, margin_y = 0.01 * deltax, 0.01 * deltay
+    tasks = []
+    for iy in range(ny):
+        for ix in range(nx):
+            cx, cy = minx + ix * deltax, miny + iy * deltay
+            tile = shapely.box(cx - margin_x, cy - margin_y, cx + deltax + margin_x, cy + deltay + margin_y)
+            pieces = []
+            for clipped in shapely.intersection(polygons, tile):
+                for piece in shapely.get_parts(clipped):
+                    if piece.geom_type == "Polygon" and not piece.is_empty:
+                        pieces.append(polygon_to_geojson(piece))
+            if pieces:
+                tasks.append((pieces, ix, iy))
+
+    hex_indexes = set()
+    with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+        futures = [executor.submit(_polyfill_tile, pieces, resolution, ix, iy, grid) for pieces, ix, iy in tasks]
+        for future in futures:
+            hex_indexes.update(future.result())
+    return hex_indexes
+
+
+#helper function: sorted list of the H3 indexes covering every polygon of gdf (see generate_H3_discretization)
+def _polyfill_region(gdf : GeoDataFrame, resolution : int, n_jobs : int = 1) -> list:
     #the following code assumes epsg = 4326 (lat long coordinate system) to interface with H3
     gdf = gdf.to_crs(epsg=4326) #convert coordinate system to lat long
 
@@ -42,66 +188,32 @@ def generate_H3_discretization(gdf : GeoDataFrame, resolution : int = 7):
 
     #loop through all observation in the geoseries. For every polygon there, compute using h3 the a list of h3 indexes and add it to the hex_indexes structure, used later to construct a new goodataframe
     #this procedure "flattens" the original geoseries, ie, multipolygon's are treated as a sequence of polygon without differentiating them in any way
-    
-    hex_indexes = set()
+    polygons = []
     for observation in gdf.geometry:
         if observation.geom_type == "MultiPolygon":
-            for polygon in observation:
-                geoJson = polygon_to_geojson(polygon)
-                hex_indexes.update(h3.polyfill(geoJson, resolution)) #h3.polyfill is the important method in the H3 library that does the heavy work of finding a good hex-cover
+            polygons.extend(observation.geoms)
         elif observation.geom_type == "Polygon":
-            geoJson = polygon_to_geojson(observation)
-            hex_indexes.update(h3.polyfill(geoJson, resolution))
+            polygons.append(observation)
         else:
             raise ValueError("GeoDataFrame's geometry is limited to either polygon of multi-polygon. Got {}".format(observation.geom_type))
-    
-    #we have the H3 indexes in hex_indexes. Now we just need to transform them into an geodataframe with any relevant info we may need
-    hex_indexes = list(hex_indexes)
-    hex_indexes.sort()
-    polygons = []
-    pol_areas = []
-    neighbors = []
-    center_points = []
-    c_neighbors = [[],[],[], [],[],[]]
-    for hex in hex_indexes:
-        #send a warning if there is a pentagon in the study region!
-        if h3.h3_is_pentagon(hex):
-            warn('A H3 cell in the study region is a pentagon. See H3\'s documentation for further details.')
-        
-        #once again: h3 uses 2-tuples for points, but shapely uses 2-lists
-        hex_coords_h3 = h3.h3_set_to_multi_polygon([hex], geo_json = False)
-        hex_coords_sh = []
-        for coords in hex_coords_h3[0]:
-            for coord in coords:
-                hex_coords_sh.append([coord[1], coord[0]]) #and in a different (lat,long) order
-        
-        pol = Polygon(hex_coords_sh)
-        polygons.append(pol)
-        
-        pol_areas.append(h3.cell_area(hex)) #cell area in default km2
-        
-        #collects h3 center points. There might be a very slight difference between these points and the ones calculated by shapely based on the polygons!
-        lat_long_center = h3.h3_to_geo(hex)
-        center_points.append(Point(lat_long_center[1], lat_long_center[0]))
-
-        hex_ring = h3.hex_ring(hex, k = 1)
-        neighbors.append([hex_indexes.index(neighbor) for neighbor in hex_ring if neighbor in hex_indexes])
-        i_n = 0
-        i_filled = 0
-        for neighbor in hex_ring:
-            if neighbor in hex_indexes:
-                c_neighbors[i_filled].append(neighbor)
-                i_filled += 1
-            i_n += 1
-        assert i_n == 6, "Cell found that did not have 6 neighbors. Does the study area contain H3 pentagons? Check H3 official documentation for details"
-        while i_filled < i_n:
-            c_neighbors[i_filled].append(None)
-            i_filled += 1
-        
 
+    n_jobs = _effective_n_jobs(n_jobs)
+    if n_jobs == 1:
+        hex_indexes = set()
+        for polygon in polygons:
+            geoJson = polygon_to_geojson(polygon)
+            hex_indexes.update(h3.polyfill(geoJson, resolution)) #h3.polyfill is the important method in the H3 library that does the heavy work of finding a good hex-cover
+    else:
+        hex_indexes = parallel_polyfill(polygons, resolution, n_jobs = n_jobs)
+    return sorted(hex_indexes)
+
+#helper function: the discretization GeoDataFrame of a sorted list of H3 indexes, with its adjacency attached
+def _h3_discretization_gdf(hex_indexes : list) -> GeoDataFrame:
+    #we have the H3 indexes in hex_indexes. Now we just need to transform them into an geodataframe with any relevant info we may need
+    polygons, pol_areas, neighbors = _h3_cells_to_columns(hex_indexes)
 
     #is there an other relevant info that could be calculated here?
-    temp_dict = {'geometry': polygons, 'h3_index':hex_indexes, 'area': pol_areas, 'neighbors': neighbors}
+    temp_dict = {'geometry': polygons, 'h3_index':hex_indexes, 'area': pol_areas}
     
 
     #replaces neighbors set for 6 neighbors columns
@@ -109,6 +221,8 @@ def generate_H3_discretization(gdf : GeoDataFrame, resolution : int = 7):
     #for i in range(6):
     #    temp_dict['neighbor'+str(i)] = c_neighbors[i]
     hex_gdf = GeoDataFrame(temp_dict, crs="EPSG:4326").reset_index() #crs="EPSG:4326" -> (lat, long) coordinates
+    #neighbors are kept in compact form. See adjacency.with_neighbors to get the 'neighbors' column of lists
+    set_adjacency(hex_gdf, neighbors)
 
     #do i want to later add the option to 'adjust the edges' of the hexagons?
     #this is still weird because it mixes H3's aproximated edges with actual edges... I'd have to smartly use k-ring or something to get it right. Seems like overkill
@@ -118,3 +232,157 @@ def generate_H3_discretization(gdf : GeoDataFrame, resolution : int = 7):
     
     return hex_gdf
 
+def generate_H3_discretization(gdf : GeoDataFrame, resolution : int = 7, *, n_jobs : int = 1):
+    
+    '''
+    Generate a hexagonal discretization of the area using Uber's H3 library, and returns a new GeoDataFrame with it. 
+
+    Parameters
+        param gdf        : GeoDataFrame - the original geodataframe whose boundaries will be considered to generate the discretization
+        param resolution : int          - the desired resolution level passed to the H3 library. A bigger number means smaller hexagons. Valid range [0,15]
+        param n_jobs     : int          - number of worker processes used for the polyfill. 1 (default) runs serially; -1 or None uses every core. See parallel_polyfill
+        return : GeoDataFrame - a new GeoDataFrame containing the H3 hexagons that approximately cover the original region 
+    '''
+
+    if(resolution < 0 or resolution > 15):
+        raise ValueError("resolution must be in range [0, 15]. Got {}".format(resolution))
+
+    hex_indexes = _polyfill_region(gdf, resolution, n_jobs)
+    return _h3_discretization_gdf(hex_indexes)
+
+class H3Hierarchy:
+    '''
+    A pyramid of H3 discretizations of the same region, one per resolution, built by generate_H3_hierarchy.
+
+    Every coarse level is made of the parents of the cells of the finest level, so each cell of a level is exactly covered by its children
+    at every finer level. Rows of every level are sorted by H3 index, which keeps the children of a cell in a contiguous range of rows:
+    values computed at a fine level (event counts, regressors, travel times) are rolled up to a coarser one with a single vectorized reduction.
+
+    Attributes
+        resolutions : list                - the resolutions of the pyramid, finest last
+        levels      : dict                - resolution -> discretization GeoDataFrame (as returned by generate_H3_discretization)
+        cells       : dict                - resolution -> numpy.ndarray of the uint64 H3 index of every row
+    '''
+
+    def __init__(self, levels : dict):
+        self.resolutions = sorted(levels)
+        self.levels = levels
+        self.cells = {resolution : np.fromiter((h3.string_to_h3(hex) for hex in gdf['h3_index']), dtype=np.uint64, count=len(gdf))
+                      for resolution, gdf in levels.items()}
+
+    def __getitem__(self, resolution : int) -> GeoDataFrame:
+        return self.levels[resolution]
+
+    def __len__(self):
+        return len(self.resolutions)
+
+    def _check_levels(self, resolution, parent_resolution):
+        for r in (resolution, parent_resolution):
+            if r not in self.levels:
+                raise KeyError("resolution {} is not part of the hierarchy. Available: {}".format(r, self.resolutions))
+        if parent_resolution > resolution:
+            raise ValueError("parent_resolution must be coarser than (or equal to) resolution. Got {} and {}".format(parent_resolution, resolution))
+
+    def parent_rows(self, resolution : int, parent_resolution : int = None) -> np.ndarray:
+        '''
+        Row of the parent (at parent_resolution) of every row of resolution.
+
+        Parameters
+            param resolution        : int - level of the children
+            param parent_resolution : int - level of the parents. Defaults to the next coarser level of the pyramid
+            return : numpy.ndarray - int32 parent row of every row of resolution, non decreasing
+        '''
+        if parent_resolution is None:
+            position = self.resolutions.index(resolution)
+            if position == 0:
+                raise ValueError("resolution {} is the coarsest level of the hierarchy".format(resolution))
+            parent_resolution = self.resolutions[position - 1]
+        self._check_levels(resolution, parent_resolution)
+        parents = h3_to_parent_array(self.cells[resolution], parent_resolution)
+        return np.searchsorted(self.cells[parent_resolution], parents).astype(np.int32)
+
+    def children(self, resolution : int, child_resolution : int = None) -> np.ndarray:
+        '''
+        Children (at child_resolution) of every row of resolution, as contiguous row ranges: the children of row i are rows children[i]:children[i + 1].
+
+        Parameters
+            param resolution       : int - level of the parents
+            param child_resolution : int - level of the children. Defaults to the next finer level of the pyramid
+            return : numpy.ndarray - int64 array of len(levels[resolution]) + 1 range bounds
+        '''
+        if child_resolution is None:
+            position = self.resolutions.index(resolution)
+            if position == len(self.resolutions) - 1:
+                raise ValueError("resolution {} is the finest level of the hierarchy".format(resolution))
+            child_resolution = self.resolutions[position + 1]
+        parent_rows = self.parent_rows(child_resolution, resolution)
+        return np.searchsorted(parent_rows, np.arange(len(self.levels[resolution]) + 1))
+
+    def rollup(self, values, resolution : int, parent_resolution : int, how = 'sum', axis : int = 0) -> np.ndarray:
+        '''
+        Aggregate values given for every row of a level into the rows of a coarser level.
+
+        Parameters
+            param values            : array like        - values of every row of resolution along axis (e.g. event counts, or a travel time matrix)
+            param resolution        : int               - level of the values
+            param parent_resolution : int               - level of the result
+            param how               : str or numpy.ufunc - 'sum', 'mean', 'max', 'min', or any numpy ufunc with a reduceat method (e.g. np.fmax to ignore NaN)
+            param axis              : int               - axis of values indexed by rows. Roll a matrix up on both of its axes with two calls
+            return : numpy.ndarray - values aggregated over the children of every row of parent_resolution
+        '''
+        values = np.asarray(values)
+        if values.shape[axis] != len(self.levels[resolution]):
+            raise ValueError("values has {} entries along axis {}, but resolution {} has {} cells".format(values.shape[axis], axis, resolution, len(self.levels[resolution])))
+        if parent_resolution == resolution:
+            return values.copy()
+        parent_rows = self.parent_rows(resolution, parent_resolution)
+        n_parents = len(self.levels[parent_resolution])
+
+        #a weighted bincount handles the common 1d sums and means
+        if values.ndim == 1 and how in ('sum', 'mean'):
+            result = np.bincount(parent_rows, weights=values, minlength=n_parents)
+            if how == 'mean':
+                result = result / np.bincount(parent_rows, minlength=n_parents)
+            return result
+
+        #every parent has at least one child, and children are contiguous, so any reduction is a reduceat over the range starts
+        starts = np.searchsorted(parent_rows, np.arange(n_parents))
+        if how == 'mean':
+            counts = np.diff(np.append(starts, len(parent_rows)))
+            shape = [1] * values.ndim
+            shape[axis] = n_parents
+            return np.add.reduceat(values, starts, axis=axis) / counts.reshape(shape)
+        ufunc = {'sum' : np.add, 'max' : np.maximum, 'min' : np.minimum}.get(how, how)
+        if not isinstance(ufunc, np.ufunc):
+            raise ValueError("how must be 'sum', 'mean', 'max', 'min' or a numpy ufunc. Got {}".format(how))
+        return ufunc.reduceat(values, starts, axis=axis)
+
+def generate_H3_hierarchy(gdf : GeoDataFrame, resolutions, *, n_jobs : int = 1) -> H3Hierarchy:
+    '''
+    Generate hexagonal discretizations of the area at many resolutions at once (see generate_H3_discretization), linked by their parent / child relations.
+
+    The region is polyfilled only once, at the finest resolution. Every coarser level is made of the parents of those cells
+    (so, unlike a separate generate_H3_discretization call, a coarse cell may stick out of the region, as long as one of its children is inside).
+    Geometry, area and neighbors are still computed for the cells of every level.
+
+    Parameters
+        param gdf         : GeoDataFrame - the original geodataframe whose boundaries will be considered to generate the discretization
+        param resolutions : iterable     - the resolutions of the pyramid, e.g. range(6, 10). Valid range [0,15]
+        param n_jobs      : int          - number of worker processes used for the polyfill. See generate_H3_discretization
+        return : H3Hierarchy - the discretization of every resolution, and the mappings between them
+    '''
+    resolutions = sorted(set(int(resolution) for resolution in resolutions))
+    if not resolutions:
+        raise ValueError("resolutions must not be empty")
+    if resolutions[0] < 0 or resolutions[-1] > 15:
+        raise ValueError("resolutions must be in range [0, 15]. Got {}".format(resolutions))
+
+    finest = resolutions[-1]
+    cells = np.fromiter((h3.string_to_h3(hex) for hex in _polyfill_region(gdf, finest, n_jobs)), dtype=np.uint64)
+
+    levels = {}
+    for resolution in resolutions:
+        #integer order matches the (fixed width) string order of H3 indexes, so levels keep the sorted rows of generate_H3_discretization
+        level_cells = cells if resolution == finest else np.unique(h3_to_parent_array(cells, resolution))
+        levels[resolution] = _h3_discretization_gdf([h3.h3_to_string(int(cell)) for cell in level_cells])
+    return H3Hierarchy(levels)
@@ -4,14 +4,18 @@ from geopandas import GeoDataFrame, read_file
 from .h3_utils import generate_H3_discretization
 from .travel_times.graphhopper import distance_matrix_from_gdf
 from .squares import rectangle_discretization
+from .cache import as_cache
+from .parquet_io import read_parquet, write_parquet
+from .adjacency import Adjacency, adjacency_from_geometries, get_adjacency, set_adjacency
 
 import numpy as np
+import shapely
 
 '''
 This file defines functions for ease of use, redirecting to the correct implementation in other files
 '''
 
-def generate_discretization(gdf, shape = 'hexagons', *, nx = 10, ny = 10, neighborhood_type = '8', h3_discretization_level = 6, export_friendly = False) -> GeoDataFrame:
+def generate_discretization(gdf, shape = 'hexagons', *, nx = 10, ny = 10, neighborhood_type = '8', h3_discretization_level = 6, export_friendly = False, n_jobs = 1, snap_tolerance = 0.0, cache = None) -> GeoDataFrame:
     '''
     Generate an enriched, discretized GeoDataFrame from the original geodataframe. The GeoDataFrame returned should work seamlessly with
         other functions provided within this module.
@@ -24,12 +28,19 @@ def generate_discretization(gdf, shape = 'hexagons', *, nx = 10, ny = 10, neighb
         neighborhood : ('8', '4') - if using 'rectangles', defines the type of neighborhood to be added to the returned gdf. See squares.py for further details
         h3_discretization_level : (int)- if using 'hexagons', this sets the resolution level passed to the H3 library. A bigger number means smaller hexagons. Valid range [0,15]
         export_friendly : (bool) - if True, the returned geodataframe is transformed to contain only columns that can be easily exported
+        n_jobs : (int) - number of worker processes. If using 'hexagons', the region is polyfilled in parallel tiles (see h3_utils.parallel_polyfill).
+            If using 'none', neighbors are computed in parallel chunks (see adjacency.adjacency_from_geometries). 1 (default) runs serially, -1 or None uses every core
+        snap_tolerance : (float) - if using 'none', shapes closer than this distance (in degrees, as the gdf is converted to lat long) are considered neighbors.
+            0 (default) only considers shapes that touch
+        cache : (DiscretizationCache, string) - opt-in on-disk cache (or the path of its directory). Results are stored keyed by the input geometries,
+            CRS and parameters, and loaded back instead of recomputed. Pass a DiscretizationCache object to keep track of its hit / miss statistics
     Returns:
-        (GeoDataFrame)  - a discretized geodataframe with columns filled as expected by the other functions in this package
+        (GeoDataFrame)  - a discretized geodataframe with columns filled as expected by the other functions in this package.
+            Neighbors are attached in compact form (see adjacency.get_adjacency); call adjacency.with_neighbors to get the 'neighbors' column of lists
     
     '''
     if(isinstance(gdf, str)):
-        gdf = geopandas.read_file(gdf).reset_index()
+        gdf = read_file(gdf).reset_index()
         gdf = gdf.to_crs(epsg=4326) #convert coordinate system to lat long
     elif (isinstance(gdf, GeoDataFrame)):
         #for now, we're converting everything to lat long. This may not be strictly necessary but made thing easier for now
@@ -37,57 +48,72 @@ def generate_discretization(gdf, shape = 'hexagons', *, nx = 10, ny = 10, neighb
     else:
         raise TypeError
 
+    if cache is not None:
+        cache = as_cache(cache)
+        if shape == 'hexagons':
+            params = {'h3_discretization_level' : h3_discretization_level}
+        elif shape == 'rectangles':
+            params = {'nx' : nx, 'ny' : ny, 'neighborhood_type' : neighborhood_type}
+        else:
+            params = {'snap_tolerance' : snap_tolerance}
+        cache_key = cache.key(gdf, shape = str(shape), **params)
+        discretized_gdf = cache.get(cache_key)
+        if discretized_gdf is not None:
+            return to_export_friendly(discretized_gdf) if export_friendly else discretized_gdf
+
     discretized_gdf = None
     if(shape == 'hexagons'):
-        discretized_gdf = generate_H3_discretization(gdf, h3_discretization_level)
+        discretized_gdf = generate_H3_discretization(gdf, h3_discretization_level, n_jobs = n_jobs)
     elif(shape == 'rectangles'):
         discretized_gdf = rectangle_discretization(gdf, nx, ny, neighborhood=neighborhood_type)
     elif shape == 'none' or shape == False:
         discretized_gdf = gdf
-        #fill neighbors column using the geometry itself:
-        #be aware, tho: this process is not 100% fail-proof, and is prone to numerical errors!
-        #calculate neighbors:
-        neighborss = []
-        for i, row in discretized_gdf.iterrows():
-            # get indices of 'touching' geometries
-            #print(numpy.flatnonzero(res_intersection[res_intersection.geometry.touches(poly.geometry)]).tolist())
-            neighbors = [i for i in gdf.index[gdf.geometry.touches(row.geometry)]]
-
-            # remove own index of the row itself from the list
-            neighbors = [ index for index in neighbors if i != index ]
-
-            # add names of neighbors as NEIGHBORS value
-            neighborss.append(neighbors)
-        discretized_gdf['neighbors'] = neighborss
+        #fill neighbors using the geometry itself:
+        #be aware, tho: this process is not 100% fail-proof, and is prone to numerical errors! snap_tolerance helps with small gaps between shapes
+        set_adjacency(discretized_gdf, adjacency_from_geometries(discretized_gdf.geometry, tolerance = snap_tolerance, n_jobs = n_jobs))
 
     #fills center_lat and center_lon
-    centers = [shape.centroid for shape in discretized_gdf.geometry]
-    discretized_gdf['center_lat'] = [p.y for p in centers]
-    discretized_gdf['center_lon'] = [p.x for p in centers]
+    centers = shapely.centroid(discretized_gdf.geometry.values)
+    discretized_gdf['center_lat'] = shapely.get_y(centers)
+    discretized_gdf['center_lon'] = shapely.get_x(centers)
 
     if not 'area' in discretized_gdf:
         #fills area
-        area = [shape.area for shape in discretized_gdf.geometry]
-        discretized_gdf['area'] = area
+        discretized_gdf['area'] = shapely.area(discretized_gdf.geometry.values)
   
     
     discretized_gdf = reindex(discretized_gdf)
 
+    if cache is not None:
+        cache.put(cache_key, discretized_gdf)
+
     if export_friendly:
         discretized_gdf = to_export_friendly(discretized_gdf)
     
     return discretized_gdf
 
+#drivers handled by parquet_io instead of geopandas / fiona
+PARQUET_DRIVERS = ('Parquet', 'GeoParquet')
+
 def save_gdf(gdf : GeoDataFrame, path, driver = 'ESRI Shapefile'):
     '''
-        Saves the familiar gdf to path, using driver. For supported drivers, see geopandas / fiona documentation
+        Saves the familiar gdf to path, using driver. For supported drivers, see geopandas / fiona documentation.
+        With driver = 'Parquet', the gdf is saved as GeoParquet and neighbors are stored as a native list column (see parquet_io.py). Prefer it for large discretizations
     '''
+    if driver in PARQUET_DRIVERS:
+        return write_parquet(gdf, path)
     return to_export_friendly(gdf).to_file(path, driver = driver)
 
-def load_gdf(path, driver = None) -> GeoDataFrame:
+def load_gdf(path, driver = None, *, columns = None, memory_map = True) -> GeoDataFrame:
     '''
-        Loads and returns a familiar gdf. If no driver is specified, geopandas tries to use the correct one automatically
+        Loads and returns a familiar gdf. If no driver is specified, geopandas tries to use the correct one automatically (.parquet files are read as GeoParquet)
+
+        Keyword only arguments, GeoParquet only:
+            columns : (list) - only read these columns. Leave 'neighbors' out to skip loading the adjacency
+            memory_map : (bool) - memory map the file instead of reading it into buffers
     '''
+    if driver in PARQUET_DRIVERS or (driver == None and str(path).lower().endswith('.parquet')):
+        return reindex(read_parquet(path, columns = columns, memory_map = memory_map))
     if driver == None:
         return reindex(from_export_friendly(read_file(path).reset_index()))
     else:
@@ -102,7 +128,7 @@ def to_export_friendly(gdf : GeoDataFrame) -> GeoDataFrame:
 
     #transform list into string separated by -
     copy_gdf = gdf.copy()
-    temp_neighbors = ['-'.join(map(str, lista)) for lista in copy_gdf['neighbors']]
+    temp_neighbors = ['-'.join(map(str, lista)) for lista in get_adjacency(gdf).to_lists()]
     copy_gdf['neighbors'] = temp_neighbors
 
     return copy_gdf
@@ -113,13 +139,18 @@ def from_export_friendly(gdf : GeoDataFrame) -> GeoDataFrame:
         Detransforms the transformation done by to_export_friendly
     '''
 
-    temp_neighbors = [list(map(int, mystring.split('-'))) if mystring else [] for mystring in gdf['neighbors']]
-    gdf['neighbors'] = temp_neighbors
-    return gdf
+    strings = gdf['neighbors'].fillna('').astype(str)
+    lengths = np.where(strings.str.len() > 0, strings.str.count('-') + 1, 0)
+    indptr = np.zeros(len(gdf) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    joined = '-'.join(s for s in strings if s)
+    indices = np.array(joined.split('-'), dtype=np.int64) if joined else np.zeros(0, dtype=np.int64)
+    return set_adjacency(gdf, Adjacency(indptr, indices))
 
 def reindex(gdf : GeoDataFrame) -> GeoDataFrame:
     #set desired order of columns
     col = ['geometry', 'area', 'center_lat', 'center_lon', 'neighbors']
+    col = [c for c in col if c in gdf.columns] # neighbors may only live in the attached adjacency
     col = col + [c for c in gdf.columns if c not in col] # but don't drop any
     re_gdf = gdf.reindex(columns=col)
     return re_gdf
@@ -0,0 +1,97 @@
+import json
+from geopandas import GeoDataFrame, read_parquet as gpd_read_parquet
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+
+from .adjacency import Adjacency, RowIndex, get_adjacency, set_adjacency
+from .squares import GRID_ATTR, RectangleGrid
+
+'''
+This file defines the GeoParquet storage backend used by save_gdf / load_gdf (driver = 'Parquet') and by the discretization cache.
+
+Neighbors are stored as a native Arrow list<int32> column built straight from the CSR adjacency arrays (the list offsets are indptr
+and the list values are indices), so no per-row string encoding or parsing is needed in either direction.
+The grid of rectangle discretizations (see squares.RectangleGrid) is kept in the file metadata.
+'''
+
+def write_parquet(gdf : GeoDataFrame, path, **kwargs):
+    '''
+        Write the familiar gdf to path as GeoParquet (WKB encoded geometry), with its adjacency as a list<int32> 'neighbors' column. kwargs are passed to pyarrow.parquet.write_table
+    '''
+    adjacency = get_adjacency(gdf)
+    geometry_name = gdf.geometry.name
+    frame = pd.DataFrame(gdf.drop(columns=[geometry_name, 'neighbors'], errors='ignore'))
+    frame.attrs = {} #the adjacency is stored as a column
+    table = pa.Table.from_pandas(frame)
+
+    geometries = np.asarray(gdf.geometry, dtype=object)
+    table = table.append_column(geometry_name, pa.array(shapely.to_wkb(geometries), type=pa.binary()))
+    neighbors = pa.ListArray.from_arrays(pa.array(adjacency.indptr, type=pa.int32()), pa.array(adjacency.indices, type=pa.int32()))
+    table = table.append_column('neighbors', neighbors)
+
+    #keep the column order of gdf (any index columns written by pandas go last)
+    order = [c for c in gdf.columns if c != 'neighbors'] + ['neighbors']
+    table = table.select(order + [c for c in table.column_names if c not in order])
+
+    #GeoParquet metadata, see https://geoparquet.org
+    geometry_types = sorted(set(t for t in shapely.get_type_id(geometries[~shapely.is_missing(geometries)]).tolist()))
+    geo = {'version' : '1.0.0', 'primary_column' : geometry_name, 'columns' : {geometry_name : {
+        'encoding' : 'WKB',
+        'geometry_types' : [GEOMETRY_TYPE_NAMES[t] for t in geometry_types if t in GEOMETRY_TYPE_NAMES],
+        'crs' : gdf.crs.to_json_dict() if gdf.crs is not None else None,
+        'bbox' : [float(v) for v in gdf.geometry.total_bounds] if len(gdf) else None,
+    }}}
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'geo'] = json.dumps(geo).encode()
+    #rectangle discretizations keep their grid metadata, so points can still be assigned with arithmetic once loaded (see points.py)
+    grid = gdf.attrs.get(GRID_ATTR)
+    if grid is not None and grid.rows.matches(gdf):
+        metadata[GRID_ATTR.encode()] = json.dumps(grid.to_metadata()).encode()
+    pq.write_table(table.replace_schema_metadata(metadata), path, **kwargs)
+
+#shapely type id -> GeoParquet geometry type name
+GEOMETRY_TYPE_NAMES = {0 : 'Point', 1 : 'LineString', 3 : 'Polygon', 4 : 'MultiPoint', 5 : 'MultiLineString', 6 : 'MultiPolygon', 7 : 'GeometryCollection'}
+
+def read_parquet(path, columns = None, memory_map : bool = True) -> GeoDataFrame:
+    '''
+        Read a GeoParquet file written by write_parquet.
+
+        Arguments:
+            path : (string) - the file
+            columns : (list) - if given, only these columns are read (the geometry column is always read). Leave 'neighbors' out to skip the adjacency
+            memory_map : (bool) - memory map the file instead of reading it into buffers
+        Returns:
+            (GeoDataFrame) - the familiar gdf, with the adjacency (if it was read) and the rectangle grid (if it was stored) attached
+    '''
+    schema = pq.read_schema(path, memory_map=memory_map)
+    names = list(schema.names)
+    geometry_name = _primary_geometry_column(schema)
+    if columns is None:
+        columns = names
+    missing = [c for c in columns if c not in names]
+    if missing:
+        raise KeyError("columns not found in {}: {}".format(path, missing))
+
+    read_neighbors = 'neighbors' in columns and 'neighbors' in names
+    other_columns = [c for c in columns if c != 'neighbors']
+    if geometry_name not in other_columns:
+        other_columns = [geometry_name] + other_columns
+    gdf = gpd_read_parquet(path, columns=other_columns, memory_map=memory_map)
+
+    if read_neighbors:
+        neighbors = pq.read_table(path, columns=['neighbors'], memory_map=memory_map).column('neighbors').combine_chunks()
+        offsets = neighbors.offsets.to_numpy()
+        indices = neighbors.values.to_numpy()[offsets[0]:offsets[-1]]
+        set_adjacency(gdf, Adjacency(offsets - offsets[0], indices))
+    if GRID_ATTR.encode() in (schema.metadata or {}):
+        gdf.attrs[GRID_ATTR] = RectangleGrid.from_metadata(json.loads(schema.metadata[GRID_ATTR.encode()]), RowIndex(gdf.index))
+    return gdf
+
+def _primary_geometry_column(schema) -> str:
+    metadata = schema.metadata or {}
+    if b'geo' not in metadata:
+        raise ValueError("not a GeoParquet file: missing 'geo' metadata")
+    return json.loads(metadata[b'geo'])['primary_column']
@@ -0,0 +1,145 @@
+from warnings import catch_warnings, simplefilter
+from geopandas import GeoDataFrame
+import numpy as np
+import pandas as pd
+import shapely
+
+from .squares import GRID_ATTR
+
+'''
+This file defines point to cell assignment (e.g. of millions of events) for every kind of discretization, without building a Point per row
+or running a spatial join:
+    hexagons (an 'h3_index' column): vectorized geo_to_h3 and a hash lookup of the cells
+    rectangles (grid metadata attached by rectangle_discretization): arithmetic on the grid origin / deltas, plus an exact test on boundary cells only
+    anything else: an STRtree query
+'''
+
+class PointAssigner:
+    '''
+    Assigns points to the rows of a discretization. Lookups are built once, so the same assigner can be applied to many chunks of points.
+
+    Attributes
+        method : str - 'h3', 'grid' or 'strtree', picked from the discretization
+    '''
+
+    def __init__(self, discretization : GeoDataFrame, *, h3_col : str = 'h3_index'):
+        self.discretization = discretization
+        self.geometries = np.asarray(discretization.geometry, dtype=object)
+        self.grid = discretization.attrs.get(GRID_ATTR)
+        if self.grid is not None and not self.grid.rows.matches(discretization):
+            self.grid = None #rows were added, dropped or reordered since the grid was attached
+        if h3_col in discretization.columns and len(discretization):
+            import h3
+            self.method = 'h3'
+            self.h3 = h3
+            self.resolution = h3.h3_get_resolution(discretization[h3_col].iloc[0])
+            self.cells = pd.Index(np.fromiter((h3.string_to_h3(hex) for hex in discretization[h3_col]), dtype=np.uint64, count=len(discretization)))
+        elif self.grid is not None:
+            self.method = 'grid'
+            shapely.prepare(self.geometries)
+        else:
+            self.method = 'strtree'
+            self.tree = shapely.STRtree(self.geometries)
+
+    def assign(self, lat, lon) -> np.ndarray:
+        '''
+            Row position of the cell containing every point (-1 if it falls outside the discretization or its coordinates are missing)
+
+            Arguments:
+                lat, lon : (array like) - coordinates of the points
+            Returns:
+                (numpy.ndarray) - int32 row positions
+        '''
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        if lat.shape != lon.shape:
+            raise ValueError("lat and lon must have the same shape. Got {} and {}".format(lat.shape, lon.shape))
+        rows = np.full(lat.shape, -1, dtype=np.int32)
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        if valid.any():
+            rows[valid] = getattr(self, '_assign_' + self.method)(lat[valid], lon[valid])
+        return rows
+
+    def _assign_h3(self, lat, lon):
+        return self.cells.get_indexer(_geo_to_h3(self.h3, lat, lon, self.resolution))
+
+    def _assign_grid(self, lat, lon):
+        grid = self.grid
+        ix = np.floor((lon - grid.minx) / grid.deltax).astype(np.int64)
+        iy = np.floor((lat - grid.miny) / grid.deltay).astype(np.int64)
+        #points exactly on the max edge of the grid belong to the last square, as the squares are closed
+        ix[(ix == grid.nx) & (lon <= grid.minx + grid.nx * grid.deltax)] = grid.nx - 1
+        iy[(iy == grid.ny) & (lat <= grid.miny + grid.ny * grid.deltay)] = grid.ny - 1
+        inside = (ix >= 0) & (iy >= 0) & (ix < grid.nx) & (iy < grid.ny)
+        square = np.where(inside, iy * grid.nx + ix, 0)
+        start, stop = grid.first_row[square], grid.first_row[square + 1]
+
+        rows = np.full(len(lat), -1, dtype=np.int64)
+        #a whole square, alone in its square: no geometric test needed
+        simple = inside & (stop - start == 1)
+        simple[simple] = grid.interior[start[simple]]
+        rows[simple] = start[simple]
+
+        #squares clipped by the boundary or split between regions: test the candidate rows in order, the first one containing the point wins
+        pending = np.flatnonzero(inside & ~simple & (stop > start))
+        offset = 0
+        while len(pending):
+            candidate = start[pending] + offset
+            hit = shapely.intersects_xy(self.geometries[candidate], lon[pending], lat[pending])
+            rows[pending[hit]] = candidate[hit]
+            pending = pending[~hit]
+            offset += 1
+            pending = pending[start[pending] + offset < stop[pending]]
+        return rows
+
+    def _assign_strtree(self, lat, lon):
+        points = shapely.points(lon, lat)
+        point_index, geometry_index = self.tree.query(points, predicate='intersects')
+        rows = np.full(len(lat), -1, dtype=np.int64)
+        #points on a shared edge intersect many cells: keep the first row, as a spatial join would list first
+        order = np.lexsort((geometry_index, point_index))
+        first = np.unique(point_index[order], return_index=True)[1]
+        rows[point_index[order][first]] = geometry_index[order][first]
+        return rows
+
+    def iter_assign(self, chunks, *, lat_col : str = 'latitude', lon_col : str = 'longitude'):
+        '''
+            Assign a stream of chunks, yielding the int32 row positions of each chunk. Chunks can be DataFrames (e.g. pd.read_csv(..., chunksize = ...)),
+            with the coordinates in lat_col / lon_col, or (lat, lon) pairs of arrays
+        '''
+        for chunk in chunks:
+            if isinstance(chunk, pd.DataFrame):
+                yield self.assign(chunk[lat_col].to_numpy(), chunk[lon_col].to_numpy())
+            else:
+                lat, lon = chunk
+                yield self.assign(lat, lon)
+
+def _geo_to_h3(h3, lat, lon, resolution):
+    '''
+        uint64 H3 cells of the points, vectorized when the installed h3 provides it
+    '''
+    try:
+        with catch_warnings():
+            simplefilter('ignore') #h3.unstable warns on import
+            from h3.unstable import vect
+        return np.asarray(vect.geo_to_h3(lat, lon, resolution), dtype=np.uint64)
+    except (ImportError, AttributeError):
+        import h3.api.numpy_int as h3_int
+        return np.fromiter((h3_int.geo_to_h3(a, b, resolution) for a, b in zip(lat.tolist(), lon.tolist())), dtype=np.uint64, count=len(lat))
+
+def assign_points(discretization : GeoDataFrame, lat, lon = None, *, lat_col : str = 'latitude', lon_col : str = 'longitude') -> np.ndarray:
+    '''
+        Assign points to the cells of a discretization, with the fastest method for its shape (see PointAssigner).
+
+        Arguments:
+            discretization : (GeoDataFrame) - a discretization, e.g. from generate_discretization. Points are expected in lat long (EPSG:4326)
+            lat, lon : (array like) - coordinates of the points. If lon is None, lat is a stream of chunks instead (see PointAssigner.iter_assign)
+            lat_col, lon_col : (string) - coordinate columns of DataFrame chunks
+        Returns:
+            (numpy.ndarray) - int32 row position of the cell containing every point, -1 for points outside the discretization
+    '''
+    assigner = PointAssigner(discretization)
+    if lon is not None:
+        return assigner.assign(lat, lon)
+    chunks = list(assigner.iter_assign(lat, lat_col = lat_col, lon_col = lon_col))
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
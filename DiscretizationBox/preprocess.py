@@ -4,11 +4,10 @@ import numpy as np
 import pandas as pd
 from tqdm import tqdm
 import geopandas as gpd
-from shapely.geometry import Point
 
 sys.path.append('..')
 from config import *
-from utils import grupo_dias_dict
+from utils import grupo_dias_dict, ArmazemContagens, EscritorEventos, escrever_eventos
 
 
 # - Parser de argumentos
@@ -18,8 +17,21 @@ parser.add_argument('--DiscrEspacial','-e',help='Tipo de discretização espacia
 parser.add_argument('--DiscrTemporal','-t',help='Tipo de discretização temporal a ser aplicada',default='meiahora')
 parser.add_argument('--NX','-x',help='Número de divisões no eixo x para discretização geográfica em retângulos',default=10)
 parser.add_argument('--NY','-y',help='Número de divisões no eixo y para discretização geográfica em retângulos',default=10)
+parser.add_argument('--TamanhoBloco','-b',help='Número de linhas de eventos lidas e processadas por vez',default=500000)
+parser.add_argument('--Eventos','-i',help='Arquivo de eventos (em ENTR_DATA_PATH) a ser processado',default='eventos_desagregados.csv')
+parser.add_argument('--Armazem','-a',help='Diretório de contagens (ArmazemContagens) em que os eventos processados são ingeridos, em vez de escrever os eventos',default=None)
+parser.add_argument('--Substituir','-s',help='Ao ingerir no armazém, substitui as contagens das datas presentes nos eventos',action='store_true')
 args = parser.parse_args()
 
+# - Variaveis de leitura
+# tipos das colunas lidas de eventos_desagregados.csv. hora repete poucos valores distintos (categoria),
+# TipoViatura é inteiro com suporte a faltantes. data e data_idx são lidas como texto e convertidas em _tratar_eventos
+TIPOS_EVENTOS = {'latitude':'float64','longitude':'float64','TipoViatura':'Int8','hora':'category'}
+FORMATO_DATA = '%m/%d/%y'
+FORMATO_DATA_IDX = '%m/%d/%y %H:%M'
+# coordenadas no formato 'POINT (x y)'
+REGEX_COORDENADAS = r'POINT \(\s*(\S+)\s+(\S+)\s*\)'
+
 
 # - Funções auxiliares
 def agrupar_dias(df,group=0):
@@ -39,7 +51,7 @@ def agrupar_dias(df,group=0):
     wd = df['data'].dt.weekday
     return wd.map(grupo_dias_dict[group])
 
-def temp_discretizar(df,w='meiahora'):
+def temp_discretizar(df,w='meiahora',relativo=True,janela_inicial=None):
     '''
     Discretiza os dados temporais no dataframe
     
@@ -52,9 +64,27 @@ def temp_discretizar(df,w='meiahora'):
             meiahora => janelas de 30 minutos
             hora      => janelas de 60 minutos
             dia       => janelas de 24 horas
+    relativo : {bool}
+        True => a primeira janela com eventos é a janela 1. False => a janela das zero horas é sempre a janela 1,
+        de forma que t não depende do lote de eventos processado (necessário para ArmazemContagens)
+    janela_inicial : {int}
+        Se relativo, a primeira janela com eventos, quando df é apenas um bloco dos eventos (ver janela_minima). None => a primeira janela de df
+    '''
+    st = _janelas(df['data_idx'],w)
+    if relativo:
+        janela_inicial = st.min() if janela_inicial is None else janela_inicial
+        df['t'] = st - janela_inicial + 1
+    else:
+        df['t'] = st + 1
+    
+    return df
+
+def _janelas(data_idx,w):
+    '''
+    Janela de tempo (a partir das zero horas, começando em 0) de cada data_idx. Ver temp_discretizar
     '''
     # o que importa é a hora do dia (em segundos)
-    dt_seconds = (df['data_idx'].dt.hour*3600) + (df['data_idx'].dt.minute*60) + (df['data_idx'].dt.second*1)
+    dt_seconds = (data_idx.dt.hour*3600) + (data_idx.dt.minute*60) + (data_idx.dt.second*1)
     # variação de tempo em janelas de meia hora
     if w == 'meiahora':
         st = (dt_seconds / (60*30)).astype(int)
@@ -66,11 +96,32 @@ def temp_discretizar(df,w='meiahora'):
         st = (w*dt_seconds / (60*60*24)).astype(int)
     else:
         print('Tipo de janela inválida:',w)
-    df['t'] = st - st.min() + 1
-    
+    return st
+
+def leitura_bairros():
+    '''
+    Leitura dos dados de divisas de bairros do rio de janeiro, em lat long
+    '''
+    bairros = gpd.read_file(os.path.join(ENTR_DATA_PATH,'Bairros_rio_de_janeiro.shp')).reset_index()
+    # possíveis CRS iniciais: 22522,29193,31983,32723
+    bairros = bairros.set_crs(epsg=29183)
+    bairros = bairros.to_crs(epsg=4326)
+    return bairros[['CODBAIRRO','NOME','area','geometry']]
+
+def _geo_discretizar_bloco(df,bairros):
+    '''
+    Associa cada evento de um bloco ao bairro que o contém (tratamento de coordenadas vetorizado e junção espacial indexada)
+    '''
+    # Dados de eventos - tratamento de coordenadas
+    coordenadas = df['Coordenadas'].str.extract(REGEX_COORDENADAS).astype(float)
+    df = df.assign(lat=coordenadas[0].to_numpy(),lon=coordenadas[1].to_numpy())
+    df = gpd.GeoDataFrame(df,geometry=gpd.points_from_xy(df['lat'],df['lon']),crs='EPSG:4326')
+    df = gpd.sjoin(df,bairros,how='left',predicate='within').drop(columns='index_right')
+    df.rename({'CODBAIRRO':'i','NOME':'nome_bairro'},axis=1,inplace=True)
+    df['i'] = df['i'].fillna(0).astype(int)
     return df
 
-def geo_discretizar(df,tipo_discretizacao,nx=None,ny=None):
+def geo_discretizar(df,tipo_discretizacao,nx=None,ny=None,tamanho_bloco=None):
     '''
     Discretiza os dados geograficos de latitude e longitude no dataframe
     
@@ -86,6 +137,8 @@ def geo_discretizar(df,tipo_discretizacao,nx=None,ny=None):
         número de divisões no espaço de latitudes
     ny : {int}
         número de divisões no espaço de longitudes
+    tamanho_bloco : {int}
+        número de eventos associados aos bairros por vez (divisas). None => todos de uma vez
     '''
     
     if tipo_discretizacao == 'retangulos':
@@ -120,27 +173,48 @@ def geo_discretizar(df,tipo_discretizacao,nx=None,ny=None):
             how='left'
         )
     elif tipo_discretizacao == 'divisas':
-        # Leitura de dados de divisas
-        bairros = gpd.read_file(os.path.join(ENTR_DATA_PATH,'Bairros_rio_de_janeiro.shp')).reset_index()
-        # possíveis CRS iniciais: 22522,29193,31983,32723
-        bairros = bairros.set_crs(epsg=29183)
-        bairros = bairros.to_crs(epsg=4326)
-
-        # Dados de eventos - tratamento de coordenadas
-        df[['lat','lon']] = df['Coordenadas']\
-            .str.replace("POINT \(","",regex=True)\
-            .str.replace(")","",regex=True)\
-            .str.strip()\
-            .str.split(' ',expand=True).astype(float)
-        df['geometry'] = [Point((lat,lon)) for (lat,lon) in tqdm(df[['lat','lon']].values,desc='Formatando coordenadas geográficas')]
-        df = gpd.GeoDataFrame(df).set_crs(epsg=4326)
-        df = gpd.sjoin(df,bairros,how='left',op='within')[list(df.columns)+['CODBAIRRO','NOME','area']]
-        df.rename({'CODBAIRRO':'i','NOME':'nome_bairro'},axis=1,inplace=True)
-        df['i'] = df['i'].fillna(0).astype(int)
-    
+        bairros = leitura_bairros()
+
+        # Dados de eventos - junção espacial por blocos, limitando a memória usada
+        tamanho_bloco = max(len(df) if tamanho_bloco is None else int(tamanho_bloco),1)
+        blocos = [
+            _geo_discretizar_bloco(df.iloc[inicio:inicio+tamanho_bloco],bairros)
+            for inicio in tqdm(range(0,max(len(df),1),tamanho_bloco),desc='Discretizando eventos')
+        ]
+        df = pd.concat(blocos)
+
     return df
 
-def leitura_eventos(group=0):
+def _eventos_validos(df):
+    '''
+    Máscara dos eventos válidos de um bloco
+    '''
+    # - Dados geográficos: faltantes e outliers (longitude > 0)
+    # - Descartar prioridade zero (TipoViatura faltante é mantido)
+    return (
+        (df['latitude'].notna()) &
+        (df['longitude']<=0) &
+        (df['TipoViatura'].ne(0).fillna(True))
+    )
+
+def _tratar_eventos(df,group=0):
+    '''
+    Tratamento inicial de um bloco de eventos: descarta eventos inválidos e converte os dados temporais
+    '''
+    df = df[_eventos_validos(df)].copy()
+
+    # - Tratar dados temporais
+    df['data']      =  pd.to_datetime(df['data'],format=FORMATO_DATA)
+    df['data_idx']  = pd.to_datetime(df['data_idx'],format=FORMATO_DATA_IDX)
+    # agrupar dias
+    df['g'] = agrupar_dias(df,group=group)
+    df.rename({'TipoViatura':'p'},axis=1,inplace=True)
+    # o tipo inteiro com suporte a faltantes só é mantido em blocos com prioridade faltante
+    if not df['p'].isna().any():
+        df['p'] = df['p'].astype('int8')
+    return df
+
+def leitura_eventos(group=0,tamanho_bloco=500000,arquivo='eventos_desagregados.csv'):
     '''
     Leitura e tratamento inicial dos dados de eventos
 
@@ -151,49 +225,100 @@ def leitura_eventos(group=0):
             0 => semana vs fim de semana
             1 => semana vs sabado vs domingo
             2 => cada um dos 7 dias
+    tamanho_bloco : {int}
+        número de linhas lidas por vez. Apenas os eventos válidos e já convertidos de cada bloco são mantidos em memória
+    arquivo : {str}
+        arquivo de eventos, em ENTR_DATA_PATH (ex: apenas os eventos novos, para ingestão incremental)
     '''
-    # - Leitura do data frame
-    df = pd.read_csv(os.path.join(ENTR_DATA_PATH,'eventos_desagregados.csv'),index_col=0)
-
-    # - Dados geográficos
-    # faltantes
-    df.drop(df.loc[
-        (df['latitude'].isna()) |
-        (df['longitude'].isna())
-    ].index,axis=0,inplace=True)
-    # outliers
-    df.drop(df[df['longitude']>0].index,axis=0,inplace=True)
+    return pd.concat(list(blocos_eventos(group=group,tamanho_bloco=tamanho_bloco,arquivo=arquivo)))
 
-    # - Descartar prioridade zero
-    df.drop(df.loc[
-        df['TipoViatura']==0
-    ].index,axis=0,inplace=True)
+def blocos_eventos(group=0,tamanho_bloco=500000,arquivo='eventos_desagregados.csv'):
+    '''
+    Leitura e tratamento inicial dos dados de eventos, um bloco por vez (gerador). Ver leitura_eventos
+    '''
+    leitor = pd.read_csv(os.path.join(ENTR_DATA_PATH,arquivo),index_col=0,
+                         dtype=TIPOS_EVENTOS,chunksize=int(tamanho_bloco))
+    for bloco in tqdm(leitor,desc='Lendo eventos'):
+        yield _tratar_eventos(bloco,group=group)
 
-    # - Tratar dados temporais
-    df['data']      =  pd.to_datetime(df['data'],format='%m/%d/%y')
-    df['data_idx']  = pd.to_datetime(df['data_idx'],format='%m/%d/%y %H:%M')
-    # agrupar dias
-    df['g'] = agrupar_dias(df,group=group)
-    df.rename({'TipoViatura':'p'},axis=1,inplace=True)
-    return df
+def janela_minima(w='meiahora',tamanho_bloco=500000,arquivo='eventos_desagregados.csv'):
+    '''
+    Primeira janela de tempo com eventos válidos (ver temp_discretizar), lendo apenas as colunas necessárias, por blocos.
+    Usada para discretizar os eventos bloco a bloco com janelas relativas
+    '''
+    colunas = ['latitude','longitude','TipoViatura','data_idx']
+    leitor = pd.read_csv(os.path.join(ENTR_DATA_PATH,arquivo),usecols=colunas,
+                         dtype={c:t for c,t in TIPOS_EVENTOS.items() if c in colunas},chunksize=int(tamanho_bloco))
+    minimos = []
+    for bloco in leitor:
+        bloco = bloco[_eventos_validos(bloco)]
+        if len(bloco):
+            minimos.append(_janelas(pd.to_datetime(bloco['data_idx'],format=FORMATO_DATA_IDX),w).min())
+    return min(minimos) if minimos else 0
 
 def main():
+    if args.DiscrEspacial == 'divisas':
+        return main_blocos()
+
+    # retangulos: os limites e a numeração das células dependem de todos os eventos, que são então processados de uma vez
     print('Lendo dados de entrada e fazendo tratamentos iniciais...',end='')
-    df = leitura_eventos(group=int(args.GrupoTempo))
+    df = leitura_eventos(group=int(args.GrupoTempo),tamanho_bloco=int(args.TamanhoBloco),arquivo=args.Eventos)
     print('ok')
     
     print('Executando discretização espacial...',end='')
-    df = geo_discretizar(df,args.DiscrEspacial,nx=args.NX,ny=args.NY)
+    df = geo_discretizar(df,args.DiscrEspacial,nx=args.NX,ny=args.NY,tamanho_bloco=int(args.TamanhoBloco))
     print('ok')
 
     print('Executando discretização temporal...',end='')
-    df = temp_discretizar(df,w=args.DiscrTemporal)
+    df = temp_discretizar(df,w=args.DiscrTemporal,relativo=args.Armazem is None)
     print('ok')
 
+    if args.Armazem is not None:
+        print('Ingerindo contagens no armazém...',end='')
+        meses = ArmazemContagens(args.Armazem).ingerir(df,substituir=args.Substituir)
+        print('ok ({} meses atualizados)'.format(len(meses)))
+        return
+
     print('Escrevendo dados tratados...',end='')
-    df.to_pickle(os.path.join(TRTD_DATA_PATH,'eventos.pkl'))
+    escrever_eventos(df,os.path.join(TRTD_DATA_PATH,'eventos'))
     print('ok')
 
+def main_blocos():
+    '''
+    Processa os eventos bloco a bloco (leitura, discretização espacial e temporal, escrita ou ingestão no armazém),
+    de forma que a memória usada depende de --TamanhoBloco e não do histórico completo de eventos
+    '''
+    tamanho_bloco = int(args.TamanhoBloco)
+    janela_inicial = None
+    if args.Armazem is None:
+        print('Calculando a primeira janela de tempo...',end='')
+        janela_inicial = janela_minima(w=args.DiscrTemporal,tamanho_bloco=tamanho_bloco,arquivo=args.Eventos)
+        print('ok')
+        escritor = EscritorEventos(os.path.join(TRTD_DATA_PATH,'eventos'))
+    else:
+        armazem = ArmazemContagens(args.Armazem)
+        # com substituir, apenas a primeira ingestão de cada data a substitui; blocos seguintes com a mesma data são somados
+        datas_ingeridas, meses = set(), set()
+
+    bairros = leitura_bairros()
+    for bloco in blocos_eventos(group=int(args.GrupoTempo),tamanho_bloco=tamanho_bloco,arquivo=args.Eventos):
+        if len(bloco) == 0:
+            continue
+        bloco = _geo_discretizar_bloco(bloco,bairros)
+        bloco = temp_discretizar(bloco,w=args.DiscrTemporal,relativo=args.Armazem is None,janela_inicial=janela_inicial)
+        if args.Armazem is None:
+            escritor.escrever(bloco)
+        elif args.Substituir:
+            novas = ~bloco['data'].isin(datas_ingeridas)
+            meses.update(armazem.ingerir(bloco[novas],substituir=True))
+            meses.update(armazem.ingerir(bloco[~novas]))
+            datas_ingeridas.update(bloco['data'].unique())
+        else:
+            meses.update(armazem.ingerir(bloco))
+
+    if args.Armazem is not None:
+        print('{} meses atualizados no armazém'.format(len(meses)))
+
 if __name__ == '__main__':
     main()
     
\ No newline at end of file
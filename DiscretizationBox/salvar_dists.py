@@ -6,13 +6,25 @@ from tqdm import tqdm
 from config import *
 from utils import *
 
-df = pd.read_pickle(os.path.join(TRTD_DATA_PATH,'eventos.pkl'))
-bairro_to_idx = df[['i','nome_bairro']].drop_duplicates().set_index('nome_bairro')['i'].to_dict()
-lista_bairros = bairro_to_idx.values()
+# diretório de contagens (ArmazemContagens) opcional: as distribuições são calculadas a partir das contagens
+# armazenadas, sem reler os eventos
+armazem = sys.argv[1] if len(sys.argv) > 1 else None
+
+if armazem is None:
+    # apenas as colunas usadas nas distribuições
+    df = ler_eventos(os.path.join(TRTD_DATA_PATH,'eventos'),colunas=['t','g','i','p','data','hora','nome_bairro'])
+    bairro_to_idx = df[['i','nome_bairro']].drop_duplicates().set_index('nome_bairro')['i'].to_dict()
+    lista_bairros = bairro_to_idx.values()
+
+    # contagens de todas as combinações (t, g, i, p) calculadas uma única vez
+    cubo = CuboContagens(df)
+else:
+    cubo = ArmazemContagens(armazem).cubo()
+    lista_bairros = cubo.valores[2]
 
 r = []
 for i in tqdm(lista_bairros,desc='Calculando distribuições'):
-    d = calcular_distribuicao(df,12,1,i,1,tipo_discretizacao_temp=0)
+    d = cubo.distribuicao(12,1,i,1,tipo_discretizacao_temp=0)
     for j in d:
         r.append([i,j])
 
@@ -1,9 +1,75 @@
+import base64
+import zlib
 import geopandas
 from geopandas import GeoDataFrame
 from shapely.geometry import Polygon
 import numpy as np
+import shapely
+
+from .adjacency import Adjacency, RowIndex, set_adjacency
+
+#(dx, dy) offsets of the neighbors of a square, in the order they are listed
+NEIGHBORHOOD_OFFSETS = {
+    '4' : [(1, 0), (-1, 0), (0, 1), (0, -1)],
+    '8' : [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)],
+}
+
+#grid metadata attached to rectangle discretizations (GeoDataFrame.attrs[GRID_ATTR]), used to assign points to cells with arithmetic. See points.py
+GRID_ATTR = 'rectangle_grid'
+
+class RectangleGrid:
+    '''
+        Origin and size of the squares of a rectangle discretization. Rows are sorted by square (index iy * nx + ix), and the rows of square s
+        are first_row[s]:first_row[s + 1]. interior[row] is True if the row is a whole square (not clipped by the region boundary).
+        rows is the RowIndex of the discretization, as the grid only describes it while its rows are not reordered
+    '''
+    def __init__(self, minx, miny, deltax, deltay, nx, ny, first_row, interior, rows):
+        self.minx, self.miny, self.deltax, self.deltay = float(minx), float(miny), float(deltax), float(deltay)
+        self.nx, self.ny = int(nx), int(ny)
+        self.first_row = np.asarray(first_row, dtype=np.int64)
+        self.interior = np.asarray(interior, dtype=bool)
+        self.rows = rows
+
+    def __eq__(self, other):
+        if not isinstance(other, RectangleGrid):
+            return NotImplemented
+        return ((self.minx, self.miny, self.deltax, self.deltay, self.nx, self.ny) == (other.minx, other.miny, other.deltax, other.deltay, other.nx, other.ny)
+                and np.array_equal(self.first_row, other.first_row) and np.array_equal(self.interior, other.interior) and self.rows == other.rows)
+
+    def __repr__(self):
+        return 'RectangleGrid(nx={}, ny={}, rows={})'.format(self.nx, self.ny, len(self.interior))
+
+    #immutable in practice, so copies of a GeoDataFrame (which deep copy attrs) share it
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def to_metadata(self) -> dict:
+        '''
+            JSON serializable form of the grid, as stored by parquet_io.write_parquet. The square of every row and the interior flags are stored as compressed arrays
+        '''
+        squares = np.repeat(np.arange(self.nx * self.ny, dtype=np.int64), np.diff(self.first_row))
+        return {'minx' : self.minx, 'miny' : self.miny, 'deltax' : self.deltax, 'deltay' : self.deltay, 'nx' : self.nx, 'ny' : self.ny,
+                'squares' : _pack(squares), 'interior' : _pack(np.packbits(self.interior))}
+
+    @classmethod
+    def from_metadata(cls, metadata : dict, rows):
+        '''
+            Inverse of to_metadata, for a discretization whose RowIndex is rows
+        '''
+        squares = np.frombuffer(_unpack(metadata['squares']), dtype=np.int64)
+        interior = np.unpackbits(np.frombuffer(_unpack(metadata['interior']), dtype=np.uint8), count=len(squares)).astype(bool)
+        first_row = np.searchsorted(squares, np.arange(metadata['nx'] * metadata['ny'] + 1))
+        return cls(metadata['minx'], metadata['miny'], metadata['deltax'], metadata['deltay'], metadata['nx'], metadata['ny'], first_row, interior, rows)
+
+def _pack(array) -> str:
+    return base64.b64encode(zlib.compress(np.ascontiguousarray(array).tobytes())).decode('ascii')
+
+def _unpack(text : str) -> bytes:
+    return zlib.decompress(base64.b64decode(text))
 
-#maybe to-do: support 8-neighborhood instead of only 4-neighborhood. Should be pretty easy to do
 def rectangle_discretization(gdf : GeoDataFrame, nx : int, ny : int, *, neighborhood = '8'):
     '''
         Construct a square discretized gdf from the original region. The final discretization is intended to be a grid of nx per ny rectangles.
@@ -22,52 +88,68 @@ def rectangle_discretization(gdf : GeoDataFrame, nx : int, ny : int, *, neighbor
     '''
     if nx <= 0 or ny <= 0:
         raise ValueError("nx and ny must be strictly positive")
+    if neighborhood not in NEIGHBORHOOD_OFFSETS:
+        raise ValueError("Invalid neighborhood type " + neighborhood)
     minx, miny, maxx, maxy = gdf.geometry.total_bounds
 
     deltay = (maxy - miny) / ny
     deltax = (maxx - minx) / nx
 
-    #construct 'squares' GeoDataFrame. Lots of rectangles covering the entire study region
-    squares = []
-    indices = []
-    neighbors = []
-    valid_index = lambda ix, iy : True if ix >= 0 and iy >= 0 and ix < nx and iy < ny else False
-    index = lambda ix, iy : iy * ny + ix if valid_index(ix, iy) else None
-
-    for iy in range(ny):
-        for ix in range(nx):
-            cx, cy = minx + ix * deltax, miny + iy * deltay
-            pol = Polygon([(cx, cy), (cx + deltax, cy), (cx + deltax, cy + deltay), (cx, cy + deltay)])
-            squares.append(pol)
-            indices.append(index(ix, iy))
-            if neighborhood == '4':
-                my_neighbors = [index(ix + 1, iy), index(ix - 1, iy), index(ix, iy + 1), index(ix, iy - 1)]
-            elif neighborhood == '8':
-                my_neighbors = [index(ix + 1, iy), index(ix - 1, iy), index(ix, iy + 1), index(ix, iy - 1),
-                                index(ix + 1, iy + 1), index(ix + 1, iy - 1), index(ix - 1, iy + 1), index(ix - 1, iy - 1)]
-            else:
-                raise ValueError("Invalid neighborhood type " + neighborhood)
-            my_neighbors = [n for n in my_neighbors if n is not None]
-            neighbors.append(my_neighbors)
-
-    squares = geopandas.GeoSeries(squares)
-    squares_gdf = geopandas.GeoDataFrame({'geometry' : squares, 'myindex' : indices, 'neighbors' : neighbors}, crs = "EPSG:4326")
-
-    #calculate the intersection between this squares gdf and the original region
-    res_intersection = geopandas.overlay(squares_gdf, gdf, how='intersection')
-    res_intersection.set_crs("EPSG:4326")
-
-    #when calculating the intersection, some rectangles may have been dropped entirely
-    #thus, we need to adjust the 'neighbor' column to correctly reflect the new indices
-    #that's why we keep a auxiliary 'myindex' column. We just need to adjust 'myindex' to actual indexes
-    new_neighbors = []
-    for i, row in res_intersection.iterrows():
-        new_list = [res_intersection.index[res_intersection['myindex'] == n] for n in row['neighbors']]
-        new_list = [item for sublist in new_list for item in sublist] #flatten lists
-        new_neighbors.append(new_list)
-    res_intersection['neighbors'] = new_neighbors
-
-
-    return res_intersection.drop(['myindex'], axis = 1)
+    #construct 'squares'. Lots of rectangles covering the entire study region, built at once. Square index = iy * nx + ix
+    ix = np.tile(np.arange(nx), ny)
+    iy = np.repeat(np.arange(ny), nx)
+    cx, cy = minx + ix * deltax, miny + iy * deltay
+    corners = np.stack([np.stack([cx, cy], axis=1), np.stack([cx + deltax, cy], axis=1),
+                        np.stack([cx + deltax, cy + deltay], axis=1), np.stack([cx, cy + deltay], axis=1)], axis=1)
+    squares = shapely.polygons(corners)
+
+    #calculate the intersection between the squares and the original region. Only (square, region) pairs whose bounding boxes overlap are tested,
+    #squares fully inside a region are kept as they are and only the ones on the boundary are actually clipped
+    regions = np.asarray(gdf.geometry)
+    reg_idx, sq_idx = shapely.STRtree(squares).query(regions, predicate='intersects')
+    order = np.lexsort((reg_idx, sq_idx))
+    reg_idx, sq_idx = reg_idx[order], sq_idx[order]
+
+    shapely.prepare(regions)
+    geometries = squares[sq_idx]
+    boundary = ~shapely.contains(regions[reg_idx], geometries)
+    geometries[boundary] = shapely.intersection(geometries[boundary], regions[reg_idx[boundary]])
+
+    #as geopandas.overlay does, only keep polygonal results (touching squares yield lines or points)
+    geometries = _polygonal_part(geometries)
+    keep = ~shapely.is_empty(geometries)
+    reg_idx, sq_idx, geometries = reg_idx[keep], sq_idx[keep], geometries[keep]
+
+    res_intersection = GeoDataFrame(gdf.drop(columns=gdf.geometry.name).iloc[reg_idx].reset_index(drop=True),
+                                    geometry=geopandas.GeoSeries(geometries), crs="EPSG:4326")
+
+    #when calculating the intersection, some rectangles may have been dropped entirely, and others may have been split between many region rows
+    #thus, neighbors must be remapped from square indexes to row indexes. Rows are sorted by square, so the rows of every square are a contiguous range
+    first_row = np.searchsorted(sq_idx, np.arange(nx * ny + 1))
+    sources, targets = [], []
+    for dx, dy in NEIGHBORHOOD_OFFSETS[neighborhood]:
+        nix, niy = ix[sq_idx] + dx, iy[sq_idx] + dy
+        valid = (nix >= 0) & (niy >= 0) & (nix < nx) & (niy < ny)
+        rows = np.flatnonzero(valid)
+        neighbor_squares = niy[valid] * nx + nix[valid]
+        start, count = first_row[neighbor_squares], first_row[neighbor_squares + 1] - first_row[neighbor_squares]
+        #expand every (row, square) pair into (row, row of square) pairs
+        offsets = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        sources.append(np.repeat(rows, count))
+        targets.append(np.repeat(start, count) + offsets)
+
+    set_adjacency(res_intersection, Adjacency.from_pairs(np.concatenate(sources), np.concatenate(targets), len(res_intersection)))
+    res_intersection.attrs[GRID_ATTR] = RectangleGrid(minx, miny, deltax, deltay, nx, ny, first_row, ~boundary[keep], RowIndex(res_intersection.index))
 
+    return res_intersection
 
+#helper function: keeps only the polygonal parts of each geometry (empty if there are none)
+def _polygonal_part(geometries):
+    polygonal = np.isin(shapely.get_type_id(geometries), [3, 6]) #Polygon, MultiPolygon
+    collections = np.flatnonzero(shapely.get_type_id(geometries) == 7) #GeometryCollection
+    for i in collections:
+        parts = [part for part in shapely.get_parts(geometries[i]) if part.geom_type in ('Polygon', 'MultiPolygon')]
+        geometries[i] = shapely.union_all(parts) if parts else Polygon()
+        polygonal[i] = True
+    geometries[~polygonal] = Polygon()
+    return geometries
@@ -0,0 +1,96 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+'''
+This file defines the HTTP plumbing shared by the travel time providers: a pooled keep-alive session, token bucket rate limits
+and retries with exponential backoff.
+'''
+
+#HTTP statuses worth retrying: rate limited or temporary server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class TokenBucket:
+	'''
+		Thread safe token bucket. Tokens are refilled continuously at rate_per_minute, up to capacity (by default, one minute worth of tokens)
+	'''
+	def __init__(self, rate_per_minute : float, capacity : float = None, clock = time.monotonic, sleep = time.sleep):
+		if rate_per_minute <= 0:
+			raise ValueError("rate_per_minute must be positive. Got {}".format(rate_per_minute))
+		self.rate = rate_per_minute / 60.0
+		self.capacity = float(capacity if capacity is not None else rate_per_minute)
+		self.tokens = self.capacity
+		self.clock = clock
+		self.sleep = sleep
+		self.last = clock()
+		self.lock = threading.Lock()
+
+	def acquire(self, amount : float = 1):
+		'''
+			Block until amount tokens are available, then take them. Amounts larger than the capacity are capped to it, so they wait for a full bucket instead of forever
+		'''
+		amount = min(amount, self.capacity)
+		while True:
+			with self.lock:
+				now = self.clock()
+				self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+				self.last = now
+				if self.tokens >= amount:
+					self.tokens -= amount
+					return
+				wait = (amount - self.tokens) / self.rate
+			self.sleep(wait)
+
+class RateLimiter:
+	'''
+		Combination of optional per minute limits on the number of requests and on the credits (API cost units) they spend
+	'''
+	def __init__(self, requests_per_minute : float = None, credits_per_minute : float = None):
+		self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+		self.credits = TokenBucket(credits_per_minute) if credits_per_minute else None
+
+	def acquire(self, credits : float = 1):
+		if self.requests is not None:
+			self.requests.acquire(1)
+		if self.credits is not None:
+			self.credits.acquire(credits)
+
+def make_session(pool_size : int = 10) -> requests.Session:
+	'''
+		requests.Session with a connection pool large enough for pool_size concurrent requests. Connections are kept alive between requests
+	'''
+	session = requests.Session()
+	adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+	session.mount('http://', adapter)
+	session.mount('https://', adapter)
+	return session
+
+def request_with_retries(session : requests.Session, method : str, url : str, *, max_retries : int = 5, backoff : float = 1.0, sleep = time.sleep,
+		retry_if = None, on_attempt = None, **kwargs) -> requests.Response:
+	'''
+		Send a request, retrying with exponential backoff (backoff * 2 ** attempt seconds, or the server's Retry-After) on connection errors and RETRY_STATUSES.
+		retry_if, if given, is called with every other response and returns True if it must be retried as well (e.g. API level rate limit answers sent with 200).
+		on_attempt, if given, is called before every attempt, retries included (e.g. to take rate limit tokens).
+		The last response (or exception) is returned (or raised) once max_retries retries are exhausted
+	'''
+	for attempt in range(max_retries + 1):
+		if on_attempt is not None:
+			on_attempt()
+		try:
+			response = session.request(method, url, **kwargs)
+		except (requests.ConnectionError, requests.Timeout):
+			if attempt == max_retries:
+				raise
+			sleep(backoff * 2 ** attempt)
+			continue
+		retry = response.status_code in RETRY_STATUSES or (retry_if is not None and retry_if(response))
+		if not retry or attempt == max_retries:
+			return response
+		retry_after = response.headers.get('Retry-After')
+		try:
+			wait = float(retry_after) if retry_after is not None else backoff * 2 ** attempt
+		except ValueError:
+			wait = backoff * 2 ** attempt
+		sleep(wait)
+	return response
@@ -1,81 +1,170 @@
-import googlemaps as gm
-import json
-import sys
-import requests
+import math
+import time
 import numpy as np
-import urllib.parse
-from itertools import tee
-from geopandas import GeoDataFrame
-
-# Example of usage of the googlemaps API
-def teste_gm(gmaps, times, n, origins, destinations):
-	mode = "driving"
-	units = "metric"
-	print(len(origins), len(destinations))
-	for i in range(n):
-		for j in range(n):
-			print(i,j,times[i][j],end=": ")
-			result = gmaps.distance_matrix(origins=origins[i],destinations=destinations[j], 
-				mode=mode, units=units)
-			print(result["rows"][0]["elements"][0]["duration"]["value"])
-
-# Makes a travel time request on a partition of the data matrix
-def make_req_gm(gmaps, indexes, times,from_,to_):
-	mode = "driving"
-	units = "metric"
-	result = gmaps.distance_matrix(from_, to_, mode=mode, units=units)
-	n = len(to_)
-	for i in range(len(indexes)):
-		for j in range(n):
-			times[indexes[i]][j] = result["rows"][i]["elements"][j]["duration"]["value"]
-
-
-# Recursively partitions the data matrix so the googlemaps API can handle it
-def rec(gmaps, indexes, times, from_, to_):
-	if len(to_) > 100:
-		raise ValueError()
-	elif len(from_)*len(to_) >  100:
-		n = len(from_)
-		rec(gmaps, indexes[:n//2], times, from_[:n//2], to_)
-		rec(gmaps, indexes[n//2:], times, from_[n//2:], to_)
-	else:
-		make_req_gm(gmaps, indexes, times,from_,to_)
-
-
-# Read a list of lat longs from the input file path and calls the recursive algorithm to
-# get the travel times
-def get_googlemaps(path):
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import RateLimiter, make_session, request_with_retries
+from .matrix import allocate_matrix, place_block
+
+'''
+This file defines the Google Maps Distance Matrix provider.
+
+Requests are packed to the API limits (at most 25 origins, 25 destinations and 100 elements each), sent concurrently over a pooled session
+and throttled by element quota. The result has the same layout as graphhopper.gen_distance_matrix: [i,j] is the travel time from i to j, in seconds.
+'''
+
+GG_KEY = "NOT SET"
+
+def set_googlemaps_key(key):
+	global GG_KEY
+	GG_KEY = key
+
+GG_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+
+#per request limits of the Distance Matrix API
+MAX_ORIGINS = 25
+MAX_DESTINATIONS = 25
+MAX_ELEMENTS = 100
 
-	gmaps = gm.Client(key=GG_KEY)
-
-	arq = open(path,"r")
-	n = int(arq.readline())
-	origins = []
-	destinations = []
-	for line in arq.readlines():
-		lat, longi = [float(x) for x in line.split()]
-		origins.append((lat,longi))
-		destinations.append((lat,longi))
-	arq.close()
-
-	times = []
-	for i in range(n):
-		times.append([0]*n)
-	rec(gmaps,range(n),times,origins,destinations)
-	return n,times
-
-def gen_distance_matrix(origins, destinations):
+#top level statuses worth retrying
+RETRY_API_STATUSES = ("OVER_QUERY_LIMIT", "UNKNOWN_ERROR")
+
+def _retry_api_status(response) -> bool:
+	'''
+		True for answers whose API status asks to try again later (see RETRY_API_STATUSES)
+	'''
+	if response.status_code != 200:
+		return False
+	try:
+		return response.json().get("status") in RETRY_API_STATUSES
+	except ValueError:
+		return False
+
+class GoogleMapsClient:
 	'''
-		Use google maps' API to fetch distance matrix between origin and destination (lists of lat-long)
+		Concurrent, rate limited client for the Google Maps Distance Matrix API.
+
+		Params:
+			key : str - Google Maps API key. Defaults to the one set with set_googlemaps_key
+			base_url : str - distance matrix endpoint. Point it to a MockMatrixServer (server.url + '/maps/api/distancematrix/json') to test without network access
+			mode : str - travel mode ('driving', 'walking', 'bicycling' or 'transit')
+			n_workers : int - maximum number of concurrent requests
+			requests_per_minute, elements_per_minute : float - optional rate limits. None means unlimited
+			max_retries : int - retries per request on 429 / 5xx / connection errors and on OVER_QUERY_LIMIT answers
+			backoff : float - base of the exponential backoff, in seconds
+			timeout : float - timeout of each request, in seconds
 	'''
-	if len(origins) !=  len(destinations):
-		raise ValueError()
-	
-	gmaps = gm.Client(key=GG_KEY)
+	def __init__(self, key = None, *, base_url = GG_URL, mode = "driving", n_workers = 4, requests_per_minute = None, elements_per_minute = None,
+			max_retries = 5, backoff = 1.0, timeout = 120, sleep = time.sleep):
+		self.key = key
+		self.base_url = base_url
+		self.mode = mode
+		self.n_workers = n_workers
+		self.limiter = RateLimiter(requests_per_minute, elements_per_minute)
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.sleep = sleep
+		self.session = make_session(n_workers)
+
+	def close(self):
+		self.session.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
 
-	times = [] #numpy???
-	for i in range(n):
-		times.append([0]*n)
-	rec(gmaps, range(n), times, origins, destinations)
+	@staticmethod
+	def _points(points):
+		return "|".join("{:.6f},{:.6f}".format(lat, longi) for longi, lat in points)
 
-	return n, times
\ No newline at end of file
+	def matrix(self, from_, to_):
+		'''
+			Request the travel times from every point in from_ to every point in to_ (lists of [longi, lat]), within the per request limits.
+			Returns a list of lists, in seconds (None for pairs without a route)
+		'''
+		if len(from_) > MAX_ORIGINS or len(to_) > MAX_DESTINATIONS or len(from_) * len(to_) > MAX_ELEMENTS:
+			raise ValueError("A request is limited to {} origins, {} destinations and {} elements. Got {} x {}".format(
+				MAX_ORIGINS, MAX_DESTINATIONS, MAX_ELEMENTS, len(from_), len(to_)))
+		params = {"origins" : self._points(from_), "destinations" : self._points(to_), "mode" : self.mode, "units" : "metric",
+			"key" : self.key if self.key is not None else GG_KEY}
+		elements = len(from_) * len(to_)
+		#a single retry layer: HTTP errors and OVER_QUERY_LIMIT answers share the retry budget and backoff, and every attempt takes its tokens
+		r = request_with_retries(self.session, "GET", self.base_url, params=params, max_retries=self.max_retries, backoff=self.backoff, sleep=self.sleep,
+			retry_if=_retry_api_status, on_attempt=lambda: self.limiter.acquire(elements), timeout=self.timeout)
+		response_data = r.json()
+		status = response_data.get("status")
+		if status == "OK":
+			return [[element["duration"]["value"] if element.get("status") == "OK" else None for element in row["elements"]]
+				for row in response_data["rows"]]
+		raise AssertionError("Distance Matrix request failed with status {} (HTTP {}): {}".format(status, r.status_code,
+			response_data.get("error_message", "no error message")))
+
+	def matrices(self, blocks):
+		'''
+			Request many (from_, to_) blocks concurrently. Yields the results in the order of blocks
+		'''
+		with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+			yield from executor.map(lambda block: self.matrix(*block), blocks)
+
+def block_shape(n_from : int, n_to : int):
+	'''
+		(origins, destinations) per request that covers an n_from x n_to matrix with the fewest requests within the API limits
+	'''
+	best = None
+	for cols in range(1, min(n_to, MAX_DESTINATIONS) + 1):
+		rows = min(n_from, MAX_ORIGINS, MAX_ELEMENTS // cols)
+		n_requests = math.ceil(n_from / rows) * math.ceil(n_to / cols)
+		if best is None or n_requests < best[0]:
+			best = (n_requests, rows, cols)
+	return best[1], best[2]
+
+def gen_distance_matrix(coords : list, *, client : GoogleMapsClient = None, dtype = np.float64, out = None, unreachable = None):
+	'''
+		Use Google Maps' Distance Matrix API to fetch the travel times between every pair of coordinates.
+
+		Params:
+			coords : list - a list of [longi, lat] lists specifying the coordinates of each point. The retuned matrix follows the index of this list
+			client : GoogleMapsClient - client used for the requests, with its concurrency and rate limits
+			dtype, out, unreachable - output matrix options, see graphhopper.gen_distance_matrix
+		Return:
+			numpy.ndarray - distance matrix, such that [i,j] indicates the travel time from i to j
+	'''
+	n = len(coords)
+	times = allocate_matrix((n, n), dtype, out)
+	if n == 0:
+		return times
+	rows_size, cols_size = block_shape(n, n)
+	blocks = [(np.arange(i, min(i + rows_size, n)), np.arange(j, min(j + cols_size, n))) for i in range(0, n, rows_size) for j in range(0, n, cols_size)]
+	block_coords = [([coords[a] for a in rows], [coords[b] for b in cols]) for rows, cols in blocks]
+
+	own_client = client is None
+	if own_client:
+		client = GoogleMapsClient()
+	try:
+		for (rows, cols), result in zip(blocks, client.matrices(block_coords)):
+			place_block(times, rows, cols, np.array(result, dtype=float), unreachable)
+	finally:
+		if own_client:
+			client.close()
+
+	if isinstance(times, np.memmap):
+		times.flush()
+	return times
+
+def get_googlemaps(path):
+	'''
+		Read a file with the number of points on its first line followed by one "lat long" per line, and fetch their travel time matrix.
+
+		Return:
+			(int, numpy.ndarray) - number of points and distance matrix
+	'''
+	coords = []
+	with open(path, "r") as arq:
+		n = int(arq.readline())
+		for line in arq.readlines():
+			lat, longi = [float(x) for x in line.split()]
+			coords.append([longi, lat])
+	return n, gen_distance_matrix(coords)
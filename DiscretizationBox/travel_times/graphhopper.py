@@ -1,10 +1,12 @@
 import json
-import requests
 import numpy as np
-import urllib.parse
-from itertools import tee
 from geopandas import GeoDataFrame
-import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import RateLimiter, make_session, request_with_retries
+from .pair_cache import as_travel_time_cache, plan_requests
+from .matrix import allocate_matrix, place_block
+from .jobs import MatrixJob, Progress
 
 GH_KEY = "NOT SET"
 
@@ -12,30 +14,90 @@ def set_graphhopper_key(key):
 	global GH_KEY
 	GH_KEY = key
 
+GH_URL = "https://graphhopper.com/api/1/matrix"
+
 def base_url_gh(key):
-	return "https://graphhopper.com/api/1/matrix?key={0}".format(key)
+	return "{0}?key={1}".format(GH_URL, key)
 
-def make_req_gh(from_,to_):
-	post_data = {}
-	post_data["from_points"] = from_
-	post_data["to_points"] = to_
-	post_data["out_arrays"] = ["times"]
-	post_data["vehicle"] = "car"
-	post_data["fail_fast"] = False
+class GraphHopperClient:
+	'''
+		Concurrent, rate limited client for the GraphHopper Matrix API.
 
-	post_headers = {"Content-Type" : "application/json"}
+		Requests share a pooled keep-alive session and run in a thread pool. Instead of fixed sleeps, they are throttled by token buckets
+		(requests per minute and/or credits per minute), and rate limited (429) or failed (5xx) requests are retried with exponential backoff.
 
-	global GH_KEY
+		Params:
+			key : str - GraphHopper API key. Defaults to the one set with set_graphhopper_key
+			base_url : str - matrix endpoint. Point it to a MockMatrixServer (see mock_server.py) to test without network access
+			vehicle : str - GraphHopper vehicle profile
+			n_workers : int - maximum number of concurrent requests
+			requests_per_minute, credits_per_minute : float - optional rate limits. None means unlimited
+			max_retries : int - retries per request on 429 / 5xx / connection errors
+			backoff : float - base of the exponential backoff, in seconds
+			timeout : float - timeout of each request, in seconds
+	'''
+	def __init__(self, key = None, *, base_url = GH_URL, vehicle = "car", n_workers = 4, requests_per_minute = None, credits_per_minute = None,
+			max_retries = 5, backoff = 1.0, timeout = 120):
+		self.key = key
+		self.base_url = base_url
+		self.vehicle = vehicle
+		self.n_workers = n_workers
+		self.limiter = RateLimiter(requests_per_minute, credits_per_minute)
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.session = make_session(n_workers)
+
+	def close(self):
+		self.session.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	@staticmethod
+	def credits(n_from, n_to):
+		'''
+			Approximate credit cost of a matrix request (GraphHopper charges about half a credit per matrix element)
+		'''
+		return max(1, (n_from * n_to) // 2)
+
+	def matrix(self, from_, to_):
+		'''
+			Request the travel times from every point in from_ to every point in to_ (lists of [longi, lat]). Returns a list of lists, in seconds
+		'''
+		post_data = {}
+		post_data["from_points"] = from_
+		post_data["to_points"] = to_
+		post_data["out_arrays"] = ["times"]
+		post_data["vehicle"] = self.vehicle
+		post_data["fail_fast"] = False
+
+		post_headers = {"Content-Type" : "application/json"}
+
+		credits = self.credits(len(from_), len(to_))
+		key = self.key if self.key is not None else GH_KEY
+		#every attempt takes its tokens, so retries after a 429 stay within the rate limits as well
+		r = request_with_retries(self.session, "POST", self.base_url, params={"key" : key}, data=json.dumps(post_data), headers=post_headers,
+			max_retries=self.max_retries, backoff=self.backoff, on_attempt=lambda: self.limiter.acquire(credits), timeout=self.timeout)
+		response_data = r.json()
+		if "times" in response_data:
+			return response_data["times"]
+		else:
+			raise AssertionError("'times' key not in request response (status {}): {}".format(r.status_code, response_data))
+
+	def matrices(self, blocks):
+		'''
+			Request many (from_, to_) blocks concurrently. Yields the results in the order of blocks
+		'''
+		with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+			yield from executor.map(lambda block: self.matrix(*block), blocks)
 
-	r = requests.post(base_url_gh(GH_KEY), data=json.dumps(post_data), headers=post_headers)
-	response_data = r.json()
-	if "times" in response_data:
-		times = response_data["times"]
-		return times
-	else:
-		print(response_data)
-		raise AssertionError("'times' key not in request response")
-		return None
+def make_req_gh(from_,to_):
+	with GraphHopperClient() as client:
+		return client.matrix(from_, to_)
 
 def chunks(coords, k=5):
 	for i in range(0,len(coords),k):
@@ -64,58 +126,123 @@ def gen_distance_matrix_from_file(path):
 		lat, longi = [float(x) for x in line.split()]
 		coords.append([longi,lat])
 
-	return graphhopper_getDistanceMatrix(coords)
+	return gen_distance_matrix(coords)
 	
-def gen_distance_matrix(coords : list, wait_time = True):
+def gen_distance_matrix(coords : list, wait_time = True, *, client : GraphHopperClient = None, cache = None, dtype = np.float64, out = None, unreachable = None,
+		checkpoint_dir = None, progress = None):
 	'''
 		Use graphhopper requests to fetch distance matrix between origin and destination (lists of lat-long). 
 		The ndarray returned is such that [i,j] indicates the travel time from i to j. Notice that this matrix is *not* symmetric
 
 		Params:
 			coords : list - a list of [longi, lat] lists specifying the coordinates of each point. The retuned matrix follows the index of this list
-			wait_time : bool - because of API limitation for non-paying users you might want to wait 1 second per request!
+			wait_time : bool - because of API limitation for non-paying users you might want to throttle requests! If True (and no client is given), at most one request per minute is sent
+			client : GraphHopperClient - client used for the requests, with its concurrency and rate limits. Overrides wait_time
+			cache : (TravelTimeCache, str) - persistent pairwise cache (or the path of its database). Only the pairs missing from it are requested,
+				grouped into as few matrix requests as possible, and the fresh values are stored back
+			dtype : numpy dtype - dtype of the matrix. float32 halves the memory of the default float64; integer dtypes (e.g. uint32) hold whole seconds
+			out : (None, numpy.ndarray, str) - where to write the matrix: a new array (default), a caller provided (n, n) array or the path of a
+				memory-mapped .npy file to create. See matrix.allocate_matrix
+			unreachable : scalar - value stored for unreachable pairs. Defaults to NaN for float dtypes and to the dtype's maximum for integer dtypes
+			checkpoint_dir : str - job directory. The planned chunks and every completed chunk are written there as they arrive, and calling
+				gen_distance_matrix again with the same directory (and coordinates) resumes the job instead of starting over. See jobs.MatrixJob
+			progress : (bool, callable) - True prints progress and ETA every few seconds; a callable is called with (done, total, eta_seconds) after every chunk
 			return:
 				numpy.ndarray - distance matrix 
 	'''
 	n = len(coords)
-	times = np.zeros((n,n))
 	c_size  = 39
-	from_ = list(chunks(coords,c_size))
-	to_ = list(chunks(coords, c_size))
-
-
-	
-	chunk_times = {}
-	for i in range(len(from_)):
-		for j in range(len(to_)):
-			chunk_times[(i,j)] = make_req_gh(from_[i], to_[j])
-			if wait_time:
-				time.sleep(60) # wait a *minute*
-
-	
-
-	for i in range(len(from_)):
-		for j in range(0,len(to_)):
-			for a in range(i*c_size,min(i*c_size+c_size, n)):
-				for b in range(j*c_size, min(j*c_size+c_size, n)):
-					times[a,b] = chunk_times[(i,j)][a % c_size][b % c_size]
 
+	own_client = client is None
+	if own_client:
+		client = GraphHopperClient(requests_per_minute = 1 if wait_time else None)
+	times = allocate_matrix((n,n), dtype, out)
+	if cache is not None:
+		cache = as_travel_time_cache(cache)
+		cached, found = cache.lookup(coords, coords, "graphhopper", client.vehicle)
+		place_block(times, np.arange(n), np.arange(n), cached, unreachable)
+		missing = ~found
+	else:
+		missing = np.ones((n,n), dtype=bool)
+
+	blocks = plan_requests(missing, c_size)
+	numbers = list(range(len(blocks)))
+	job = None
+	if checkpoint_dir is not None:
+		job = MatrixJob.open(checkpoint_dir, coords, blocks, provider="graphhopper", profile=client.vehicle)
+		blocks, numbers = job.blocks, job.pending()
+		for rows, cols, result in job.completed():
+			place_block(times, rows, cols, result, unreachable)
+	tracker = None
+	if progress:
+		tracker = Progress(len(blocks), len(blocks) - len(numbers), callback = progress if callable(progress) else None)
+
+	block_coords = [([coords[a] for a in blocks[i][0]], [coords[b] for b in blocks[i][1]]) for i in numbers]
+	try:
+		for i, (from_, to_), result in zip(numbers, block_coords, client.matrices(block_coords)):
+			rows, cols = blocks[i]
+			result = np.array(result, dtype=float) #unreachable pairs (null) become nan
+			if job is not None:
+				job.save(i, result)
+			place_block(times, rows, cols, result, unreachable)
+			if cache is not None:
+				cache.store(from_, to_, result, "graphhopper", client.vehicle)
+			if tracker is not None:
+				tracker.update()
+	finally:
+		if own_client:
+			client.close()
+
+	if isinstance(times, np.memmap):
+		times.flush()
 	return times
 
-def distance_matrix_from_gdf(gdf : GeoDataFrame):
+#provider keyword arguments accepted by the sparse mode of distance_matrix_from_gdf (see sparse.sparse_distance_matrix_from_gdf)
+SPARSE_KWARGS = {"c_size"}
+
+def distance_matrix_from_gdf(gdf : GeoDataFrame, wait_time = True, *, client : GraphHopperClient = None, cache = None, provider = "graphhopper", k = None, radius_m = None, **provider_kwargs):
 	'''
-		Assuming a geodataframe in this project's usual format, calculate a distance matrix using graphhopper
+		Assuming a geodataframe in this project's usual format, calculate a distance matrix using graphhopper (or another provider)
 
 		Params:
 			gdf : GeoDataFrame - a geodataframe enriched with columns 'center_lat' and 'center_lon' indicating each geometries center coordinates.
+			wait_time, client, cache - see gen_distance_matrix
+			provider : str - where travel times come from:
+				'graphhopper' - the GraphHopper Matrix API (default)
+				'local' - a local road graph, see local.gen_distance_matrix. Requires a graph keyword argument
+				'haversine' - great circle estimate, see haversine.gen_distance_matrix. Meant for very large matrices
+				'googlemaps' - the Google Maps Distance Matrix API, see googlemaps.gen_distance_matrix
+			k, radius_m - sparse mode: if either is given, only the travel times between nearby cells are requested (see sparse.candidate_pairs)
+				and a scipy.sparse matrix is returned (cache is used in this mode too). Only available for the graphhopper provider
+			provider_kwargs - extra keyword arguments passed to the provider's gen_distance_matrix (in the sparse mode, only c_size)
 
 		Return:
 			numpy.ndarray - distance matrix, such that [i,j] indicates the travel time from i to j. Notice that this matrix is *not* symmetric
 	'''
-	coords = []
-	for _t , row in gdf.iterrows():
-		lat, longi = row['center_lat'], row['center_lon']
-		coords.append([longi,lat])
-
-	return gen_distance_matrix(coords)
-
+	coords = [[longi, lat] for lat, longi in zip(gdf['center_lat'].tolist(), gdf['center_lon'].tolist())]
+
+	if cache is not None and provider != "graphhopper":
+		raise ValueError("The travel time cache is only available for the graphhopper provider. Got provider " + str(provider))
+
+	if k is not None or radius_m is not None:
+		if provider != "graphhopper":
+			raise ValueError("The sparse mode (k / radius_m) is only available for the graphhopper provider")
+		unsupported = sorted(set(provider_kwargs) - SPARSE_KWARGS)
+		if unsupported:
+			raise TypeError("Keyword arguments {} are not supported in the sparse mode (k / radius_m). Supported: {}".format(unsupported, sorted(SPARSE_KWARGS)))
+		from .sparse import sparse_distance_matrix_from_gdf
+		return sparse_distance_matrix_from_gdf(gdf, k = k, radius_m = radius_m, client = client, wait_time = wait_time, cache = cache, **provider_kwargs)
+
+	if provider == "graphhopper":
+		return gen_distance_matrix(coords, wait_time, client = client, cache = cache, **provider_kwargs)
+	elif provider == "local":
+		from . import local
+		return local.gen_distance_matrix(coords, **provider_kwargs)
+	elif provider == "haversine":
+		from . import haversine
+		return haversine.gen_distance_matrix(coords, **provider_kwargs)
+	elif provider == "googlemaps":
+		from . import googlemaps
+		return googlemaps.gen_distance_matrix(coords, client = client, **provider_kwargs)
+	else:
+		raise ValueError("Unknown travel time provider " + str(provider))
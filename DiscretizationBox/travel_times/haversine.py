@@ -0,0 +1,74 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from .matrix import allocate_matrix
+
+'''
+This file defines an approximate travel time provider for very large N: great circle distance x detour factor / speed.
+
+There is no network access and no quota, so it is meant for scenario screening between tens of thousands of cell centers.
+The matrix is computed in blocks, can be written straight to a memory-mapped file and uses multiple threads (NumPy releases the GIL).
+'''
+
+EARTH_RADIUS_KM = 6371.0088
+
+def gen_distance_matrix(coords : list, *, speed_kmh : float = 30.0, detour_factor : float = 1.3, dtype = np.float32, out = None,
+		block_size : int = 1024, n_jobs : int = 1) -> np.ndarray:
+	'''
+		Estimate the travel time matrix between coordinates as great circle distance * detour_factor / speed_kmh.
+
+		Params:
+			coords : list - a list of [longi, lat] lists (or a (n, 2) array). The retuned matrix follows the index of this list
+			speed_kmh : float - average travel speed
+			detour_factor : float - ratio between road and great circle distances. See calibrate to fit both from a sample of real travel times
+			dtype : numpy dtype - dtype of the matrix. float32 (default) halves the memory of float64
+			out : (None, numpy.ndarray, str) - where to write the matrix. A path creates a memory-mapped .npy file, so 50k x 50k (10 GB in float32)
+				needs no more RAM than a few blocks. See matrix.allocate_matrix
+			block_size : int - rows and columns per block. Each thread holds a few block_size x block_size float64 temporaries
+			n_jobs : int - number of threads. -1 or None uses every core
+		Return:
+			numpy.ndarray - matrix such that [i,j] is the estimated travel time (seconds) from i to j
+	'''
+	coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+	n = len(coords)
+	times = allocate_matrix((n, n), dtype, out)
+	lon, lat = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+	cos_lat = np.cos(lat)
+	seconds_per_km = detour_factor / speed_kmh * 3600.0
+
+	def fill_rows(start):
+		stop = min(start + block_size, n)
+		for c_start in range(0, n, block_size):
+			c_stop = min(c_start + block_size, n)
+			#haversine formula, on a block_size x block_size tile
+			a = np.sin((lat[c_start:c_stop][None, :] - lat[start:stop][:, None]) / 2) ** 2
+			a += cos_lat[start:stop][:, None] * cos_lat[c_start:c_stop][None, :] * np.sin((lon[c_start:c_stop][None, :] - lon[start:stop][:, None]) / 2) ** 2
+			np.clip(a, 0.0, 1.0, out=a)
+			times[start:stop, c_start:c_stop] = 2 * EARTH_RADIUS_KM * seconds_per_km * np.arcsin(np.sqrt(a))
+
+	if n_jobs is None or n_jobs < 0:
+		n_jobs = os.cpu_count() or 1
+	starts = range(0, n, block_size)
+	if n_jobs == 1:
+		for start in starts:
+			fill_rows(start)
+	else:
+		with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+			list(executor.map(fill_rows, starts))
+	if isinstance(times, np.memmap):
+		times.flush()
+	return times
+
+def calibrate(coords : list, times : np.ndarray, *, detour_factor : float = 1.3) -> float:
+	'''
+		Fit the speed (km/h) that best reproduces a sample of real travel times (e.g. a small GraphHopper matrix) for the given detour factor,
+		by least squares over the off diagonal pairs. Use the result as gen_distance_matrix's speed_kmh
+	'''
+	coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+	times = np.asarray(times, dtype=np.float64)
+	estimate = gen_distance_matrix(coords, speed_kmh=1.0, detour_factor=detour_factor, dtype=np.float64)
+	valid = np.isfinite(times) & (times > 0) & ~np.eye(len(coords), dtype=bool)
+	#times = estimate / speed  =>  least squares on 1 / speed
+	inverse_speed = (estimate[valid] * times[valid]).sum() / (estimate[valid] ** 2).sum()
+	return 1.0 / inverse_speed
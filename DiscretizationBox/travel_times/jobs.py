@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+'''
+This file defines checkpointed matrix jobs, so a long travel time run can resume after a crash or an exhausted quota instead of starting over.
+
+A job directory holds:
+	manifest.json - what the job computes (number of points, hash of the coordinates, provider, profile, number of chunks)
+	plan.npz      - the planned requests (rows and columns of every chunk), in CSR-like arrays
+	chunks/       - one <chunk number>.npy per completed chunk, written atomically as soon as it arrives
+'''
+
+JOB_VERSION = 1
+
+def coords_hash(coords) -> str:
+	return hashlib.sha256(np.ascontiguousarray(np.asarray(coords, dtype=np.float64)).tobytes()).hexdigest()
+
+def _pack(arrays):
+	return np.concatenate([[0], np.cumsum([len(a) for a in arrays])]).astype(np.int64), np.concatenate(arrays).astype(np.int64) if arrays else np.zeros(0, dtype=np.int64)
+
+def _unpack(indptr, values):
+	return [values[indptr[i]:indptr[i + 1]] for i in range(len(indptr) - 1)]
+
+class MatrixJob:
+	'''
+		A checkpointed matrix job stored in directory. Use MatrixJob.open to create or resume one.
+
+		Attributes:
+			blocks : list of (rows, cols) index arrays - the planned chunks
+			done : set - numbers of the chunks already on disk
+	'''
+	def __init__(self, directory, blocks, done = ()):
+		self.directory = str(directory)
+		self.blocks = blocks
+		self.done = set(done)
+
+	@classmethod
+	def open(cls, directory, coords, blocks, *, provider : str, profile : str):
+		'''
+			Resume the job in directory, or start it with the planned blocks if the directory holds no job.
+			A job computed for other coordinates, provider or profile is an error, so checkpoints are never mixed up
+		'''
+		directory = str(directory)
+		manifest = {'version' : JOB_VERSION, 'n' : len(coords), 'coords_sha256' : coords_hash(coords), 'provider' : provider, 'profile' : profile}
+		manifest_path = os.path.join(directory, 'manifest.json')
+		if os.path.exists(manifest_path):
+			with open(manifest_path) as f:
+				saved = json.load(f)
+			mismatch = [key for key, value in manifest.items() if saved.get(key) != value]
+			if mismatch:
+				raise ValueError("{} holds a different job (mismatched {}). Use another directory or delete it".format(directory, ', '.join(mismatch)))
+			with np.load(os.path.join(directory, 'plan.npz')) as plan:
+				blocks = list(zip(_unpack(plan['row_ptr'], plan['rows']), _unpack(plan['col_ptr'], plan['cols'])))
+			done = [int(name[:-len('.npy')]) for name in os.listdir(os.path.join(directory, 'chunks')) if name.endswith('.npy')]
+			return cls(directory, blocks, done)
+
+		os.makedirs(os.path.join(directory, 'chunks'), exist_ok=True)
+		row_ptr, rows = _pack([r for r, _c in blocks])
+		col_ptr, cols = _pack([c for _r, c in blocks])
+		np.savez(os.path.join(directory, 'plan.npz'), row_ptr=row_ptr, rows=rows, col_ptr=col_ptr, cols=cols)
+		manifest['n_chunks'] = len(blocks)
+		#the manifest goes last: a directory with a manifest always has a complete plan
+		_write_atomic(manifest_path, lambda f: f.write(json.dumps(manifest, indent=1).encode()))
+		return cls(directory, blocks)
+
+	def _chunk_path(self, number):
+		return os.path.join(self.directory, 'chunks', '{:06d}.npy'.format(number))
+
+	def pending(self) -> list:
+		'''
+			Numbers of the chunks still to be computed
+		'''
+		return [number for number in range(len(self.blocks)) if number not in self.done]
+
+	def load(self, number) -> np.ndarray:
+		return np.load(self._chunk_path(number))
+
+	def save(self, number, values):
+		'''
+			Persist the travel times of chunk number (float64, NaN for unreachable pairs)
+		'''
+		values = np.asarray(values, dtype=np.float64)
+		_write_atomic(self._chunk_path(number), lambda f: np.save(f, values))
+		self.done.add(number)
+
+	def completed(self) -> list:
+		'''
+			(rows, cols, values) of every chunk already on disk
+		'''
+		return [(self.blocks[number][0], self.blocks[number][1], self.load(number)) for number in sorted(self.done)]
+
+def _write_atomic(path, write):
+	tmp = path + '.tmp'
+	with open(tmp, 'wb') as f:
+		write(f)
+	os.replace(tmp, path)
+
+class Progress:
+	'''
+		Progress and ETA of a job, printed every `every` seconds (or handed to callback(done, total, eta_seconds) if given)
+	'''
+	def __init__(self, total : int, done : int = 0, *, every : float = 10.0, callback = None, clock = time.monotonic):
+		self.total = total
+		self.done = done
+		self.start_done = done
+		self.every = every
+		self.callback = callback
+		self.clock = clock
+		self.start = self.last = clock()
+
+	def eta(self) -> float:
+		'''
+			Seconds left, estimated from the chunks completed in this session. None until one is
+		'''
+		finished = self.done - self.start_done
+		if finished == 0:
+			return None
+		return (self.clock() - self.start) / finished * (self.total - self.done)
+
+	def update(self, amount : int = 1):
+		self.done += amount
+		now = self.clock()
+		if self.callback is not None:
+			self.callback(self.done, self.total, self.eta())
+		elif now - self.last >= self.every or self.done == self.total:
+			eta = self.eta()
+			print("{}/{} chunks ({:.1f}%), ETA {}".format(self.done, self.total, 100.0 * self.done / max(self.total, 1),
+				'?' if eta is None else time.strftime('%H:%M:%S', time.gmtime(eta))))
+			self.last = now
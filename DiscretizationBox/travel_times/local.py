@@ -0,0 +1,257 @@
+import math
+import os
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+'''
+This file defines an offline travel time provider: a local road graph and many-to-many shortest travel times over it.
+
+Graphs can be loaded from an OpenStreetMap XML extract (.osm / .xml), from an edge list (.csv) or from a graph previously saved with
+RoadGraph.save (.npz). OSM PBF extracts can be converted to XML first, e.g. with "osmium cat extract.osm.pbf -o extract.osm".
+
+Usage:
+	graph = load_road_graph('rio.osm')
+	times = distance_matrix_from_gdf(gdf, provider = 'local', graph = graph, n_jobs = 4)
+'''
+
+#default speeds (km/h) of the OSM highway classes considered drivable
+DEFAULT_SPEEDS = {
+	'motorway' : 90, 'motorway_link' : 60, 'trunk' : 80, 'trunk_link' : 50, 'primary' : 60, 'primary_link' : 40,
+	'secondary' : 50, 'secondary_link' : 40, 'tertiary' : 40, 'tertiary_link' : 30, 'unclassified' : 30, 'residential' : 25,
+	'living_street' : 10, 'service' : 15, 'road' : 30,
+}
+
+EARTH_RADIUS_M = 6371008.8
+
+def haversine_m(lon1, lat1, lon2, lat2):
+	'''
+		Great circle distance in meters. Works on scalars and numpy arrays
+	'''
+	lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+	a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+	return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+class RoadGraph:
+	'''
+		Directed road graph in CSR form: the edges leaving node u are indices[indptr[u]:indptr[u+1]], with travel times (seconds) in weights.
+
+		Attributes
+			lon, lat : numpy.ndarray - coordinates of the nodes
+			indptr, indices : numpy.ndarray (int32) - CSR structure
+			weights : numpy.ndarray (float64) - travel time of every edge, in seconds
+	'''
+	def __init__(self, lon, lat, indptr, indices, weights):
+		self.lon = np.asarray(lon, dtype=np.float64)
+		self.lat = np.asarray(lat, dtype=np.float64)
+		self.indptr = np.asarray(indptr, dtype=np.int32)
+		self.indices = np.asarray(indices, dtype=np.int32)
+		self.weights = np.asarray(weights, dtype=np.float64)
+		self._tree = None
+
+	@classmethod
+	def from_edges(cls, lon, lat, sources, targets, seconds):
+		'''
+			Build from directed edges between node positions. Parallel edges are reduced to the fastest one
+		'''
+		sources, targets, seconds = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64), np.asarray(seconds, dtype=np.float64)
+		n = len(lon)
+		order = np.lexsort((seconds, targets, sources))
+		sources, targets, seconds = sources[order], targets[order], seconds[order]
+		first = np.ones(len(sources), dtype=bool)
+		first[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+		sources, targets, seconds = sources[first], targets[first], seconds[first]
+		indptr = np.zeros(n + 1, dtype=np.int64)
+		np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+		return cls(lon, lat, indptr, targets, seconds)
+
+	@property
+	def n_nodes(self) -> int:
+		return len(self.lon)
+
+	@property
+	def n_edges(self) -> int:
+		return len(self.indices)
+
+	def to_scipy(self):
+		from scipy.sparse import csr_matrix
+		#built from the CSR arrays directly, so zero time edges are kept as (explicit) edges
+		return csr_matrix((self.weights, self.indices, self.indptr), shape=(self.n_nodes, self.n_nodes))
+
+	def nearest_nodes(self, lon, lat) -> np.ndarray:
+		'''
+			Index of the closest graph node to every point (in a local equirectangular projection, accurate enough at city scale)
+		'''
+		from scipy.spatial import cKDTree
+		scale = math.cos(math.radians(float(np.mean(self.lat)))) if self.n_nodes else 1.0
+		if self._tree is None:
+			self._tree = cKDTree(np.column_stack([self.lon * scale, self.lat]))
+		_distance, nodes = self._tree.query(np.column_stack([np.asarray(lon, dtype=float) * scale, np.asarray(lat, dtype=float)]))
+		return nodes
+
+	def save(self, path):
+		np.savez(path, lon=self.lon, lat=self.lat, indptr=self.indptr, indices=self.indices, weights=self.weights)
+
+	@classmethod
+	def load(cls, path):
+		with np.load(path) as arrays:
+			return cls(arrays['lon'], arrays['lat'], arrays['indptr'], arrays['indices'], arrays['weights'])
+
+def read_edge_list(path_or_df, *, default_speed_kmh : float = 30, decimals : int = 7) -> RoadGraph:
+	'''
+		Build a RoadGraph from an edge list (CSV path or DataFrame) with one row per road segment and columns
+			from_lon, from_lat, to_lon, to_lat - end points of the segment. Nodes are identified by their coordinates (rounded to decimals)
+			seconds - travel time, or
+			length_m and optionally speed_kmh (default_speed_kmh if missing) - length of the segment; if neither is given the great circle length is used
+			oneway - optional. Segments are traversable in both directions unless oneway is true
+	'''
+	edges = pd.read_csv(path_or_df) if isinstance(path_or_df, (str, os.PathLike)) else path_or_df
+	ends = np.concatenate([edges[['from_lon', 'from_lat']].to_numpy(float), edges[['to_lon', 'to_lat']].to_numpy(float)])
+	keys, node_of = np.unique(np.rint(ends * 10 ** decimals).astype(np.int64), axis=0, return_inverse=True)
+	node_of = node_of.ravel()
+	coords = np.zeros((len(keys), 2))
+	coords[node_of] = ends
+	sources, targets = node_of[:len(edges)], node_of[len(edges):]
+
+	if 'seconds' in edges:
+		seconds = edges['seconds'].to_numpy(float)
+	else:
+		length = edges['length_m'].to_numpy(float) if 'length_m' in edges else haversine_m(ends[:len(edges), 0], ends[:len(edges), 1], ends[len(edges):, 0], ends[len(edges):, 1])
+		speed = edges['speed_kmh'].fillna(default_speed_kmh).to_numpy(float) if 'speed_kmh' in edges else np.full(len(edges), float(default_speed_kmh))
+		seconds = length / (speed / 3.6)
+
+	both = ~edges['oneway'].fillna(False).astype(bool).to_numpy() if 'oneway' in edges else np.ones(len(edges), dtype=bool)
+	return RoadGraph.from_edges(coords[:, 0], coords[:, 1], np.concatenate([sources, targets[both]]), np.concatenate([targets, sources[both]]),
+		np.concatenate([seconds, seconds[both]]))
+
+def _parse_maxspeed(value):
+	try:
+		if value.endswith('mph'):
+			return float(value[:-3].strip()) * 1.609344
+		return float(value.split()[0])
+	except (ValueError, IndexError, AttributeError):
+		return None
+
+def read_osm_xml(path, *, speeds : dict = None) -> RoadGraph:
+	'''
+		Build a RoadGraph from an OpenStreetMap XML extract. Only ways whose highway tag is in speeds (DEFAULT_SPEEDS by default) are used.
+		The maxspeed tag, when present and parseable, overrides the class speed. oneway=yes/true/1/-1 ways are only traversable in one direction
+	'''
+	speeds = DEFAULT_SPEEDS if speeds is None else speeds
+	node_ids, node_lon, node_lat = [], [], []
+	way_nodes, way_speed, way_oneway = [], [], []
+	#streamed, so large extracts do not build a full element tree: the root is cleared after every top level element,
+	#otherwise it keeps a reference to each of them (emptied, but still in memory)
+	root = None
+	for event, element in ET.iterparse(str(path), events=('start', 'end')):
+		if root is None:
+			root = element
+		if event == 'start':
+			continue
+		if element.tag == 'node':
+			node_ids.append(int(element.get('id')))
+			node_lon.append(float(element.get('lon')))
+			node_lat.append(float(element.get('lat')))
+			root.clear()
+		elif element.tag == 'way':
+			tags = {tag.get('k') : tag.get('v') for tag in element.iter('tag')}
+			highway = tags.get('highway')
+			if highway in speeds:
+				refs = [int(nd.get('ref')) for nd in element.iter('nd')]
+				if len(refs) >= 2:
+					maxspeed = _parse_maxspeed(tags.get('maxspeed'))
+					oneway = tags.get('oneway', 'no')
+					if oneway == '-1':
+						refs.reverse()
+					way_nodes.append(refs)
+					way_speed.append(maxspeed if maxspeed else speeds[highway])
+					way_oneway.append(oneway in ('yes', 'true', '1', '-1') or highway in ('motorway', 'motorway_link'))
+			root.clear()
+		elif element.tag == 'relation':
+			root.clear()
+
+	ids = pd.Index(node_ids)
+	lon, lat = np.asarray(node_lon), np.asarray(node_lat)
+	lengths = np.fromiter(map(len, way_nodes), dtype=np.int64, count=len(way_nodes))
+	refs = ids.get_indexer(np.fromiter((r for way in way_nodes for r in way), dtype=np.int64, count=int(lengths.sum())))
+	#segments between consecutive nodes of the same way
+	way_of = np.repeat(np.arange(len(way_nodes)), lengths)
+	same_way = way_of[1:] == way_of[:-1]
+	sources, targets, way = refs[:-1][same_way], refs[1:][same_way], way_of[:-1][same_way]
+	valid = (sources >= 0) & (targets >= 0) #ways may reference nodes outside the extract
+	sources, targets, way = sources[valid], targets[valid], way[valid]
+
+	seconds = haversine_m(lon[sources], lat[sources], lon[targets], lat[targets]) / (np.asarray(way_speed)[way] / 3.6)
+	both = ~np.asarray(way_oneway, dtype=bool)[way]
+	return RoadGraph.from_edges(lon, lat, np.concatenate([sources, targets[both]]), np.concatenate([targets, sources[both]]),
+		np.concatenate([seconds, seconds[both]]))
+
+def load_road_graph(path, **kwargs) -> RoadGraph:
+	'''
+		Load a RoadGraph, choosing the reader from the file extension (.npz, .csv, .osm / .xml)
+	'''
+	lower = str(path).lower()
+	if lower.endswith('.npz'):
+		return RoadGraph.load(path)
+	if lower.endswith('.csv'):
+		return read_edge_list(path, **kwargs)
+	if lower.endswith('.osm') or lower.endswith('.xml'):
+		return read_osm_xml(path, **kwargs)
+	if lower.endswith('.pbf'):
+		raise ValueError("OSM PBF extracts are not read directly. Convert to XML first, e.g. 'osmium cat {} -o extract.osm'".format(path))
+	raise ValueError("Unknown road graph format: {}".format(path))
+
+#graph of the worker processes used by many_to_many
+_worker_graph = None
+
+def _init_worker(lon, lat, indptr, indices, weights):
+	global _worker_graph
+	_worker_graph = RoadGraph(lon, lat, indptr, indices, weights).to_scipy()
+
+def _dijkstra_chunk(sources, targets, graph = None):
+	from scipy.sparse.csgraph import dijkstra
+	graph = _worker_graph if graph is None else graph
+	return dijkstra(graph, directed=True, indices=sources)[:, targets]
+
+def many_to_many(graph : RoadGraph, sources, targets, *, n_jobs : int = 1, chunk_size : int = 64) -> np.ndarray:
+	'''
+		Shortest travel times (seconds) from every source node to every target node, running Dijkstra from chunks of sources, optionally in a process pool.
+		Unreachable pairs are inf
+	'''
+	sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+	unique_sources, source_row = np.unique(sources, return_inverse=True)
+	chunks = [unique_sources[i:i + chunk_size] for i in range(0, len(unique_sources), chunk_size)]
+	if n_jobs is None or n_jobs < 0:
+		n_jobs = os.cpu_count() or 1
+
+	if n_jobs == 1 or len(chunks) <= 1:
+		csr = graph.to_scipy()
+		results = [_dijkstra_chunk(chunk, targets, csr) for chunk in chunks]
+	else:
+		initargs = (graph.lon, graph.lat, graph.indptr, graph.indices, graph.weights)
+		with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=initargs) as executor:
+			results = list(executor.map(_dijkstra_chunk, chunks, [targets] * len(chunks)))
+
+	times = np.concatenate(results) if results else np.zeros((0, len(targets)))
+	return times[source_row.ravel()]
+
+def gen_distance_matrix(coords : list, *, graph, n_jobs : int = 1, chunk_size : int = 64) -> np.ndarray:
+	'''
+		Compute the travel time matrix between coordinates over a local road graph. Same output as graphhopper.gen_distance_matrix
+
+		Params:
+			coords : list - a list of [longi, lat] lists. The retuned matrix follows the index of this list
+			graph : (RoadGraph, str) - the road graph, or a path accepted by load_road_graph. Every point is snapped to its closest graph node
+			n_jobs : int - number of worker processes. -1 or None uses every core
+			chunk_size : int - number of sources per Dijkstra batch. Each batch holds a chunk_size x (number of nodes) array in memory
+		Return:
+			numpy.ndarray - matrix such that [i,j] is the travel time (seconds) from i to j. Unreachable pairs are nan
+	'''
+	if not isinstance(graph, RoadGraph):
+		graph = load_road_graph(graph)
+	coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+	nodes = graph.nearest_nodes(coords[:, 0], coords[:, 1])
+	times = many_to_many(graph, nodes, nodes, n_jobs=n_jobs, chunk_size=chunk_size)
+	times[np.isinf(times)] = np.nan
+	return times
@@ -0,0 +1,65 @@
+import os
+import numpy as np
+
+'''
+This file defines helpers shared by the travel time providers to allocate their output matrices.
+'''
+
+def allocate_matrix(shape, dtype = np.float64, out = None, fill = None):
+	'''
+		Return the array a provider should write its matrix into.
+
+		Params:
+			shape : tuple - shape of the matrix
+			dtype : numpy dtype - dtype of a newly allocated matrix
+			out : (None, numpy.ndarray, str) - None allocates an in-memory array. An array (e.g. a numpy.memmap) is used as is, after checking its shape.
+				A path creates a memory-mapped .npy file there (see numpy.lib.format.open_memmap), so the matrix never has to fit in RAM
+			fill : scalar - optional initial value
+	'''
+	if out is None:
+		matrix = np.empty(shape, dtype=dtype)
+	elif isinstance(out, (str, os.PathLike)):
+		matrix = np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=shape)
+	else:
+		matrix = out
+		if matrix.shape != tuple(shape):
+			raise ValueError("out has shape {} but the matrix has shape {}".format(matrix.shape, tuple(shape)))
+	if fill is not None:
+		matrix[...] = fill
+	return matrix
+
+def unreachable_value(dtype, unreachable = None):
+	'''
+		Value stored for unreachable pairs: unreachable if given, else NaN for float dtypes and the largest representable value for integer dtypes
+	'''
+	dtype = np.dtype(dtype)
+	if unreachable is None:
+		return np.nan if dtype.kind == 'f' else np.iinfo(dtype).max
+	if dtype.kind != 'f' and np.isnan(unreachable):
+		raise ValueError("NaN can not be stored in a {} matrix. Pick an integer sentinel for unreachable pairs".format(dtype))
+	return unreachable
+
+def _as_range(index):
+	'''
+		slice equivalent to a sorted index array of consecutive integers, or None
+	'''
+	if len(index) and index[-1] - index[0] == len(index) - 1:
+		return slice(int(index[0]), int(index[-1]) + 1)
+	return None
+
+def place_block(matrix, rows, cols, values, unreachable = None):
+	'''
+		Write a block of travel times (seconds, NaN for unreachable pairs) into matrix[rows][:, cols], converting it to the matrix dtype.
+
+		Regular blocks (consecutive rows and columns) are written with a single slice assignment; other blocks fall back to fancy indexing.
+	'''
+	values = np.asarray(values, dtype=np.float64).reshape(len(rows), len(cols))
+	unreachable = unreachable_value(matrix.dtype, unreachable)
+	if matrix.dtype.kind != 'f':
+		values = np.rint(values)
+	values = np.where(np.isnan(values), unreachable, values).astype(matrix.dtype, copy=False)
+	row_slice, col_slice = _as_range(rows), _as_range(cols)
+	if row_slice is not None and col_slice is not None:
+		matrix[row_slice, col_slice] = values
+	else:
+		matrix[np.ix_(rows, cols)] = values
@@ -0,0 +1,135 @@
+import json
+import math
+import threading
+import time
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+'''
+This file defines a local stand-in for the travel time APIs (GraphHopper matrix and Google Maps Distance Matrix), to test and benchmark the providers without network access or quota.
+
+Usage:
+	with MockMatrixServer(latency = 0.2, fail_every = 5) as server:
+		client = GraphHopperClient('any key', base_url = server.url + '/matrix')
+		...
+
+Travel times are great circle distance / speed_kmh, in seconds. Request statistics are kept in server.requests / server.elements.
+'''
+
+def _haversine_seconds(lon1, lat1, lon2, lat2, speed_kmh):
+	lon1, lat1, lon2, lat2 = map(math.radians, (lon1, lat1, lon2, lat2))
+	a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+	km = 2 * 6371.0088 * math.asin(math.sqrt(a))
+	return km / speed_kmh * 3600
+
+class MockMatrixServer:
+	'''
+		Threaded HTTP server answering GraphHopper style matrix requests (POST /matrix) and Google Maps style distance matrix requests
+		(GET /maps/api/distancematrix/json, with the API's per request limits).
+
+		Parameters
+			speed_kmh  : float - speed used to turn distances into travel times
+			latency    : float - seconds to wait before answering each request
+			fail_every : int   - if set, every fail_every-th request is answered with 429 (Too Many Requests)
+			port       : int   - port to listen on. 0 (default) picks a free one
+	'''
+	def __init__(self, *, speed_kmh : float = 40.0, latency : float = 0.0, fail_every : int = None, port : int = 0):
+		self.speed_kmh = speed_kmh
+		self.latency = latency
+		self.fail_every = fail_every
+		self.requests = 0
+		self.elements = 0
+		self.lock = threading.Lock()
+		self.routes = {'/matrix' : self._graphhopper_matrix, '/maps/api/distancematrix/json' : self._googlemaps_matrix}
+		self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+		self.httpd.daemon_threads = True
+		self.thread = None
+
+	@property
+	def url(self) -> str:
+		host, port = self.httpd.server_address[:2]
+		return 'http://{}:{}'.format(host, port)
+
+	def start(self):
+		self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def _count(self, elements):
+		'''
+			Register a request. Returns False if it must be rejected with 429
+		'''
+		with self.lock:
+			self.requests += 1
+			if self.fail_every and self.requests % self.fail_every == 0:
+				return False
+			self.elements += elements
+			return True
+
+	def _graphhopper_matrix(self, method, path, query, body):
+		if method != 'POST':
+			return 405, {'message' : 'use POST'}
+		data = json.loads(body or b'{}')
+		from_points, to_points = data.get('from_points', []), data.get('to_points', [])
+		if not self._count(len(from_points) * len(to_points)):
+			return 429, {'message' : 'Too Many Requests'}
+		times = [[round(_haversine_seconds(f[0], f[1], t[0], t[1], self.speed_kmh)) for t in to_points] for f in from_points]
+		return 200, {'times' : times}
+
+	def _googlemaps_matrix(self, method, path, query, body):
+		params = parse_qs(query)
+		parse = lambda name: [[float(v) for v in point.split(',')] for point in params.get(name, [''])[0].split('|') if point]
+		origins, destinations = parse('origins'), parse('destinations')
+		if len(origins) > 25 or len(destinations) > 25:
+			return 200, {'status' : 'MAX_DIMENSIONS_EXCEEDED', 'rows' : []}
+		if len(origins) * len(destinations) > 100:
+			return 200, {'status' : 'MAX_ELEMENTS_EXCEEDED', 'rows' : []}
+		if not self._count(len(origins) * len(destinations)):
+			return 200, {'status' : 'OVER_QUERY_LIMIT', 'rows' : []}
+		#points are "lat,lng"
+		rows = [{'elements' : [{'status' : 'OK', 'duration' : {'value' : round(_haversine_seconds(o[1], o[0], d[1], d[0], self.speed_kmh))}}
+			for d in destinations]} for o in origins]
+		return 200, {'status' : 'OK', 'rows' : rows}
+
+	def _handler_class(self):
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def _dispatch(self, method):
+				path, _sep, query = self.path.partition('?')
+				length = int(self.headers.get('Content-Length') or 0)
+				body = self.rfile.read(length) if length else b''
+				route = server.routes.get(path)
+				if server.latency:
+					time.sleep(server.latency)
+				if route is None:
+					status, payload = 404, {'message' : 'not found'}
+				else:
+					status, payload = route(method, path, query, body)
+				encoded = json.dumps(payload).encode()
+				self.send_response(status)
+				self.send_header('Content-Type', 'application/json')
+				self.send_header('Content-Length', str(len(encoded)))
+				self.end_headers()
+				self.wfile.write(encoded)
+
+			def do_GET(self):
+				self._dispatch('GET')
+
+			def do_POST(self):
+				self._dispatch('POST')
+
+			def log_message(self, format, *args):
+				pass
+
+		return Handler
@@ -0,0 +1,153 @@
+import sqlite3
+import numpy as np
+
+'''
+This file defines a persistent cache of pairwise travel times, so reruns only request the pairs that were never fetched.
+
+Pairs are keyed by provider, vehicle profile and origin / destination coordinates rounded to a fixed number of decimals,
+and stored in a local SQLite database.
+'''
+
+class TravelTimeCache:
+	'''
+		SQLite backed travel time cache.
+
+		Params:
+			path : str - database file. Created if it does not exist
+			decimals : int - coordinates are rounded to this many decimals before being used as keys (5 decimals is about 1 meter)
+	'''
+	def __init__(self, path, *, decimals : int = 5):
+		self.path = str(path)
+		self.decimals = decimals
+		self.connection = sqlite3.connect(self.path)
+		self.connection.execute('''CREATE TABLE IF NOT EXISTS travel_times (
+			provider TEXT NOT NULL, profile TEXT NOT NULL,
+			from_lon INTEGER NOT NULL, from_lat INTEGER NOT NULL, to_lon INTEGER NOT NULL, to_lat INTEGER NOT NULL,
+			seconds REAL,
+			PRIMARY KEY (provider, profile, from_lon, from_lat, to_lon, to_lat)) WITHOUT ROWID''')
+		self.connection.commit()
+
+	def close(self):
+		self.connection.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def _keys(self, coords):
+		'''
+			Integer keys of a list of [longi, lat] coordinates
+		'''
+		return np.rint(np.asarray(coords, dtype=float).reshape(-1, 2) * 10 ** self.decimals).astype(np.int64)
+
+	def lookup(self, origins, destinations, provider : str, profile : str):
+		'''
+			Fetch every cached pair between origins and destinations (lists of [longi, lat]).
+
+			Return:
+				(numpy.ndarray, numpy.ndarray) - travel times of shape (len(origins), len(destinations)), and a boolean mask of the pairs found in the cache.
+					Pairs found but cached as unreachable are NaN
+		'''
+		times = np.full((len(origins), len(destinations)), np.nan)
+		found = np.zeros(times.shape, dtype=bool)
+		if times.size == 0:
+			return times, found
+		cursor = self.connection.cursor()
+		cursor.execute('CREATE TEMP TABLE IF NOT EXISTS origins (idx INTEGER, lon INTEGER, lat INTEGER)')
+		cursor.execute('CREATE TEMP TABLE IF NOT EXISTS destinations (idx INTEGER, lon INTEGER, lat INTEGER)')
+		cursor.execute('DELETE FROM origins')
+		cursor.execute('DELETE FROM destinations')
+		cursor.executemany('INSERT INTO origins VALUES (?, ?, ?)', [(i, int(lon), int(lat)) for i, (lon, lat) in enumerate(self._keys(origins))])
+		cursor.executemany('INSERT INTO destinations VALUES (?, ?, ?)', [(i, int(lon), int(lat)) for i, (lon, lat) in enumerate(self._keys(destinations))])
+		cursor.execute('CREATE INDEX IF NOT EXISTS temp.destinations_key ON destinations (lon, lat)')
+		#one indexed range scan per origin, then a lookup of the destination
+		rows = cursor.execute('''SELECT o.idx, d.idx, t.seconds FROM origins o
+			JOIN travel_times t ON t.provider = ? AND t.profile = ? AND t.from_lon = o.lon AND t.from_lat = o.lat
+			JOIN destinations d ON d.lon = t.to_lon AND d.lat = t.to_lat''', (provider, profile)).fetchall()
+		if rows:
+			result = np.array(rows, dtype=float)
+			i, j = result[:, 0].astype(np.int64), result[:, 1].astype(np.int64)
+			times[i, j] = result[:, 2]
+			found[i, j] = True
+		return times, found
+
+	def lookup_pairs(self, origins, destinations, provider : str, profile : str):
+		'''
+			Fetch the cached travel time of every (origins[i], destinations[i]) pair, e.g. the candidate pairs of a sparse matrix.
+
+			Return:
+				(numpy.ndarray, numpy.ndarray) - travel times of shape (len(origins),), and a boolean mask of the pairs found in the cache.
+					Pairs found but cached as unreachable are NaN
+		'''
+		if len(origins) != len(destinations):
+			raise ValueError("origins and destinations must have the same length. Got {} and {}".format(len(origins), len(destinations)))
+		times = np.full(len(origins), np.nan)
+		found = np.zeros(len(origins), dtype=bool)
+		if len(origins) == 0:
+			return times, found
+		cursor = self.connection.cursor()
+		cursor.execute('CREATE TEMP TABLE IF NOT EXISTS pairs (idx INTEGER, from_lon INTEGER, from_lat INTEGER, to_lon INTEGER, to_lat INTEGER)')
+		cursor.execute('DELETE FROM pairs')
+		keys = np.hstack([self._keys(origins), self._keys(destinations)]).tolist()
+		cursor.executemany('INSERT INTO pairs VALUES (?, ?, ?, ?, ?)', [(i, *key) for i, key in enumerate(keys)])
+		#one primary key lookup per pair
+		rows = cursor.execute('''SELECT p.idx, t.seconds FROM pairs p
+			JOIN travel_times t ON t.provider = ? AND t.profile = ? AND t.from_lon = p.from_lon AND t.from_lat = p.from_lat
+				AND t.to_lon = p.to_lon AND t.to_lat = p.to_lat''', (provider, profile)).fetchall()
+		if rows:
+			result = np.array(rows, dtype=float)
+			i = result[:, 0].astype(np.int64)
+			times[i] = result[:, 1]
+			found[i] = True
+		return times, found
+
+	def store(self, origins, destinations, times, provider : str, profile : str):
+		'''
+			Store a block of travel times (shape (len(origins), len(destinations)), NaN or None for unreachable pairs)
+		'''
+		times = np.asarray(times, dtype=float).reshape(len(origins), len(destinations))
+		from_keys, to_keys = self._keys(origins).tolist(), self._keys(destinations).tolist()
+		values = [None if np.isnan(t) else t for t in times.ravel().tolist()]
+		rows = ((provider, profile, f[0], f[1], d[0], d[1], values[a * len(to_keys) + b])
+			for a, f in enumerate(from_keys) for b, d in enumerate(to_keys))
+		with self.connection:
+			self.connection.executemany('INSERT OR REPLACE INTO travel_times VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+	def __len__(self):
+		return self.connection.execute('SELECT COUNT(*) FROM travel_times').fetchone()[0]
+
+def as_travel_time_cache(cache) -> TravelTimeCache:
+	'''
+		Accept either a TravelTimeCache or the path of its database
+	'''
+	if isinstance(cache, TravelTimeCache):
+		return cache
+	return TravelTimeCache(cache)
+
+def plan_requests(missing : np.ndarray, c_size : int):
+	'''
+		Group the missing pairs of a matrix into few rectangular requests of at most c_size x c_size.
+
+		Rows are ordered so rows missing the same destinations end up in the same request; each request then asks for the union
+		of the destinations missing in its rows. When every pair is missing, this is the usual regular grid of chunks.
+
+		Params:
+			missing : numpy.ndarray - boolean matrix, True for the (origin, destination) pairs to request
+			c_size : int - maximum number of origins and of destinations per request
+		Return:
+			list of (rows, cols) index arrays
+	'''
+	rows = np.flatnonzero(missing.any(axis=1))
+	if len(rows) == 0:
+		return []
+	patterns = np.packbits(missing[rows], axis=1)
+	rows = rows[np.lexsort(patterns.T[::-1])]
+	blocks = []
+	for start in range(0, len(rows), c_size):
+		block_rows = np.sort(rows[start:start + c_size])
+		cols = np.flatnonzero(missing[block_rows].any(axis=0))
+		for c_start in range(0, len(cols), c_size):
+			blocks.append((block_rows, cols[c_start:c_start + c_size]))
+	return blocks
@@ -0,0 +1,202 @@
+import math
+import numpy as np
+from geopandas import GeoDataFrame
+
+from .local import haversine_m
+
+'''
+This file defines the sparse travel time mode: only pairs of cells close to each other (k nearest / within a radius) are requested,
+and the result is a scipy.sparse matrix.
+
+Candidate pairs come from the discretization itself: H3 k_ring for hexagons ('h3_index' column), a KD-tree on the cell centers otherwise.
+They are batched into rectangular sub-matrices of spatially close origins and destinations, so most of every request is useful.
+'''
+
+def _centers(gdf):
+	return np.asarray(gdf['center_lon'], dtype=np.float64), np.asarray(gdf['center_lat'], dtype=np.float64)
+
+def _h3_candidates(h3_indexes, k):
+	'''
+		(sources, targets) of every cell and the cells at most k rings away from it
+	'''
+	import h3
+	import h3.api.numpy_int as h3_int
+	import pandas as pd
+	cells = np.array([h3.string_to_h3(h) for h in h3_indexes], dtype=np.uint64)
+	lookup = pd.Index(cells)
+	rings = [h3_int.k_ring(int(cell), k) for cell in cells]
+	targets = lookup.get_indexer(np.concatenate(rings).astype(np.uint64))
+	sources = np.repeat(np.arange(len(cells)), [len(ring) for ring in rings])
+	inside = targets >= 0 #cells of the ring outside the discretization
+	return sources[inside], targets[inside]
+
+def _h3_rings_for_radius(h3_indexes, radius_m):
+	'''
+		Number of rings needed to cover radius_m around a cell (centers of adjacent cells are about sqrt(3) edge lengths apart)
+	'''
+	import h3
+	resolution = h3.h3_get_resolution(h3_indexes[0])
+	spacing = math.sqrt(3) * h3.edge_length(resolution, unit='m')
+	#edge_length is an average and cells shrink away from the center of their icosahedron face, so leave a margin of one ring
+	return int(math.ceil(radius_m / spacing)) + 1
+
+def _kdtree_candidates(lon, lat, k, radius_m):
+	'''
+		(sources, targets) of every center and its k nearest centers (itself included) or, without k, the centers within radius_m.
+		Distances are measured in a local equirectangular projection
+	'''
+	from scipy.spatial import cKDTree
+	scale = math.cos(math.radians(float(np.mean(lat))))
+	meters_per_degree = math.pi / 180 * 6371008.8
+	points = np.column_stack([lon * scale, lat]) * meters_per_degree
+	tree = cKDTree(points)
+	if k is None:
+		#a small margin for the projection error, the exact distance is checked afterwards
+		neighbors = tree.query_ball_point(points, radius_m * 1.01 + 1.0)
+		sources = np.repeat(np.arange(len(points)), [len(n) for n in neighbors])
+		targets = np.concatenate([np.asarray(n, dtype=np.int64) for n in neighbors]) if len(neighbors) else np.zeros(0, dtype=np.int64)
+		return sources, targets
+	k = min(k, len(points))
+	_distances, targets = tree.query(points, k=k)
+	targets = np.asarray(targets).reshape(len(points), k)
+	return np.repeat(np.arange(len(points)), k), targets.ravel()
+
+def candidate_pairs(gdf : GeoDataFrame, *, k : int = None, radius_m : float = None):
+	'''
+		Pairs of cells whose travel times are worth requesting.
+
+		Params:
+			gdf : GeoDataFrame - a discretization with 'center_lat' and 'center_lon' columns (and 'h3_index' for hexagons)
+			k : int - for hexagons, the k_ring distance. For other shapes, the number of nearest centers (each cell included)
+			radius_m : float - keep only pairs whose centers are at most radius_m meters apart (great circle). Can be combined with k
+		Return:
+			(numpy.ndarray, numpy.ndarray) - sorted, unique (sources, targets) row positions. Pairs are symmetric for hexagons and radii,
+				not necessarily for k nearest neighbors
+	'''
+	if k is None and radius_m is None:
+		raise ValueError("Either k or radius_m must be given")
+	lon, lat = _centers(gdf)
+	if len(gdf) == 0:
+		return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+	if 'h3_index' in gdf.columns:
+		h3_indexes = gdf['h3_index'].tolist()
+		rings = k if k is not None else _h3_rings_for_radius(h3_indexes, radius_m)
+		if k is not None and radius_m is not None:
+			rings = min(k, _h3_rings_for_radius(h3_indexes, radius_m))
+		sources, targets = _h3_candidates(h3_indexes, rings)
+	else:
+		sources, targets = _kdtree_candidates(lon, lat, k, radius_m)
+	if radius_m is not None:
+		close = haversine_m(lon[sources], lat[sources], lon[targets], lat[targets]) <= radius_m
+		sources, targets = sources[close], targets[close]
+	keys = np.unique(sources.astype(np.int64) * len(gdf) + targets)
+	return keys // len(gdf), keys % len(gdf)
+
+def _spatial_order(lon, lat):
+	'''
+		Positions sorted along a Z-order (Morton) curve of the centers, so consecutive positions are spatially close
+	'''
+	def spread(v):
+		v = v.astype(np.uint64)
+		for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333), (1, 0x5555555555555555)):
+			v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+		return v
+
+	def quantize(v):
+		span = v.max() - v.min()
+		return np.zeros(len(v)) if span == 0 else (v - v.min()) / span * 0xFFFF
+
+	return np.argsort(spread(quantize(lon)) | (spread(quantize(lat)) << np.uint64(1)), kind='stable')
+
+def plan_sparse_requests(sources, targets, order, c_size : int):
+	'''
+		Batch candidate pairs into rectangular requests of at most c_size x c_size.
+
+		Origins are taken c_size at a time in spatial order, and each group asks for the union of their candidate destinations (also in spatial order).
+
+		Params:
+			sources, targets : numpy.ndarray - candidate pairs
+			order : numpy.ndarray - spatial order of the positions (see _spatial_order)
+			c_size : int - maximum number of origins and of destinations per request
+		Return:
+			list of (rows, cols) index arrays
+	'''
+	n = len(order)
+	rank = np.empty(n, dtype=np.int64)
+	rank[order] = np.arange(n)
+	#pairs sorted by the spatial rank of their origin, then of their destination
+	pair_order = np.lexsort((rank[targets], rank[sources]))
+	sources, targets = sources[pair_order], targets[pair_order]
+	group = rank[sources] // c_size
+	bounds = np.flatnonzero(np.diff(group)) + 1
+	blocks = []
+	for group_sources, group_targets in zip(np.split(sources, bounds), np.split(targets, bounds)):
+		if len(group_sources) == 0:
+			continue
+		rows = np.unique(group_sources)
+		cols = np.unique(group_targets)
+		cols = cols[np.argsort(rank[cols], kind='stable')]
+		for c_start in range(0, len(cols), c_size):
+			blocks.append((rows, np.sort(cols[c_start:c_start + c_size])))
+	return blocks
+
+def sparse_distance_matrix_from_gdf(gdf : GeoDataFrame, *, k : int = None, radius_m : float = None, client = None, wait_time = True, cache = None, c_size : int = 39):
+	'''
+		Travel times between nearby cells only, as a scipy.sparse matrix.
+
+		Params:
+			gdf : GeoDataFrame - a discretization with 'center_lat' and 'center_lon' columns (and 'h3_index' for hexagons)
+			k, radius_m - which pairs to request, see candidate_pairs
+			client - client used for the requests (anything with a matrices(blocks) method, e.g. a GraphHopperClient). Defaults to a
+				GraphHopperClient, throttled to one request per minute if wait_time is True
+			cache : (TravelTimeCache, str) - persistent pairwise cache (or the path of its database). Candidate pairs found there are not requested,
+				and the fetched blocks are stored back
+			c_size : int - maximum number of origins and of destinations per request
+		Return:
+			scipy.sparse.csr_matrix - [i,j] is the travel time (seconds) from i to j. Exactly the candidate pairs are stored (zeros included);
+				unreachable pairs are stored as NaN and pairs that are not stored were not requested
+	'''
+	from scipy.sparse import csr_matrix
+	from .graphhopper import GraphHopperClient
+	from .pair_cache import as_travel_time_cache
+
+	n = len(gdf)
+	lon, lat = _centers(gdf)
+	coords = np.column_stack([lon, lat]).tolist()
+	sources, targets = candidate_pairs(gdf, k=k, radius_m=radius_m)
+
+	own_client = client is None
+	if own_client:
+		client = GraphHopperClient(requests_per_minute = 1 if wait_time else None)
+	rows_found, cols_found, values = [], [], []
+	try:
+		if cache is not None:
+			cache = as_travel_time_cache(cache)
+			cached, found = cache.lookup_pairs([coords[a] for a in sources], [coords[b] for b in targets], "graphhopper", client.vehicle)
+			rows_found.append(sources[found])
+			cols_found.append(targets[found])
+			values.append(cached[found])
+			sources, targets = sources[~found], targets[~found]
+
+		blocks = plan_sparse_requests(sources, targets, _spatial_order(lon, lat), c_size)
+		block_coords = [([coords[a] for a in rows], [coords[b] for b in cols]) for rows, cols in blocks]
+		candidate_keys = sources * n + targets #sorted, see candidate_pairs
+		for (rows, cols), (from_, to_), result in zip(blocks, block_coords, client.matrices(block_coords)):
+			result = np.array(result, dtype=float) #unreachable pairs (null) become nan
+			if cache is not None:
+				cache.store(from_, to_, result, "graphhopper", client.vehicle)
+			block_rows, block_cols = np.repeat(rows, len(cols)), np.tile(cols, len(rows))
+			#requests are rectangles, keep only their candidate pairs
+			keys = block_rows * n + block_cols
+			position = np.minimum(np.searchsorted(candidate_keys, keys), len(candidate_keys) - 1)
+			wanted = candidate_keys[position] == keys
+			rows_found.append(block_rows[wanted])
+			cols_found.append(block_cols[wanted])
+			values.append(result.ravel()[wanted])
+	finally:
+		if own_client:
+			client.close()
+
+	if not values:
+		return csr_matrix((n, n))
+	return csr_matrix((np.concatenate(values), (np.concatenate(rows_found), np.concatenate(cols_found))), shape=(n, n))
@@ -16,12 +16,288 @@ grupo_dias_dict = {
         }
     }
 
+# - Esquema dos eventos processados (tipos compactos de cada coluna; colunas ausentes são ignoradas)
+ESQUEMA_EVENTOS = {
+    'latitude':'float32','longitude':'float32','lat':'float32','lon':'float32','area':'float32',
+    't':'int16','g':'int8','p':'int8','i':'int16','discr_x':'int16','discr_y':'int16',
+    'nome_bairro':'category','geo_discr':'category',
+}
+# colunas (e tipos) de partição dos eventos processados em parquet
+ESQUEMA_PARTICOES = {'ano':'int16','mes':'int8'}
+PARTICOES_EVENTOS = list(ESQUEMA_PARTICOES)
+
+def compactar_eventos(df):
+    '''
+    Converte as colunas de eventos processados para os tipos compactos de ESQUEMA_EVENTOS.
+    Colunas inteiras com valores faltantes usam o tipo inteiro com suporte a nulos do pandas (ex: Int8)
+
+    Parâmetros
+    ----------
+    df : {pandas.DataFrame}
+        eventos processados (ex: saída de preprocess.py)
+    '''
+    tipos = {}
+    for col, tipo in ESQUEMA_EVENTOS.items():
+        if col in df.columns:
+            tipos[col] = tipo.capitalize() if tipo.startswith('int') and df[col].isna().any() else tipo
+    return df.astype(tipos)
+
+def escrever_eventos(df,caminho):
+    '''
+    Escreve os eventos processados em parquet, no esquema compacto, particionados por ano e mês da data
+    (um diretório caminho/ano=AAAA/mes=M por partição). Partições já existentes com dados em df são substituídas.
+    A coluna geometry, se existir, não é escrita: os pontos são reconstruídos por gpd.points_from_xy(df['lat'],df['lon'])
+
+    Parâmetros
+    ----------
+    df : {pandas.DataFrame}
+        eventos processados, com a coluna 'data' com formato de datetime
+    caminho : {str}
+        diretório de saída
+    '''
+    EscritorEventos(caminho).escrever(df)
+
+class EscritorEventos:
+    '''
+    Escreve eventos processados bloco a bloco (ex: leitura por partes), no formato de escrever_eventos.
+    A primeira escrita em cada partição substitui os dados já existentes nela; as seguintes são acrescentadas como novos arquivos
+
+    Parâmetros
+    ----------
+    caminho : {str}
+        diretório de saída
+    '''
+    def __init__(self,caminho):
+        self.caminho = caminho
+        self.particoes = set()
+
+    def escrever(self,df):
+        '''
+        Escreve um bloco de eventos processados, com a coluna 'data' com formato de datetime
+        '''
+        df = compactar_eventos(pd.DataFrame(df.drop(columns='geometry',errors='ignore')))
+        df['ano'] = df['data'].dt.year.astype(ESQUEMA_PARTICOES['ano'])
+        df['mes'] = df['data'].dt.month.astype(ESQUEMA_PARTICOES['mes'])
+        particoes = pd.MultiIndex.from_arrays([df['ano'],df['mes']])
+        novas = ~particoes.isin(list(self.particoes))
+        # partições já escritas por este escritor recebem novos arquivos (nomes únicos), em vez de serem substituídas
+        for parte, comportamento in ((df[novas],'delete_matching'),(df[~novas],'overwrite_or_ignore')):
+            if len(parte):
+                parte.to_parquet(self.caminho,partition_cols=PARTICOES_EVENTOS,existing_data_behavior=comportamento)
+        self.particoes.update(particoes.unique())
+
+def ler_eventos(caminho,colunas=None,filtros=None):
+    '''
+    Lê os eventos processados escritos por escrever_eventos, apenas com as colunas e partições necessárias
+
+    Parâmetros
+    ----------
+    caminho : {str}
+        diretório dos eventos
+    colunas : {list}
+        colunas lidas. None => todas
+    filtros : {list}
+        filtros de partição no formato do pyarrow, ex: [('ano','=',2020),('mes','in',[1,2,3])]. None => todas as partições
+    '''
+    df = pd.read_parquet(caminho,columns=colunas,filters=filtros)
+    for col in PARTICOES_EVENTOS:
+        if col in df.columns:
+            df[col] = df[col].astype(ESQUEMA_PARTICOES[col])
+    return df
+
+class CuboContagens:
+    '''
+    Contagens de chamadas por (t, g, i, p, data), calculadas em uma única passada sobre os eventos.
+    A distribuição de qualquer combinação (t, g, i, p) é então uma fatia do cubo, sem filtrar os eventos novamente.
+
+    As contagens são guardadas em uma matriz esparsa (scipy.sparse.csr_matrix), com uma linha por combinação
+    (t, g, i, p) e uma coluna por dia entre a primeira e a última data de df.
+
+    Parâmetros
+    ----------
+    df : {pandas.DataFrame}
+        Dataframe com chamadas. Deve possuir a coluna 'data' com formato de datetime e a coluna 'hora'
+        (são contadas as chamadas com 'hora' preenchida).
+    cols: {str's}
+        Nome das colunas em df com os valores de t, g, i e p
+    col_contagem : {str}
+        Se informado, df já contém contagens agregadas (ex: ArmazemContagens.contagens()), uma linha por
+        (t, g, i, p, data) com o número de chamadas nesta coluna, em vez de uma linha por chamada.
+    '''
+    def __init__(self,df,col1='t',col2='g',col3='i',col4='p',col_contagem=None):
+        from scipy.sparse import csr_matrix
+
+        # valores distintos de cada dimensão, e o código de cada evento em cada dimensão
+        codigos, self.valores = [], []
+        for col in (col1,col2,col3,col4):
+            cod, val = pd.factorize(df[col],sort=True)
+            codigos.append(cod)
+            self.valores.append(pd.Index(val))
+        self.forma = tuple(len(val) for val in self.valores)
+
+        # todos os dias entre a primeira e a última data
+        # (nenhuma data em um df vazio, ex: armazém de contagens recém criado)
+        if df['data'].notna().any():
+            self.datas = pd.date_range(df['data'].min(),df['data'].max(),freq='D')
+        else:
+            self.datas = pd.DatetimeIndex([])
+        dia = (df['data'] - df['data'].min()).dt.days.to_numpy()
+
+        # contagem: uma única passada sobre os eventos. Eventos sem 'hora' não são contados, mas sua data é mantida na
+        # matriz (com contagem zero explícita), como no groupby('data')['hora'].count() de calcular_distribuicao
+        validos = df['data'].notna().to_numpy() & np.all([cod >= 0 for cod in codigos],axis=0)
+        linha = np.ravel_multi_index([cod[validos] for cod in codigos],self.forma)
+        pesos = df['hora'].notna() if col_contagem is None else df[col_contagem]
+        self.matriz = csr_matrix(
+            (pesos.to_numpy()[validos].astype(np.int64),(linha,dia[validos].astype(np.int64))),
+            shape=(int(np.prod(self.forma)),len(self.datas))
+        )
+
+    def _linha(self,t,g,i,p):
+        # linha da combinação (t, g, i, p) na matriz de contagens, -1 se algum valor não ocorre nos eventos
+        posicoes = [val.get_indexer([v])[0] for val,v in zip(self.valores,(t,g,i,p))]
+        if min(posicoes) < 0:
+            return -1
+        return np.ravel_multi_index(posicoes,self.forma)
+
+    def distribuicao(self,t,g,i,p,tipo_discretizacao_temp=0,dt_range=None):
+        '''
+        Distribuição de número de chamadas por data para um conjunto de filtros (mesmo resultado de calcular_distribuicao)
+
+        Parâmetros
+        ----------
+        t, g, i, p : {int}
+            Período de tempo do dia, grupo de dias, grupo geográfico e prioridade.
+        tipo_discretizacao_temp : {int}
+            Tipo de agrupamento de dias usado em g (ver grupo_dias_dict).
+        dt_range : {pandas.DatetimeIndex}
+            Datas consideradas. As datas do grupo g sem chamadas têm contagem zero. None => todas as datas do cubo
+        '''
+        linha = self._linha(t,g,i,p)
+        if linha < 0:
+            datas = pd.Series(np.zeros(0,dtype=np.int64),index=pd.DatetimeIndex([]))
+        else:
+            inicio, fim = self.matriz.indptr[linha], self.matriz.indptr[linha+1]
+            datas = pd.Series(self.matriz.data[inicio:fim],index=self.datas[self.matriz.indices[inicio:fim]])
+
+        # adicionar datas sem chamadas (com zero)
+        if dt_range is None:
+            dt_range = self.datas
+        dt_range = pd.DatetimeIndex(dt_range)
+        grupos = np.array([grupo_dias_dict[tipo_discretizacao_temp][wd] for wd in range(7)])
+        datas_grupo = dt_range[grupos[dt_range.weekday] == g]
+
+        return datas.reindex(datas.index.union(datas_grupo),fill_value=0).values
+
+    def denso(self):
+        '''
+        Cubo de contagens denso, um numpy.ndarray indexado por (t, g, i, p, data) segundo as posições em valores e datas.
+        Atenção: ocupa (número de combinações) x (número de dias) inteiros
+        '''
+        return self.matriz.toarray().reshape(self.forma+(len(self.datas),))
+
+class ArmazemContagens:
+    '''
+    Armazenamento persistente das contagens de chamadas por (t, g, i, p, data), atualizado incrementalmente.
+
+    As contagens ficam em um diretório, em um arquivo por mês (AAAA-MM.pkl). Ingerir um novo lote de eventos
+    lê e reescreve apenas os meses das datas do lote, sem reprocessar o histórico.
+    Os valores de t, g e i devem ser calculados da mesma forma em todos os lotes
+    (ex: discretização por divisas, e temp_discretizar com janelas contadas a partir das zero horas).
+
+    Parâmetros
+    ----------
+    diretorio : {str}
+        Diretório das contagens. É criado se não existir.
+    cols: {str's}
+        Nome das colunas dos eventos com os valores de t, g, i e p
+    '''
+    def __init__(self,diretorio,col1='t',col2='g',col3='i',col4='p'):
+        self.diretorio = diretorio
+        self.colunas = [col1,col2,col3,col4]
+        os.makedirs(diretorio,exist_ok=True)
+
+    def _arquivo(self,mes):
+        return os.path.join(self.diretorio,'{}.pkl'.format(mes))
+
+    def meses(self):
+        '''
+        Meses (pandas.Period) com contagens armazenadas, em ordem
+        '''
+        return sorted(pd.Period(nome[:-len('.pkl')],freq='M') for nome in os.listdir(self.diretorio) if nome.endswith('.pkl'))
+
+    def _ler(self,mes):
+        arquivo = self._arquivo(mes)
+        if os.path.exists(arquivo):
+            return pd.read_pickle(arquivo)
+        # mês sem contagens: colunas vazias com os tipos das contagens armazenadas
+        vazio = {col:pd.Series(dtype='int64') for col in self.colunas}
+        vazio['data'] = pd.Series(dtype='datetime64[ns]')
+        vazio['contagem'] = pd.Series(dtype='int64')
+        return pd.DataFrame(vazio)
+
+    def _escrever(self,mes,contagens):
+        # escrita atômica: um mês nunca fica parcialmente escrito se o processo for interrompido
+        arquivo = self._arquivo(mes)
+        contagens.to_pickle(arquivo+'.tmp')
+        os.replace(arquivo+'.tmp',arquivo)
+
+    def ingerir(self,df,substituir=False):
+        '''
+        Adiciona as chamadas de um lote de eventos às contagens armazenadas
+
+        Parâmetros
+        ----------
+        df : {pandas.DataFrame}
+            Eventos do lote, com as colunas de t, g, i, p, 'data' (datetime) e 'hora'.
+        substituir : {bool}
+            False => as chamadas do lote são somadas às já armazenadas (lotes com eventos distintos)
+            True  => as contagens das datas presentes no lote são substituídas pelas do lote (reprocessamento de dias)
+
+        Retorna
+        -------
+        Lista dos meses (pandas.Period) atualizados
+        '''
+        # contagens do lote, uma linha por (t, g, i, p, data). Combinações sem 'hora' são mantidas com contagem zero
+        lote = df.groupby(self.colunas+['data'])['hora'].count().rename('contagem').reset_index()
+        meses = lote['data'].dt.to_period('M')
+
+        atualizados = []
+        for mes, novas in lote.groupby(meses):
+            contagens = self._ler(mes)
+            if substituir:
+                contagens = contagens[~contagens['data'].isin(novas['data'])]
+            contagens = pd.concat([contagens,novas]) if len(contagens) else novas
+            contagens = contagens.groupby(self.colunas+['data'])['contagem'].sum().reset_index()
+            self._escrever(mes,contagens)
+            atualizados.append(mes)
+        return atualizados
+
+    def contagens(self,meses=None):
+        '''
+        Contagens armazenadas (todas, ou apenas as dos meses informados), uma linha por (t, g, i, p, data)
+        '''
+        meses = self.meses() if meses is None else meses
+        partes = [self._ler(mes) for mes in meses]
+        if not partes:
+            return self._ler(None)
+        return pd.concat(partes,ignore_index=True)
+
+    def cubo(self,meses=None):
+        '''
+        CuboContagens das contagens armazenadas (todas, ou apenas as dos meses informados).
+        Em um armazém vazio, o cubo não tem combinações nem datas, e todas as distribuições são vazias
+        '''
+        col1, col2, col3, col4 = self.colunas
+        return CuboContagens(self.contagens(meses),col1=col1,col2=col2,col3=col3,col4=col4,col_contagem='contagem')
+
 def calcular_distribuicao(df,t,g,i,p,
                         tipo_discretizacao_temp=0,col1='t',
                         col2='g',col3='i',col4='p',
                         dt_range=None):
     '''
-    Calcula a distribuição de número de chamadas para um conjunto de filtros
+    Calcula a distribuição de número de chamadas para um conjunto de filtros.
+    Para várias distribuições dos mesmos eventos, construa um CuboContagens uma única vez e use CuboContagens.distribuicao
 
     Parâmetros
     ----------
@@ -39,28 +315,5 @@ def calcular_distribuicao(df,t,g,i,p,
     cols: {str's}
         Nome das colunas em df para match dos valores
     '''
-    filtro = df.copy()
-    # aplicar filtros
-    filtro = filtro[
-        (filtro[col1]==t) &
-        (filtro[col2]==g) &
-        (filtro[col3]==i) &
-        (filtro[col4]==p)
-    ]
-    
-    # pegar datas com chamadas
-    datas = filtro.groupby('data')['hora'].count()
-    
-    # adicionar datas sem chamadas (com zero)
-    if dt_range is None:
-        dt_range = pd.date_range(df['data'].min(),df['data'].max(),freq='D')
-        
-    for dt in dt_range:
-        # se a data passa no filtro de grupo
-        if grupo_dias_dict[tipo_discretizacao_temp][dt.weekday()] == g:
-            if not(dt in datas.index):
-                datas[dt] = 0
-
-    datas.sort_index(inplace=True)
-
-    return datas.values
\ No newline at end of file
+    cubo = CuboContagens(df,col1=col1,col2=col2,col3=col3,col4=col4)
+    return cubo.distribuicao(t,g,i,p,tipo_discretizacao_temp=tipo_discretizacao_temp,dt_range=dt_range)
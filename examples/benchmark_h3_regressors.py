@@ -0,0 +1,61 @@
+'''
+Benchmark: polygon overlay vs H3-native regressor aggregation (add_regressors method = 'h3').
+
+Usage:
+    python examples/benchmark_h3_regressors.py [resolution] [n_regressors]
+
+A synthetic region around Rio de Janeiro is discretized at the given H3 resolution, and a land-use like regressor layer
+(a Voronoi partition of the region, densified to many vertices per polygon) is applied with both methods.
+For every sub-resolution, the script prints the time taken and the error of the H3 method relative to the exact overlay.
+'''
+import os
+import sys
+import time
+import warnings
+
+import geopandas
+import numpy as np
+import shapely
+from shapely.geometry import Point
+
+#as the example notebook does, import the package from the repository root (the parent of this directory)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from DiscretizationBox import generate_H3_discretization, addRegressorWeightedAverage, addRegressorUniformDistribution
+
+def main():
+    resolution = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    n_regressors = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    region = Point(-43.4, -22.9).buffer(0.25).simplify(0.005)
+    gdf = geopandas.GeoDataFrame({'name' : ['region']}, geometry = [region], crs = "EPSG:4326")
+
+    #land use like layer: a partition of the region in irregular polygons with many vertices
+    rng = np.random.default_rng(0)
+    minx, miny, maxx, maxy = region.bounds
+    points = shapely.points(rng.uniform(minx, maxx, n_regressors), rng.uniform(miny, maxy, n_regressors))
+    cells = shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(points)))
+    cells = shapely.segmentize(shapely.intersection(cells, region), 0.0005)
+    regressors = geopandas.GeoDataFrame({'population' : rng.uniform(0, 1000, len(cells))}, geometry = cells, crs = "EPSG:4326")
+
+    warnings.simplefilter('ignore')
+    hexagons = generate_H3_discretization(gdf, resolution)
+    print('resolution {}: {} cells, {} regressor polygons ({} vertices)'.format(resolution, len(hexagons), len(regressors), shapely.get_num_coordinates(cells).sum()))
+
+    for function in (addRegressorWeightedAverage, addRegressorUniformDistribution):
+        start = time.perf_counter()
+        exact = function(hexagons, regressors.copy(), regressor_columns = ['population'])['population'].to_numpy()
+        overlay_time = time.perf_counter() - start
+        print('{}: overlay {:.2f}s'.format(function.__name__, overlay_time))
+
+        for sub_resolution in range(resolution + 1, min(resolution + 4, 16)):
+            start = time.perf_counter()
+            approx = function(hexagons, regressors.copy(), regressor_columns = ['population'], method = 'h3', sub_resolution = sub_resolution)['population'].to_numpy()
+            h3_time = time.perf_counter() - start
+            both = ~np.isnan(exact) & ~np.isnan(approx)
+            relative_error = np.abs(approx[both] - exact[both]).sum() / np.abs(exact[both]).sum()
+            print('    sub_resolution {:2d}: {:.2f}s ({:.1f}x), relative L1 error {:.2%}, max cell error {:.2f}'.format(
+                sub_resolution, h3_time, overlay_time / h3_time, relative_error, np.abs(approx[both] - exact[both]).max()))
+
+if __name__ == '__main__':
+    main()
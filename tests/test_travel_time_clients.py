@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from DiscretizationBox.travel_times.client import TokenBucket
+from DiscretizationBox.travel_times import googlemaps
+from DiscretizationBox.travel_times.graphhopper import GraphHopperClient, gen_distance_matrix
+from DiscretizationBox.travel_times.mock_server import MockMatrixServer, _haversine_seconds
+
+'''
+Offline tests of the travel time clients against MockMatrixServer: retries on rate limited answers, rate limit accounting
+and placement of the requested blocks in the matrix
+'''
+
+#more points than a GraphHopper chunk (39), so the matrix is split into several blocks. 6 decimals, as sent to Google Maps
+COORDS = [[round(-43.3 + 0.011 * i, 6), round(-22.95 + 0.007 * (i % 13), 6)] for i in range(100)]
+
+def expected_matrix(coords, speed_kmh = 40.0):
+    return np.array([[round(_haversine_seconds(f[0], f[1], t[0], t[1], speed_kmh)) for t in coords] for f in coords], dtype=float)
+
+def frozen_limiter(limiter, requests = 10 ** 6, credits = 10 ** 9):
+    '''
+        Replace the buckets of a RateLimiter by never refilled ones, so the tokens taken can be counted exactly
+    '''
+    limiter.requests = TokenBucket(requests, clock = lambda: 0.0)
+    limiter.credits = TokenBucket(credits, clock = lambda: 0.0)
+    return limiter
+
+@pytest.fixture
+def server():
+    with MockMatrixServer(fail_every = 3) as server:
+        yield server
+
+def graphhopper_client(server, **kwargs):
+    kwargs.setdefault('backoff', 0.001)
+    return GraphHopperClient('test key', base_url = server.url + '/matrix', n_workers = 1, **kwargs)
+
+def test_graphhopper_retries_rate_limited_requests(server):
+    with graphhopper_client(server) as client:
+        times = gen_distance_matrix(COORDS, client = client)
+    #3 x 3 blocks of at most 39 x 39, every third request answered with 429 and retried
+    assert server.requests == 13
+    np.testing.assert_array_equal(times, expected_matrix(COORDS))
+
+def test_graphhopper_gives_up_after_max_retries(server):
+    server.fail_every = 1
+    with graphhopper_client(server, max_retries = 2) as client:
+        with pytest.raises(AssertionError, match = '429'):
+            client.matrix(COORDS[:2], COORDS[:2])
+    assert server.requests == 3
+
+def test_graphhopper_limiter_counts_every_attempt(server):
+    with graphhopper_client(server) as client:
+        limiter = frozen_limiter(client.limiter)
+        gen_distance_matrix(COORDS, client = client)
+    assert limiter.requests.capacity - limiter.requests.tokens == server.requests
+
+    #3 requests of 10 x 10 points, the third one retried once: 4 attempts of 50 credits each
+    with graphhopper_client(server) as client:
+        limiter = frozen_limiter(client.limiter)
+        server.requests = 0
+        for _ in range(3):
+            client.matrix(COORDS[:10], COORDS[:10])
+    assert server.requests == 4
+    assert limiter.requests.capacity - limiter.requests.tokens == 4
+    assert limiter.credits.capacity - limiter.credits.tokens == 4 * GraphHopperClient.credits(10, 10)
+
+def test_graphhopper_cache_rerun_makes_no_requests(server, tmp_path):
+    cache = str(tmp_path / 'travel_times.sqlite')
+    with graphhopper_client(server) as client:
+        first = gen_distance_matrix(COORDS, client = client, cache = cache)
+        requests = server.requests
+        second = gen_distance_matrix(COORDS, client = client, cache = cache)
+    assert server.requests == requests
+    np.testing.assert_array_equal(first, expected_matrix(COORDS))
+    np.testing.assert_array_equal(second, first)
+
+def test_graphhopper_checkpoint_resume(server, tmp_path):
+    checkpoint_dir = str(tmp_path / 'job')
+    #without retries, the third request fails and interrupts the job after two blocks
+    with graphhopper_client(server, max_retries = 0) as client:
+        with pytest.raises(AssertionError):
+            gen_distance_matrix(COORDS, client = client, checkpoint_dir = checkpoint_dir)
+
+    with MockMatrixServer() as resumed_server:
+        with graphhopper_client(resumed_server) as client:
+            times = gen_distance_matrix(COORDS, client = client, checkpoint_dir = checkpoint_dir)
+        assert resumed_server.requests == 9 - 2
+    np.testing.assert_array_equal(times, expected_matrix(COORDS))
+
+def googlemaps_client(server, **kwargs):
+    return googlemaps.GoogleMapsClient('test key', base_url = server.url + '/maps/api/distancematrix/json', n_workers = 1, sleep = lambda seconds: None, **kwargs)
+
+def test_googlemaps_retries_over_query_limit(server):
+    coords = COORDS[:30]
+    with googlemaps_client(server) as client:
+        limiter = frozen_limiter(client.limiter)
+        times = googlemaps.gen_distance_matrix(coords, client = client)
+    #30 x 30 in 3 x 3 blocks of 10 x 10 (the 100 elements limit), every third request answered with OVER_QUERY_LIMIT and retried
+    assert server.requests == 13
+    assert limiter.requests.capacity - limiter.requests.tokens == server.requests
+    np.testing.assert_array_equal(times, expected_matrix(coords))
+
+def test_googlemaps_gives_up_after_max_retries(server):
+    server.fail_every = 1
+    with googlemaps_client(server, max_retries = 2) as client:
+        limiter = frozen_limiter(client.limiter)
+        with pytest.raises(AssertionError, match = 'OVER_QUERY_LIMIT'):
+            client.matrix(COORDS[:5], COORDS[:5])
+    assert server.requests == 3
+    #every attempt takes the elements of the request
+    assert limiter.credits.capacity - limiter.credits.tokens == 3 * 25